@@ -0,0 +1,68 @@
+import numpy
+from pyalgotrade import bar
+from pyalgotrade.barfeed import membf
+
+"""
+    PyAlgo的内存数据源：直接由numpy数组或DataFrame（PyAlgo格式的Date、Open、High、Low、Close、Volume、Adj Close列，
+    或者PriceStore.getColumns的结果）构造K线，日期一次性向量化转换，不再由yahoofeed逐行解析csv和日期字符串。
+    得到的K线与yahoofeed.Feed().addBarsFromCSV完全相同（日频、无时区、当天0点），策略不需要任何修改。
+    barsFromArrays构造的K线列表可以重复交给多个数据源，参数扫描、滚动窗口等多次回测时只需要构造一次。
+    @Author: zengshuang61@gmail.com
+"""
+
+
+def barsFromArrays(dates, open, high, low, close, volume, adj_close=None, frequency=bar.Frequency.DAY):
+    """
+        由各列数组构造K线列表
+    :param dates: 日期，datetime64或'2019-10-31'格式的字符串
+    :param open: 开盘价
+    :param high: 最高价
+    :param low: 最低价
+    :param close: 收盘价
+    :param volume: 成交量
+    :param adj_close: 复权收盘价，默认为None
+    :param frequency: K线周期
+    :return: [bar.BasicBar]
+    """
+    date_times = numpy.asarray(dates, dtype='M8[D]').astype('M8[us]').tolist()
+    columns = [numpy.asarray(values, dtype=numpy.float64).tolist() for values in (open, high, low, close, volume)]
+    adj = [None] * len(date_times) if adj_close is None else numpy.asarray(adj_close, dtype=numpy.float64).tolist()
+    return [bar.BasicBar(*values, frequency) for values in zip(date_times, *columns, adj)]
+
+
+def barsFromFrame(df, frequency=bar.Frequency.DAY):
+    """
+        由PyAlgo格式的DataFrame（或列名相同的dict）构造K线列表
+    :param df: Stock.getPriceData的结果
+    :param frequency: K线周期
+    :return: [bar.BasicBar]
+    """
+    adj_close = df['Adj Close'] if 'Adj Close' in df else None
+    return barsFromArrays(df['Date'], df['Open'], df['High'], df['Low'], df['Close'], df['Volume'], adj_close,
+                          frequency)
+
+
+class ArrayBarFeed(membf.BarFeed):
+    def __init__(self, frequency=bar.Frequency.DAY, maxLen=None):
+        super(ArrayBarFeed, self).__init__(frequency, maxLen)
+        self.__adjClose = True
+
+    def barsHaveAdjClose(self):
+        return self.__adjClose
+
+    def addBars(self, instrument, bars):
+        """
+            加入已经构造好的K线
+        :param instrument: 股票代码
+        :param bars: barsFromArrays或barsFromFrame的结果
+        :return:
+        """
+        if bars and bars[0].getAdjClose() is None:
+            self.__adjClose = False
+        self.addBarsFromSequence(instrument, bars)
+
+    def addBarsFromArrays(self, instrument, dates, open, high, low, close, volume, adj_close=None):
+        self.addBars(instrument, barsFromArrays(dates, open, high, low, close, volume, adj_close, self.getFrequency()))
+
+    def addBarsFromFrame(self, instrument, df):
+        self.addBars(instrument, barsFromFrame(df, self.getFrequency()))
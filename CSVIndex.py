@@ -0,0 +1,127 @@
+import io
+import os
+
+import numpy
+import pandas
+
+"""
+    股价csv的日期索引：为每个<code>.csv生成一个旁路索引文件<code>.csv.idx.npz，记录每一行的日期和它在文件中的字节偏移，
+    以及生成索引时csv的(大小, 修改时间ns)，两者与当前的csv完全相同时才认为索引有效。
+    按时间区间读取时先在索引上二分查找出行区间，再只读取这一段字节交给pandas解析，不需要读取整个文件再筛选。
+    tushare的历史数据是按日期降序保存的，PyAlgo的数据是升序的，两种顺序都支持。
+    @Author: zengshuang61@gmail.com
+"""
+
+INDEX_DTYPE = [('date', 'M8[D]'), ('offset', '<i8')]
+
+
+def indexPath(csv_path):
+    return csv_path + '.idx.npz'
+
+
+def sourceStamp(csv_path):
+    """
+        csv的(大小, 修改时间ns)，与StockUniverse的缓存一样用来判断索引是否过期
+    :param csv_path: csv文件
+    :return:
+    """
+    stat = os.stat(csv_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def buildCSVIndex(csv_path):
+    """
+        扫描一遍csv生成索引，最后一条记录的offset为文件末尾，日期为NaT
+    :param csv_path: csv文件
+    :return: 索引数组
+    """
+    # 扫描之前记录，扫描期间csv被改写时下次读取会重新生成
+    stamp = sourceStamp(csv_path)
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        columns = [name.strip() for name in header.decode('utf-8').split(',')]
+        date_index = columns.index('date') if 'date' in columns else columns.index('Date')
+        dates = []
+        offsets = []
+        offset = len(header)
+        for line in f:
+            if line.strip():
+                dates.append(line.split(b',', date_index + 1)[date_index].decode())
+                offsets.append(offset)
+            offset += len(line)
+    index = numpy.zeros(len(dates) + 1, dtype=INDEX_DTYPE)
+    index['date'][:-1] = numpy.asarray(dates, dtype='M8[D]')
+    index['date'][-1] = numpy.datetime64('NaT')
+    index['offset'][:-1] = offsets
+    index['offset'][-1] = offset
+    path = indexPath(csv_path)
+    with open(path + '.tmp', 'wb') as f:
+        numpy.savez(f, index=index, source=numpy.asarray(stamp, dtype=numpy.int64))
+    os.replace(path + '.tmp', path)
+    return index
+
+
+def loadCSVIndex(csv_path):
+    """
+        读取索引，索引不存在或记录的csv大小、修改时间与当前不同时重新生成。
+        比较的是相等而不是先后，csv在文件系统的时间精度内被改写（例如刚生成索引就被updateSharePrice追加）也能发现
+    :param csv_path: csv文件
+    :return:
+    """
+    path = indexPath(csv_path)
+    if os.path.exists(path):
+        try:
+            with numpy.load(path, allow_pickle=False) as data:
+                if tuple(data['source'].tolist()) == sourceStamp(csv_path):
+                    return data['index']
+        except (OSError, ValueError, KeyError):
+            pass
+    return buildCSVIndex(csv_path)
+
+
+def searchRange(dates, startTime=None, endTime=None):
+    """
+        在升序的日期数组上二分查找[startTime, endTime]对应的行区间[lo, hi)
+    :param dates: 升序的datetime64[D]数组
+    :param startTime: 开始时间，None表示不限
+    :param endTime: 结束时间（包含），None表示不限
+    :return:
+    """
+    lo = 0 if startTime is None else int(numpy.searchsorted(dates, numpy.datetime64(startTime, 'D'), 'left'))
+    hi = len(dates) if endTime is None else int(numpy.searchsorted(dates, numpy.datetime64(endTime, 'D'), 'right'))
+    return lo, max(lo, hi)
+
+
+def readCSVRange(csv_path, startTime=None, endTime=None):
+    """
+        只读取csv中日期位于[startTime, endTime]之间的行，行的顺序与文件中一致
+    :param csv_path: csv文件
+    :param startTime: 开始时间，例如'2018-01-01'
+    :param endTime: 结束时间
+    :return: DataFrame
+    """
+    index = loadCSVIndex(csv_path)
+    dates = index['date'][:-1]
+    count = len(dates)
+    if numpy.all(dates[1:] >= dates[:-1]):
+        lo, hi = searchRange(dates, startTime, endTime)
+    elif numpy.all(dates[1:] <= dates[:-1]):
+        # 降序文件：在反转后的视图上查找，再换算回文件中的行号
+        lo, hi = searchRange(dates[::-1], startTime, endTime)
+        lo, hi = count - hi, count - lo
+    else:
+        # 日期无序时无法二分，退回到读取整个文件再筛选
+        df = pandas.read_csv(csv_path)
+        date_column = 'date' if 'date' in df.columns else 'Date'
+        mask = pandas.Series(True, index=df.index)
+        if startTime is not None:
+            mask &= df[date_column] >= startTime
+        if endTime is not None:
+            mask &= df[date_column] <= endTime
+        return df[mask]
+
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        f.seek(index['offset'][lo])
+        chunk = f.read(index['offset'][hi] - index['offset'][lo])
+    return pandas.read_csv(io.BytesIO(header + chunk))
@@ -1,19 +1,24 @@
 import collections
+import multiprocessing
 
 import pandas as pd
+from matplotlib import pyplot
 from pyalgotrade import plotter
 from pyalgotrade import strategy
 from pyalgotrade import technical
-from pyalgotrade.barfeed import yahoofeed
 from pyalgotrade.broker import backtesting
 from pyalgotrade.stratanalyzer import drawdown
 from pyalgotrade.stratanalyzer import returns
 from pyalgotrade.stratanalyzer import sharpe
 from pyalgotrade.stratanalyzer import trades
 
+from ArrayBarFeed import ArrayBarFeed
+from Metrics import metrics
+from PriceView import openPyAlgoStore, readPyAlgoCSV
+from RollingExtrema import RollingRange
 from Stock import *
-from preprocess import getStockCodeAndName
-from process import stockCode2NameAndIndustry
+from StockUniverse import loadUniverse
+from process import readFilteredCodes
 from pandas.plotting import register_matplotlib_converters
 
 register_matplotlib_converters()
@@ -69,19 +74,15 @@ class DualEventWindow(CustomEventWindow):
         assert (period > 0)
         super(DualEventWindow, self).__init__(period)
         self.__value = None
+        # 用单调队列增量维护HH、LC、HC、LL，每根K线均摊O(1)，不再每次遍历整个窗口
+        self.__range = RollingRange(period)
 
     def _calculateTrueRange(self, value):
-        ret = None
-        values = self.getValues()
-        HH = max([bar.getHigh() for bar in values])
-        LC = min([bar.getClose() for bar in values])
-        HC = max([bar.getClose() for bar in values])
-        LL = min([bar.getLow() for bar in values])
-        ret = max((HH - LC), (HC - LL))
-        return ret
+        return self.__range.getValue()
 
     def onNewValue(self, dateTime, value):
         super(DualEventWindow, self).onNewValue(dateTime, value)
+        self.__range.onNewValue(value.getHigh(), value.getLow(), value.getClose())
 
         if self.windowFull():
             self.__value = self._calculateTrueRange(value)
@@ -100,7 +101,7 @@ class MyStrategy(strategy.BacktestingStrategy):
         实现Dual Thrust策略，继承自PyAlgo的回测策略基类
     """
 
-    def __init__(self, feed, instrument):
+    def __init__(self, feed, instrument, k=0.08, period=15):
         # 起始金额100万刀
         super(MyStrategy, self).__init__(feed, 1000000)
         self.__broker = self.getBroker()
@@ -110,9 +111,9 @@ class MyStrategy(strategy.BacktestingStrategy):
 
         # 如果想用修正后的收盘价，也就是股票数据csv文件中的Adj Close这一列的数据，那么需要使用这一行配置
         # self.setUseAdjustedValues(True)
-        self.__k = 0.08
+        self.__k = k
         self.__bars = feed[self.__instrument]
-        self.__dual = Dual(self.__bars)
+        self.__dual = Dual(self.__bars, period)
 
     def onEnterCanceled(self, position):
         self.__position = None
@@ -169,18 +170,113 @@ class MyStrategy(strategy.BacktestingStrategy):
                 self.__position.exitMarket()
 
 
-def runStrategy(code, csv_file, stdout=True):
+class PortfolioStrategy(strategy.BacktestingStrategy):
+    """
+        组合模式的Dual Thrust策略：所有股票共用一个数据源、一个broker和一份资金，
+        PyAlgo把各股票的K线按时间合并成一条事件流，整个回测只推进一次
+    """
+
+    def __init__(self, feed, instruments, k=0.08, period=15, cash=1000000, max_positions=10):
+        """
+        :param feed: 加入了所有股票K线的数据源
+        :param instruments: 股票代码列表，同一天多支股票同时出现买入信号时按列表顺序优先
+        :param k: 上下轨系数
+        :param period: Dual的区间窗口
+        :param cash: 起始资金
+        :param max_positions: 最多同时持有（含未成交的买单）的股票数，每支股票最多使用总权益的1/max_positions
+        """
+        super(PortfolioStrategy, self).__init__(feed, cash)
+        self.getBroker().setCommission(backtesting.TradePercentage(0.0005))
+        self.__instruments = list(instruments)
+        self.__k = k
+        self.__maxPositions = max_positions
+        self.__positions = {}
+        self.__duals = {instrument: Dual(feed[instrument], period) for instrument in self.__instruments}
+
+    def onEnterCanceled(self, position):
+        del self.__positions[position.getInstrument()]
+
+    def onEnterOk(self, position):
+        execInfo = position.getEntryOrder().getExecutionInfo()
+        self.info("BUY %s at $%.2f" % (position.getInstrument(), execInfo.getPrice()))
+
+    def onExitOk(self, position):
+        execInfo = position.getExitOrder().getExecutionInfo()
+        self.info("SELL %s at $%.2f" % (position.getInstrument(), execInfo.getPrice()))
+        del self.__positions[position.getInstrument()]
+
+    def onExitCanceled(self, position):
+        position.exitMarket()
+
+    def __reservedCash(self, bars):
+        """
+            还没有成交的买单预留的资金，避免多支股票的买单同时占用同一笔现金
+        :param bars:
+        :return:
+        """
+        reserved = 0.0
+        for instrument, position in self.__positions.items():
+            if position.entryActive():
+                bar = bars.getBar(instrument)
+                price = bar.getPrice() if bar is not None else position.getLastPrice()
+                reserved += position.getEntryOrder().getRemaining() * price * 1.0005
+        return reserved
+
+    def onBars(self, bars):
+        """
+            每个时间点依次处理当天有K线的股票：先检查持仓的卖出信号，再在资金和持仓数的限制内处理买入信号
+        :param bars:
+        :return:
+        """
+        for instrument in self.__instruments:
+            position = self.__positions.get(instrument)
+            bar = bars.getBar(instrument)
+            if position is None or bar is None or position.exitActive() or self.__duals[instrument][-1] is None:
+                continue
+            sell_line = bar.getOpen() - (self.__k * self.__duals[instrument][-1])
+            if bar.getClose() < sell_line:
+                position.exitMarket()
+
+        budget = self.getBroker().getEquity() / self.__maxPositions
+        available = self.getBroker().getCash() - self.__reservedCash(bars)
+        for instrument in self.__instruments:
+            if len(self.__positions) >= self.__maxPositions:
+                break
+            bar = bars.getBar(instrument)
+            if instrument in self.__positions or bar is None or self.__duals[instrument][-1] is None:
+                continue
+            buy_line = bar.getOpen() + (self.__k * self.__duals[instrument][-1])
+            oneUnit = min(budget, available) // (bar.getPrice() * 100)
+            if oneUnit > 0 and bar.getClose() > buy_line:
+                self.__positions[instrument] = self.enterLong(instrument, oneUnit * 100, True)
+                available -= oneUnit * 100 * bar.getPrice() * 1.0005
+
+
+def runStrategy(code, csv_file, stdout=True, k=0.08, period=15, plot=None, plot_path=None, data=None):
     """
         策略回测
     :param code:    股票代码
     :param csv_file:    文件地址
     :param stdout: 是否控制台输出
+    :param k: 上下轨系数
+    :param period: Dual的区间窗口
+    :param plot: 是否构造StrategyPlotter并登记数据序列，默认与stdout相同；批量回测时为False，不再为绘图付出代价
+    :param plot_path: 把回测图保存为文件（png、svg等，格式取扩展名），不弹出交互窗口
+    :param data: 已经读取好的股价数据（Stock.getPriceData得到的DataFrame），或ArrayBarFeed.barsFromFrame构造好的K线列表，
+                 多次回测同一支股票时可以重复使用；为None时读取csv_file
     :return:
     """
-    feed = yahoofeed.Feed()
-
-    feed.addBarsFromCSV(code, csv_file)
-    myStrategy = MyStrategy(feed, code)
+    feed = ArrayBarFeed()
+
+    with metrics.stage('feed_read', code):
+        if data is None:
+            data = pd.read_csv(csv_file)
+            metrics.count('files')
+        if isinstance(data, list):
+            feed.addBars(code, data)
+        else:
+            feed.addBarsFromFrame(code, data)
+    myStrategy = MyStrategy(feed, code, k, period)
 
     # 初始化三大分析工具：收益，回撤、交易及夏普比率（6月21日新增）
     """
@@ -198,12 +294,17 @@ def runStrategy(code, csv_file, stdout=True):
     myStrategy.attachAnalyzer(tradesAnalyzer)
     myStrategy.attachAnalyzer(sharpeRatioAnalyzer)
 
-    # 开始绘图
-    plt = plotter.StrategyPlotter(myStrategy)
-    plt.getOrCreateSubplot("returns").addDataSeries("Simple returns", returnsAnalyzer.getReturns())
+    # 开始绘图，无界面的批量模式不构造plotter
+    if plot is None:
+        plot = stdout
+    plt = None
+    if plot or plot_path:
+        plt = plotter.StrategyPlotter(myStrategy)
+        plt.getOrCreateSubplot("returns").addDataSeries("Simple returns", returnsAnalyzer.getReturns())
 
     # 运行策略进行回测
-    myStrategy.run()
+    with metrics.stage('strategy_run', code):
+        myStrategy.run()
 
     # 最终投资组合
     result = myStrategy.getResult()
@@ -237,84 +338,224 @@ def runStrategy(code, csv_file, stdout=True):
         print("交易总次数: %d次" % tradeCount)
         print("交易中盈利次数: %d次" % profitableCount)
         print("交易中亏损次数: %d次" % unprofitableCount)
+
+    if plot_path:
+        with metrics.stage('plot', code):
+            plt.savePlot(plot_path, format=os.path.splitext(plot_path)[1][1:] or 'png')
+        pyplot.close('all')
+    elif plot:
         plt.plot()
 
     return result, shareRatio, cumReturn, maxDrawdown, longestDrawDownDuration, tradeCount, profitableCount, unprofitableCount
 
 
-def AnalyzeByDualThrust(path, Index='ROE'):
+def runPortfolioStrategy(codes, csv_dir="data/share_price_processed", stdout=True, k=0.08, period=15, cash=1000000,
+                         max_positions=10):
+    """
+        组合回测：所有股票合并成一条按时间排序的事件流，共用资金，只运行一次事件循环
+    :param codes: 股票代码列表
+    :param csv_dir: PyAlgo格式的股价数据目录，没有某支股票的csv时读取data/share_price/下的数据
+    :param stdout: 是否控制台输出
+    :param k: 上下轨系数
+    :param period: Dual的区间窗口
+    :param cash: 起始资金
+    :param max_positions: 最多同时持有的股票数
+    :return: 与runStrategy相同的组合层面指标
+    """
+    feed = ArrayBarFeed()
+    with metrics.stage('feed_read'):
+        for code in codes:
+            feed.addBarsFromFrame(code, readPyAlgoCSV(code, csv_dir=csv_dir))
+    metrics.count('files', len(codes))
+    myStrategy = PortfolioStrategy(feed, codes, k, period, cash, max_positions)
+
+    returnsAnalyzer = returns.Returns()
+    drawDownAnalyzer = drawdown.DrawDown()
+    tradesAnalyzer = trades.Trades()
+    sharpeRatioAnalyzer = sharpe.SharpeRatio()
+    myStrategy.attachAnalyzer(returnsAnalyzer)
+    myStrategy.attachAnalyzer(drawDownAnalyzer)
+    myStrategy.attachAnalyzer(tradesAnalyzer)
+    myStrategy.attachAnalyzer(sharpeRatioAnalyzer)
+
+    with metrics.stage('strategy_run'):
+        myStrategy.run()
+
+    result = myStrategy.getResult()
+    shareRatio = sharpeRatioAnalyzer.getSharpeRatio(0.05)
+    cumReturn = returnsAnalyzer.getCumulativeReturns()[-1] * 100
+    maxDrawdown = drawDownAnalyzer.getMaxDrawDown() * 100
+    longestDrawDownDuration = drawDownAnalyzer.getLongestDrawDownDuration()
+    tradeCount = tradesAnalyzer.getCount()
+    profitableCount = tradesAnalyzer.getProfitableCount()
+    unprofitableCount = tradesAnalyzer.getUnprofitableCount()
+
+    if stdout:
+        print("组合最终价值: $%.2f" % result)
+        print("夏普率: %.2f" % shareRatio)
+        print("累计收益率: %.2f %%" % cumReturn)
+        print("最大回撤比例: %.2f %%" % maxDrawdown)
+        print("最长回撤周期: %s" % longestDrawDownDuration)
+        print("交易总次数: %d次" % tradeCount)
+        print("交易中盈利次数: %d次" % profitableCount)
+        print("交易中亏损次数: %d次" % unprofitableCount)
+
+    return result, shareRatio, cumReturn, maxDrawdown, longestDrawDownDuration, tradeCount, profitableCount, unprofitableCount
+
+
+# 回测结果文件的列
+RESULT_COLUMNS = ["code", "startTime", "endTime", "result", "shareRatio", "cumReturn(%)", "maxDrawdown(%)",
+                  "longestDrawDownDuration", "tradeCount", "profitableCount", "unprofitableCount"]
+
+
+def analyzeOneStock(code, name, industry, price_store=None, stdout=True, plot=False):
+    """
+        对单支股票进行Dual Thrust回测
+    :param code: 股票代码
+    :param name: 股票名称
+    :param industry: 股票所属行业
+    :param price_store: PyAlgo格式的PriceStore或PriceView
+    :param stdout: 是否控制台输出
+    :param plot: 是否绘制回测图，批量回测时不绘图，需要时由report.py单独渲染
+    :return: 结果文件中的一行，顺序与RESULT_COLUMNS一致
+    """
+    download_dir = "data/share_price_processed"
+    newStock = Stock(stock_code=code, stock_name=name, stock_industry=industry, price_store=price_store)
+    csv_file = os.path.join(download_dir, "{}.csv".format(code))
+    # 获取近7年历史数据，格式为PyAlgo要求的数据格式，可以在这里调整要获取的时间范围[startTime,endTime]
+    df = newStock.getPriceData(startTime=None, endTime=None)
+    # 也可以直接从csv文件中获取所有的历史数据（近7年内）
+    # df = pd.read_csv(csv_file)
+    startTime = df.Date.iloc[0]
+    endTime = df.Date.iloc[-1]
+    code = os.path.basename(csv_file)[:6]
+
+    # 直接使用上面读取的数据构造PyAlgo的数据源，不再重新解析csv
+    result, shareRatio, cumReturn, maxDrawdown, longestDrawDownDuration, tradeCount, profitableCount, unprofitableCount = runStrategy(
+        code, csv_file, stdout=stdout, plot=plot, data=df)
+    return [code, startTime, endTime, result, shareRatio, cumReturn, maxDrawdown,
+            str(longestDrawDownDuration).split('\t')[0], tradeCount, profitableCount, unprofitableCount]
+
+
+# 每个子进程各自打开一次PriceStore，memmap不在进程间传递
+_worker_price_store = None
+
+
+def _initWorker():
+    global _worker_price_store
+    _worker_price_store = openPyAlgoStore()
+
+
+def _analyzeInWorker(task):
+    """
+        子进程中执行的回测任务，异常在子进程内捕获后随结果一起返回，单支股票失败不影响其他股票
+    :param task: (序号, 股票代码, 名称, 行业)
+    :return: (序号, 结果行或None, 错误信息或None, 这支股票的运行指标)
+    """
+    index, code, name, industry = task
+    metrics.reset()
+    try:
+        row, error = analyzeOneStock(code, name, industry, _worker_price_store, stdout=False), None
+    except Exception as e:
+        metrics.count('failures')
+        row, error = None, '{}: {}'.format(type(e).__name__, e)
+    return index, row, error, metrics.snapshot()
+
+
+def AnalyzeByDualThrust(path, Index='ROE', workers=1):
     """
         Dual Thrust策略流程方法，从我们排序后筛选出来的股票中，分别获取历史数据去feed这个strategy，并运行
     :param path:
     :param Index:
+    :param workers: 并行回测的进程数，1为串行，None为使用全部CPU核数
     :return:
     """
-    code2Name_dict, code2Industry_dict = stockCode2NameAndIndustry(getStockCodeAndName())
-    download_dir = "data/share_price_processed"
+    # 输出的运行指标只统计这一次运行，同一进程中多次调用时不累加上一次的结果
+    metrics.reset()
+    universe = loadUniverse()
     result_dir = "result"
     result_path = "dual_thrust_{}.csv".format(Index)
     if not os.path.exists("result"):
         os.mkdir(result_dir)
 
-    ret_dict = {
-        "code": [],
-        "startTime": [],
-        "endTime": [],
-        "result": [],
-        "shareRatio": [],
-        "cumReturn(%)": [],
-        "maxDrawdown(%)": [],
-        "longestDrawDownDuration": [],
-        "tradeCount": [],
-        "profitableCount": [],
-        "unprofitableCount": []
-    }
-    code_lis = []
-    with open(path, 'r', encoding='utf-8') as f:
-        count = 0
-        lines = f.readlines()
-        for line in lines:
-            if count == 0:
-                count += 1
-                continue
-            info = line.split('\t')
-            code_lis.append(info[0])
+    ret_dict = {key: [] for key in RESULT_COLUMNS}
+    code_lis = readFilteredCodes(path)
+    tasks = []
     for code in code_lis:
-        try:
-            newStock = Stock(stock_code=code, stock_name=code2Name_dict[code], stock_industry=code2Industry_dict[code])
-        except KeyError:
+        if code not in universe:
             print('股票代码为 {} 已经退市，略过！'.format(code))
             continue
-        csv_file = os.path.join(download_dir, "{}.csv".format(code))
-        # 获取近7年历史数据，格式为PyAlgo要求的数据格式，可以在这里调整要获取的时间范围[startTime,endTime]
-        df = newStock.getPriceData(startTime=None, endTime=None)
-        # 也可以直接从csv文件中获取所有的历史数据（近7年内）
-        # df = pd.read_csv(csv_file)
-        startTime = df.Date.iloc[0]
-        endTime = df.Date.iloc[-1]
-        code = os.path.basename(csv_file)[:6]
-
+        tasks.append((len(tasks), code, universe.name(code), universe.industryOf(code)))
+
+    rows = [None] * len(tasks)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers > 1:
+        # 子进程完成一支就通过进程池的结果队列返回一支，按序号放回原来的位置，保证输出顺序与串行一致
+        pool = multiprocessing.Pool(workers, initializer=_initWorker)
         try:
-            result, shareRatio, cumReturn, maxDrawdown, longestDrawDownDuration, tradeCount, profitableCount, unprofitableCount = runStrategy(
-                code, csv_file)
-        except:
-            print('error {}!'.format(code))
+            for index, row, error, snapshot in pool.imap_unordered(_analyzeInWorker, tasks):
+                metrics.merge(snapshot)
+                if error is not None:
+                    print('error {}! {}'.format(tasks[index][1], error))
+                rows[index] = row
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        price_store = openPyAlgoStore()
+        for index, code, name, industry in tasks:
+            try:
+                rows[index] = analyzeOneStock(code, name, industry, price_store)
+            except:
+                metrics.count('failures')
+                print('error {}!'.format(code))
+
+    for row in rows:
+        if row is None:
             continue
-        ret_dict["code"].append(code)
-        ret_dict["startTime"].append(startTime)
-        ret_dict["endTime"].append(endTime)
-        ret_dict["result"].append(result)
-        ret_dict["shareRatio"].append(shareRatio)
-        ret_dict["cumReturn(%)"].append(cumReturn)
-        ret_dict["maxDrawdown(%)"].append(maxDrawdown)
-        ret_dict["longestDrawDownDuration"].append(str(longestDrawDownDuration).split('\t')[0])
-        ret_dict["tradeCount"].append(tradeCount)
-        ret_dict["profitableCount"].append(profitableCount)
-        ret_dict["unprofitableCount"].append(unprofitableCount)
+        for key, value in zip(RESULT_COLUMNS, row):
+            ret_dict[key].append(value)
 
     result_path = os.path.join(result_dir, result_path)
-    ret_df = pd.DataFrame(ret_dict)
-    ret_df.to_csv(result_path, index=False, encoding='utf-8')
+    with metrics.stage('result_write'):
+        ret_df = pd.DataFrame(ret_dict, columns=RESULT_COLUMNS)
+        ret_df.to_csv(result_path, index=False, encoding='utf-8')
+    metrics.count('result_rows', len(ret_df))
+
+    # 各阶段耗时和计数，JSON中包含每支股票的耗时，.prom可以交给Prometheus采集
+    metrics.writeJSON(os.path.join(result_dir, "metrics_dual_thrust_{}.json".format(Index)))
+    metrics.writePrometheus(os.path.join(result_dir, "metrics_dual_thrust_{}.prom".format(Index)))
+    metrics.report()
+
+
+def AnalyzeByDualThrustPortfolio(path, Index='ROE', cash=1000000, max_positions=10):
+    """
+        组合模式：筛选出来的股票共用一份起始资金，结果为整个组合的一行指标，保存到result/dual_thrust_portfolio_<Index>.csv
+    :param path: 筛选结果文件
+    :param Index: 指标类型
+    :param cash: 起始资金
+    :param max_positions: 最多同时持有的股票数
+    :return:
+    """
+    universe = loadUniverse()
+    result_dir = "result"
+    if not os.path.exists(result_dir):
+        os.mkdir(result_dir)
+    codes = []
+    for code in readFilteredCodes(path):
+        if code not in universe:
+            print('股票代码为 {} 已经退市，略过！'.format(code))
+            continue
+        codes.append(code)
+
+    row = list(runPortfolioStrategy(codes, cash=cash, max_positions=max_positions))
+    # 与AnalyzeByDualThrust的结果文件格式一致
+    row[4] = str(row[4])
+    ret_df = pd.DataFrame([[len(codes), max_positions, cash] + row],
+                          columns=["stocks", "maxPositions", "cash"] + RESULT_COLUMNS[3:])
+    ret_df.to_csv(os.path.join(result_dir, "dual_thrust_portfolio_{}.csv".format(Index)), index=False,
+                  encoding='utf-8')
 
 
 def testOneStock(code):
@@ -322,11 +563,11 @@ def testOneStock(code):
     csv_path = os.path.join(download_path, "{}.csv".format(code))
     code = os.path.basename(csv_path)[:6]
     csv_file = csv_path
-    df = pd.read_csv(csv_file)
+    df = readPyAlgoCSV(code, csv_dir=download_path)
     startTime = df.Date.iloc[0]
     endTime = df.Date.iloc[-1]
     print(" 开始日期： %s" % startTime)
-    runStrategy(code, csv_file, stdout=True)
+    runStrategy(code, csv_file, stdout=True, data=df)
     print("结束日期 %s" % endTime)
 
 
@@ -335,6 +576,10 @@ if __name__ == '__main__':
     # AnalyzeByDualThrust('data/filtered_stocks_MACD.txt', Index='MACD')
     # 根据ROE排序后的股票进行Dual Thrust策略分析，根据PyAlgo文档说明，起始资金为100万美元
     # AnalyzeByDualThrust('data/filtered_stocks_ROE.txt')
+    # 多进程并行回测，workers=None时使用全部CPU核数
+    # AnalyzeByDualThrust('data/filtered_stocks_ROE.txt', workers=None)
+    # 组合模式：所有股票共用100万起始资金，最多同时持有10支
+    # AnalyzeByDualThrustPortfolio('data/filtered_stocks_ROE.txt', max_positions=10)
 
     # 可以测试单个股票，起始资金为100万美元
     testOneStock('000599')
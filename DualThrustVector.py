@@ -0,0 +1,421 @@
+import datetime
+import os
+
+import numpy
+import pandas
+
+from PriceStore import loadPanel as loadPricePanel
+from PriceView import openPyAlgoStore, readPyAlgoCSV
+from RollingExtrema import dualRangeSeries
+from process import readFilteredCodes
+
+"""
+    Dual Thrust策略的向量化回测引擎，不经过PyAlgo的事件循环，直接在(股票数 × 交易日)的面板上用数组运算完成回测。
+    面板按每支股票自己的交易日左对齐：第i行第j列是第i支股票的第j根K线，不足的部分用NaN填充，
+    这样每支股票的滚动区间与PyAlgo单独回测时完全一致。
+    撮合规则与PyAlgo的回测broker保持一致：
+        1.信号在当天收盘后产生，市价单在下一根K线的开盘价成交，未成交的部分一直有效（GTC）；
+        2.每根K线最多成交该K线成交量的25%，超过的部分分多天成交；
+        3.手续费为成交金额的0.0005，现金不足时当天不成交；
+        4.买入数量为100股的整数倍。
+    输出的指标与DualThrustStrategy.runStrategy一致。
+    @Author: zengshuang61@gmail.com
+"""
+
+PANEL_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def loadPanel(codes, price_store=None, csv_dir='data/share_price_processed'):
+    """
+        把多支股票的PyAlgo格式股价数据读取为左对齐的面板
+    :param codes: 股票代码列表
+    :param price_store: PyAlgo格式的PriceStore或PriceView，为None时读取csv
+    :param csv_dir: csv目录，没有某支股票的csv时读取data/share_price/下的数据
+    :return: dict，包含codes、length、Date（datetime64[D]）以及Open/High/Low/Close/Volume，都是(股票数 × 最大K线数)的数组
+    """
+    return loadPricePanel(codes, PANEL_COLUMNS, price_store=price_store, csv_dir=csv_dir,
+                          reader=lambda code: readPyAlgoCSV(code, csv_dir=csv_dir))
+
+
+def simulateDualThrust(panel, dual_range, k_buy=0.08, k_sell=0.08, cash=1000000, commission=0.0005,
+                       volume_limit=0.25, rows=None):
+    """
+        逐日推进、按股票向量化的撮合模拟，与MyStrategy.onBars加PyAlgo回测broker的行为一致
+    :param panel: loadPanel得到的面板
+    :param dual_range: RollingExtrema.dualRangeSeries得到的区间
+    :param k_buy: 上轨系数，标量或与rows等长的数组
+    :param k_sell: 下轨系数，标量或与rows等长的数组
+    :param cash: 每支股票的起始资金
+    :param commission: 手续费比例
+    :param volume_limit: 每根K线可成交量占该K线成交量的比例
+    :param rows: 每一路模拟对应面板中的第几支股票，默认每支股票一路；同一支股票可以出现多次，用于参数扫描
+    :return: dict，equity为每日权益，tradeCount、profitableCount、unprofitableCount为交易统计
+    """
+    open_price, close, volume = panel['Open'], panel['Close'], panel['Volume']
+    if rows is None:
+        rows = numpy.arange(close.shape[0])
+    count, width = len(rows), close.shape[1]
+    length = panel['length'][rows]
+    k_buy = numpy.broadcast_to(numpy.asarray(k_buy, dtype=numpy.float64), (count,))
+    k_sell = numpy.broadcast_to(numpy.asarray(k_sell, dtype=numpy.float64), (count,))
+
+    cash = numpy.full(count, float(cash))
+    shares = numpy.zeros(count)
+    entry_left = numpy.zeros(count)
+    exit_left = numpy.zeros(count)
+    in_position = numpy.zeros(count, dtype=bool)
+    trade_pnl = numpy.zeros(count)
+    trade_count = numpy.zeros(count, dtype=numpy.int64)
+    profitable_count = numpy.zeros(count, dtype=numpy.int64)
+    unprofitable_count = numpy.zeros(count, dtype=numpy.int64)
+    equity = numpy.full((count, width), numpy.nan)
+
+    for t in range(width):
+        active = t < length
+        price = open_price[rows, t]
+        current = close[rows, t]
+        day_range = dual_range[rows, t]
+        volume_left = numpy.floor(numpy.where(active, volume[rows, t], 0) * volume_limit)
+
+        # 1.处理之前提交的买单，在开盘价成交
+        fill = numpy.where(active & (entry_left > 0), numpy.minimum(volume_left, entry_left), 0)
+        cost = -(price * fill) - price * fill * commission
+        fill_ok = (fill > 0) & (cash + cost >= 0)
+        cash = numpy.where(fill_ok, cash + cost, cash)
+        shares = numpy.where(fill_ok, shares + fill, shares)
+        entry_left = numpy.where(fill_ok, entry_left - fill, entry_left)
+        trade_pnl = numpy.where(fill_ok, trade_pnl + cost, trade_pnl)
+
+        # 2.处理之前提交的卖单
+        fill = numpy.where(active & (exit_left > 0), numpy.minimum(volume_left, exit_left), 0)
+        proceeds = price * fill - price * fill * commission
+        fill_ok = fill > 0
+        cash = numpy.where(fill_ok, cash + proceeds, cash)
+        shares = numpy.where(fill_ok, shares - fill, shares)
+        exit_left = numpy.where(fill_ok, exit_left - fill, exit_left)
+        trade_pnl = numpy.where(fill_ok, trade_pnl + proceeds, trade_pnl)
+        closed = fill_ok & (shares == 0)
+        trade_count += closed
+        profitable_count += closed & (trade_pnl > 0)
+        unprofitable_count += closed & (trade_pnl < 0)
+        trade_pnl = numpy.where(closed, 0, trade_pnl)
+        in_position &= ~(fill_ok & (exit_left == 0))
+
+        equity[:, t] = numpy.where(active, cash + shares * current, numpy.nan)
+
+        # 3.收盘后根据上下轨产生信号，下一根K线成交
+        ready = active & ~numpy.isnan(day_range)
+        buy_line = price + k_buy * day_range
+        sell_line = price - k_sell * day_range
+        units = numpy.floor_divide(cash, numpy.where(ready, current * 100, 1))
+        enter = ready & ~in_position & (units > 0) & (current > buy_line)
+        leave = ready & in_position & (exit_left == 0) & (current < sell_line)
+
+        entry_left = numpy.where(enter, units * 100, entry_left)
+        # 卖出时先撤销未完成的买单，没有持仓则直接平仓，否则卖出已持有的股数
+        exit_left = numpy.where(leave, shares, exit_left)
+        entry_left = numpy.where(leave, 0, entry_left)
+        in_position = (in_position | enter) & ~(leave & (shares == 0))
+
+    return {
+        'rows': rows,
+        'equity': equity,
+        'tradeCount': trade_count,
+        'profitableCount': profitable_count,
+        'unprofitableCount': unprofitable_count,
+    }
+
+
+def strategyMetrics(panel, simulation, cash=1000000, riskFreeRate=0.05):
+    """
+        根据每日权益计算与runStrategy相同的回测指标
+    :param panel: loadPanel得到的面板
+    :param simulation: simulateDualThrust的结果
+    :param cash: 起始资金
+    :param riskFreeRate: 无风险利率，与runStrategy中getSharpeRatio(0.05)一致
+    :return: DataFrame，每一路模拟一行，列与AnalyzeByDualThrust输出的结果文件一致
+    """
+    equity = simulation['equity']
+    rows = simulation['rows']
+    length = panel['length'][rows]
+    index = numpy.arange(len(rows))
+    last = length - 1
+    dates = panel['Date'][rows]
+
+    # 每日收益率，第一天相对于起始资金
+    previous = numpy.concatenate([numpy.full((len(rows), 1), float(cash)), equity[:, :-1]], axis=1)
+    daily = equity / previous - 1
+    mean = numpy.nanmean(daily, axis=1)
+    std = numpy.nanstd(daily, axis=1, ddof=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        shareRatio = numpy.where(std != 0, (mean - riskFreeRate / 252.0) / std * numpy.sqrt(252), 0.0)
+
+    result = equity[index, last]
+    cumReturn = (result / cash - 1) * 100
+
+    # 回撤：权益创新高（含持平）时刷新高点日期
+    high = numpy.fmax.accumulate(equity, axis=1)
+    maxDrawdown = numpy.nanmax(1 - equity / high, axis=1) * 100
+    columns = numpy.arange(equity.shape[1])
+    high_index = numpy.maximum.accumulate(numpy.where(equity >= high, columns, 0), axis=1)
+    duration = (dates - dates[index[:, None], high_index]).astype(numpy.int64)
+    duration = numpy.where(columns < length[:, None], duration, 0).max(axis=1)
+
+    return pandas.DataFrame({
+        "code": [panel['codes'][row] for row in rows],
+        "startTime": numpy.datetime_as_string(dates[:, 0], unit='D'),
+        "endTime": numpy.datetime_as_string(dates[index, last], unit='D'),
+        "result": result,
+        "shareRatio": shareRatio,
+        "cumReturn(%)": cumReturn,
+        "maxDrawdown(%)": maxDrawdown,
+        "longestDrawDownDuration": [str(datetime.timedelta(days=int(days))) for days in duration],
+        "tradeCount": simulation['tradeCount'],
+        "profitableCount": simulation['profitableCount'],
+        "unprofitableCount": simulation['unprofitableCount'],
+    })
+
+
+def runVectorStrategy(panel, k=0.08, period=15):
+    """
+        面板上所有股票一次性回测
+    :param panel: loadPanel得到的面板
+    :param k: 上下轨系数
+    :param period: 区间窗口
+    :return: 每支股票一行的回测指标
+    """
+    dual_range = dualRangeSeries(panel['High'], panel['Low'], panel['Close'], period)
+    return strategyMetrics(panel, simulateDualThrust(panel, dual_range, k, k))
+
+
+def sweepDualThrust(panel, ks=(0.08,), periods=(15,), k_buys=None, k_sells=None, max_rows=2048):
+    """
+        参数扫描：面板只加载一次，每个period的Range序列只计算一次，该period下所有k的组合叠在一起同时模拟
+    :param panel: loadPanel得到的面板
+    :param ks: k的取值，k_buy = k_sell = k
+    :param periods: period的取值
+    :param k_buys: 上轨系数的取值，与k_sells同时给出时按二者的所有组合扫描，此时忽略ks；只给出其中一个时抛出ValueError
+    :param k_sells: 下轨系数的取值
+    :param max_rows: 每次模拟的最大路数（组合数 × 股票数），用于控制每日权益矩阵占用的内存
+    :return: DataFrame，每个(period, k_buy, k_sell, code)一行
+    """
+    if (k_buys is None) != (k_sells is None):
+        raise ValueError('k_buys和k_sells必须同时给出')
+    if k_buys is not None:
+        combos = [(k_buy, k_sell) for k_buy in k_buys for k_sell in k_sells]
+    else:
+        combos = [(k, k) for k in ks]
+    count = len(panel['codes'])
+    per_chunk = max(1, max_rows // max(count, 1))
+
+    frames = []
+    for period in periods:
+        dual_range = dualRangeSeries(panel['High'], panel['Low'], panel['Close'], period)
+        for start in range(0, len(combos), per_chunk):
+            chunk = combos[start:start + per_chunk]
+            rows = numpy.tile(numpy.arange(count), len(chunk))
+            k_buy = numpy.repeat([k for k, _ in chunk], count)
+            k_sell = numpy.repeat([k for _, k in chunk], count)
+            ret_df = strategyMetrics(panel, simulateDualThrust(panel, dual_range, k_buy, k_sell, rows=rows))
+            ret_df.insert(0, 'k_sell', k_sell)
+            ret_df.insert(0, 'k_buy', k_buy)
+            ret_df.insert(0, 'period', period)
+            frames.append(ret_df)
+    return pandas.concat(frames, ignore_index=True)
+
+
+def foldPanel(panel, dual_range, rows, offsets, width):
+    """
+        按(股票, 起始位置)把面板切成多个窗口，叠成一个新面板，同一次模拟就能回测所有窗口。
+        滚动区间直接取整段历史上算好的值，窗口开头不需要重新预热
+    :param panel: loadPanel得到的面板
+    :param dual_range: 整段历史上的区间，形状与面板相同，也可以是多个period的区间组成的列表
+    :param rows: 每个窗口是面板中的第几支股票
+    :param offsets: 每个窗口在这支股票K线中的起始位置
+    :param width: 窗口长度（K线数）
+    :return: (新面板, 切好的区间)
+    """
+    length = numpy.clip(panel['length'][rows] - offsets, 0, width)
+    # 超出面板宽度的位置指向最后一列，它们都在length之外，模拟时不会被使用
+    columns = numpy.minimum(offsets[:, None] + numpy.arange(width)[None, :], panel['Close'].shape[1] - 1)
+    ret = {'codes': [panel['codes'][row] for row in rows], 'length': length}
+    for name in PANEL_COLUMNS + ['Date']:
+        ret[name] = panel[name][rows[:, None], columns]
+    if isinstance(dual_range, list):
+        return ret, [values[rows[:, None], columns] for values in dual_range]
+    return ret, dual_range[rows[:, None], columns]
+
+
+def walkForwardFolds(panel, train, test, step=None):
+    """
+        划分滚动窗口，以K线数计，每支股票按自己的交易日划分，测试段没有数据的窗口不参与
+    :param panel: loadPanel得到的面板
+    :param train: 训练段长度
+    :param test: 测试段长度
+    :param step: 相邻两个窗口的间隔，默认等于test，测试段首尾相接
+    :return: (窗口序号, 股票在面板中的行号, 训练段起始位置)，都是等长的数组
+    """
+    step = step or test
+    width = int(panel['length'].max()) if len(panel['length']) else 0
+    starts = numpy.arange(0, max(width - train, 0), step, dtype=numpy.int64)
+    count = len(panel['codes'])
+    folds = numpy.repeat(numpy.arange(len(starts)), count)
+    rows = numpy.tile(numpy.arange(count), len(starts))
+    offsets = starts[folds]
+    keep = panel['length'][rows] > offsets + train
+    return folds[keep], rows[keep], offsets[keep]
+
+
+def walkForwardDualThrust(panel, train=500, test=125, step=None, ks=(0.08,), periods=(15,), select='shareRatio',
+                          max_rows=2048):
+    """
+        滚动样本内外检验：每个窗口先在训练段上对(period, k)的所有组合回测，按select为每支股票选出最优参数，
+        再用选出的参数回测紧接着的测试段，每个测试段都以起始资金重新开始。
+        面板只加载一次，每个period的区间只在整段历史上计算一次，之后各窗口只是切片；
+        所有窗口叠在一起模拟，逐日推进的次数是窗口长度，而不是窗口数 × 窗口长度
+    :param panel: loadPanel得到的面板
+    :param train: 训练段的K线数
+    :param test: 测试段的K线数
+    :param step: 窗口每次向后移动的K线数，默认等于test；不能小于test，否则测试段互相重叠，aggregateWalkForward会把同一段行情复利多次
+    :param ks: k的取值，k_buy = k_sell = k
+    :param periods: period的取值
+    :param select: 训练段上用来选参数的指标列，越大越好
+    :param max_rows: 每次模拟的最大路数（组合数 × 窗口数），用于控制每日权益矩阵占用的内存
+    :return: DataFrame，每个(窗口, 股票)一行：窗口序号、训练段的起止日期和选出的参数及其指标，以及测试段的回测指标
+    """
+    assert train > 0 and test > 0
+    if step is not None and step < test:
+        raise ValueError('step({})不能小于test({})，测试段不能重叠'.format(step, test))
+    folds, rows, offsets = walkForwardFolds(panel, train, test, step)
+    ranges = [dualRangeSeries(panel['High'], panel['Low'], panel['Close'], period) for period in periods]
+    train_panel, train_ranges = foldPanel(panel, ranges, rows, offsets, train)
+    test_panel, test_ranges = foldPanel(panel, ranges, rows, offsets + train, test)
+
+    # 训练段：同一个period下的k分块叠在一起模拟，得到每个窗口在每个组合上的分数
+    combos = [(p, k) for p in range(len(periods)) for k in ks]
+    count = len(rows)
+    scores = numpy.full((len(combos), count), -numpy.inf)
+    per_chunk = max(1, max_rows // max(count, 1))
+    for p in range(len(periods)):
+        indices = [i for i, (q, _) in enumerate(combos) if q == p]
+        for start in range(0, len(indices), per_chunk):
+            chunk = indices[start:start + per_chunk]
+            k_values = numpy.repeat([combos[i][1] for i in chunk], count)
+            simulation = simulateDualThrust(train_panel, train_ranges[p], k_values, k_values,
+                                            rows=numpy.tile(numpy.arange(count), len(chunk)))
+            score = strategyMetrics(train_panel, simulation)[select].values.reshape(len(chunk), count)
+            scores[chunk] = numpy.where(numpy.isnan(score), -numpy.inf, score)
+    # 分数相同时取先出现的组合
+    best = numpy.argmax(scores, axis=0)
+    best_period = numpy.array([combos[i][0] for i in best], dtype=numpy.int64)
+    best_k = numpy.array([combos[i][1] for i in best], dtype=numpy.float64)
+
+    # 测试段：每个窗口使用自己选出的period的区间和k，一次模拟
+    test_range = numpy.stack(test_ranges)[best_period, numpy.arange(count)] if len(periods) > 1 else test_ranges[0]
+    ret_df = strategyMetrics(test_panel, simulateDualThrust(test_panel, test_range, best_k, best_k))
+    index = numpy.arange(count)
+    ret_df.insert(1, 'fold', folds)
+    ret_df.insert(2, 'trainStart', numpy.datetime_as_string(train_panel['Date'][:, 0], unit='D'))
+    ret_df.insert(3, 'trainEnd', numpy.datetime_as_string(train_panel['Date'][index, train - 1], unit='D'))
+    ret_df.insert(4, 'period', numpy.asarray(periods)[best_period])
+    ret_df.insert(5, 'k', best_k)
+    ret_df.insert(6, 'train_' + select, scores[best, index])
+    return ret_df.sort_values(by=['code', 'fold'], kind='mergesort').reset_index(drop=True)
+
+
+def aggregateWalkForward(folds_df, cash=1000000):
+    """
+        按股票汇总各测试段的结果，各测试段互不重叠（walkForwardDualThrust保证step不小于test），累计收益率是各段收益的连乘
+    :param folds_df: walkForwardDualThrust的结果
+    :param cash: 起始资金
+    :return: DataFrame，每支股票一行：窗口数、测试段复利累计收益率、平均收益率和夏普率、盈利窗口占比、最大回撤、交易统计
+    """
+    grouped = folds_df.groupby('code', sort=False)
+    growth = folds_df['result'] / cash
+    return pandas.DataFrame({
+        'folds': grouped.size(),
+        'startTime': grouped['startTime'].first(),
+        'endTime': grouped['endTime'].last(),
+        'cumReturn(%)': (growth.groupby(folds_df['code'], sort=False).prod() - 1) * 100,
+        'meanReturn(%)': grouped['cumReturn(%)'].mean(),
+        'meanShareRatio': grouped['shareRatio'].mean(),
+        'profitableFolds(%)': grouped['cumReturn(%)'].apply(lambda x: (x > 0).mean() * 100),
+        'maxDrawdown(%)': grouped['maxDrawdown(%)'].max(),
+        'tradeCount': grouped['tradeCount'].sum(),
+        'profitableCount': grouped['profitableCount'].sum(),
+        'unprofitableCount': grouped['unprofitableCount'].sum(),
+    }).rename_axis('code').reset_index()
+
+
+def AnalyzeByDualThrustVector(path, Index='ROE'):
+    """
+        与AnalyzeByDualThrust相同的流程和输出文件，但使用向量化引擎一次性回测所有筛选出来的股票
+    :param path: 筛选结果文件
+    :param Index: 指标类型
+    :return:
+    """
+    result_dir = "result"
+    if not os.path.exists(result_dir):
+        os.mkdir(result_dir)
+    price_store = openPyAlgoStore()
+    panel = loadPanel(readFilteredCodes(path), price_store=price_store)
+    ret_df = runVectorStrategy(panel)
+    ret_df.to_csv(os.path.join(result_dir, "dual_thrust_{}.csv".format(Index)), index=False, encoding='utf-8')
+
+
+def SweepByDualThrust(path, ks=(0.08,), periods=(15,), k_buys=None, k_sells=None, Index='ROE'):
+    """
+        对筛选出来的股票进行参数扫描，结果保存到result/dual_thrust_sweep_<Index>.csv
+    :param path: 筛选结果文件
+    :param ks: k的取值
+    :param periods: period的取值
+    :param k_buys: 上轨系数的取值
+    :param k_sells: 下轨系数的取值
+    :param Index: 指标类型
+    :return:
+    """
+    result_dir = "result"
+    if not os.path.exists(result_dir):
+        os.mkdir(result_dir)
+    price_store = openPyAlgoStore()
+    panel = loadPanel(readFilteredCodes(path), price_store=price_store)
+    ret_df = sweepDualThrust(panel, ks, periods, k_buys, k_sells)
+    ret_df.to_csv(os.path.join(result_dir, "dual_thrust_sweep_{}.csv".format(Index)), index=False, encoding='utf-8')
+
+
+def WalkForwardByDualThrust(path, train=500, test=125, step=None, ks=(0.08,), periods=(15,), select='shareRatio',
+                            Index='ROE'):
+    """
+        对筛选出来的股票做滚动样本内外检验，每个窗口的结果保存到result/dual_thrust_walkforward_<Index>.csv，
+        按股票汇总的结果保存到result/dual_thrust_walkforward_summary_<Index>.csv
+    :param path: 筛选结果文件
+    :param train: 训练段的K线数
+    :param test: 测试段的K线数
+    :param step: 窗口每次向后移动的K线数，默认等于test，不能小于test
+    :param ks: k的取值
+    :param periods: period的取值
+    :param select: 训练段上用来选参数的指标列
+    :param Index: 指标类型
+    :return:
+    """
+    result_dir = "result"
+    if not os.path.exists(result_dir):
+        os.mkdir(result_dir)
+    price_store = openPyAlgoStore()
+    panel = loadPanel(readFilteredCodes(path), price_store=price_store)
+    folds_df = walkForwardDualThrust(panel, train, test, step, ks, periods, select)
+    folds_df.to_csv(os.path.join(result_dir, "dual_thrust_walkforward_{}.csv".format(Index)), index=False,
+                    encoding='utf-8')
+    summary_path = os.path.join(result_dir, "dual_thrust_walkforward_summary_{}.csv".format(Index))
+    aggregateWalkForward(folds_df).to_csv(summary_path, index=False, encoding='utf-8')
+
+
+if __name__ == '__main__':
+    # 根据MACD排序后的股票进行Dual Thrust策略的向量化回测
+    # AnalyzeByDualThrustVector('data/filtered_stocks_MACD.txt', Index='MACD')
+    AnalyzeByDualThrustVector('data/filtered_stocks_ROE.txt')
+    # 参数扫描：20个k × 10个period
+    # SweepByDualThrust('data/filtered_stocks_ROE.txt', ks=numpy.arange(1, 21) * 0.01, periods=range(5, 55, 5))
+    # 滚动样本内外检验：训练2年、测试半年，每个窗口在训练段上选出最优的k和period
+    # WalkForwardByDualThrust('data/filtered_stocks_ROE.txt', train=500, test=125, ks=numpy.arange(1, 21) * 0.01,
+    #                         periods=range(5, 55, 5))
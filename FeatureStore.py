@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy
+import pandas
+import stockstats
+
+"""
+    指标特征仓库：把stockstats算好的指标列按股票保存为二进制文件（每列一个.npy），下次读取时直接加载，
+    不再解析csv、也不再重新计算。
+    缓存键由源数据的内容哈希（sha1）、列名（stockstats的列名本身包含窗口等参数，例如rsi_6、cci_20）、
+    时间区间以及stockstats的版本组成，源数据变化后旧的键不会再被命中，写入新数据时删除这支股票的全部旧条目。
+    源文件的大小和修改时间与上次相同时直接使用记录的哈希，只被touch过的文件重新计算哈希后仍然命中；
+    源数据来自列式仓库时用storeDigest（行数、首尾日期和最后一行）代替全部数据的哈希。
+    目录结构：
+        <code>/meta.json    源数据（路径、大小、修改时间、哈希）以及已缓存的条目
+        <code>/<key>.npy    一列指标或日期索引，key为上述各项的sha1
+    @Author: zengshuang61@gmail.com
+"""
+
+FEATURE_DIR = 'data/feature_store'
+INDEX_KEY = '__index__'
+
+
+def _stockstatsVersion():
+    version = getattr(stockstats, '__version__', None)
+    if version is None:
+        try:
+            from importlib.metadata import version as packageVersion
+            version = packageVersion('stockstats')
+        except Exception:
+            version = ''
+    return version
+
+
+STOCKSTATS_VERSION = _stockstatsVersion()
+
+
+def fileDigest(path, chunk_size=1 << 20):
+    """
+        文件内容的sha1
+    :param path: 文件路径
+    :param chunk_size: 每次读取的字节数
+    :return: 十六进制字符串
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def storeDigest(store, code):
+    """
+        列式仓库中一支股票的数据标识：行数、首尾日期以及最后一行各列的值，只读取memmap中的几页，
+        命中缓存时不需要读取和哈希全部历史。仓库由只追加的csv转换而来，新增或删除K线都会改变这几项
+    :param store: PriceStore
+    :param code: 股票代码
+    :return: 十六进制字符串
+    """
+    lo, hi = store.rowRange(code)
+    sha1 = hashlib.sha1('{}:{}'.format(code, hi - lo).encode('utf-8'))
+    if hi > lo:
+        for name in [store.date_column] + sorted(store.columns):
+            column = store.column(name)
+            sha1.update(name.encode('utf-8'))
+            sha1.update(numpy.ascontiguousarray(column[[lo, hi - 1]]).tobytes())
+    return sha1.hexdigest()
+
+
+class FeatureStore(object):
+    def __init__(self, store_dir=FEATURE_DIR):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self.__metas = {}
+        # 股票代码 -> sourceDigest最近一次得到的源数据描述，put时记录到meta.json
+        self.__sources = {}
+
+    def __codeDir(self, code):
+        return os.path.join(self.store_dir, code)
+
+    def __meta(self, code):
+        meta = self.__metas.get(code)
+        if meta is None:
+            path = os.path.join(self.__codeDir(code), 'meta.json')
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            else:
+                meta = {'source': None, 'entries': {}}
+            self.__metas[code] = meta
+        return meta
+
+    def __writeMeta(self, code, meta):
+        code_dir = self.__codeDir(code)
+        os.makedirs(code_dir, exist_ok=True)
+        path = os.path.join(code_dir, 'meta.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+        self.__metas[code] = meta
+
+    def sourceDigest(self, code, path):
+        """
+            源csv文件的内容哈希，大小和修改时间与记录一致时不再读取文件
+        :param code: 股票代码
+        :param path: 源文件
+        :return: 文件不存在时返回None
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        meta = self.__meta(code)
+        recorded = meta['source']
+        if recorded is not None and recorded['path'] == path and recorded['size'] == stat.st_size \
+                and recorded['mtime'] == stat.st_mtime_ns:
+            return recorded['digest']
+        source = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'digest': fileDigest(path)}
+        self.__sources[code] = source
+        if recorded is not None and recorded['digest'] == source['digest']:
+            # 内容没有变化，只记录新的修改时间
+            meta['source'] = source
+            self.__writeMeta(code, meta)
+        return source['digest']
+
+    @staticmethod
+    def entryKey(digest, column, startTime=None, endTime=None):
+        text = '\0'.join([digest, column, str(startTime), str(endTime), STOCKSTATS_VERSION])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, code, digest, columns, startTime=None, endTime=None):
+        """
+            读取缓存的指标列
+        :param code: 股票代码
+        :param digest: 源数据的哈希
+        :param columns: 指标列
+        :param startTime: 开始时间
+        :param endTime: 结束时间
+        :return: 以日期为索引的DataFrame，任何一列不在缓存中时返回None
+        """
+        meta = self.__meta(code)
+        if meta['source'] is None or meta['source']['digest'] != digest:
+            return None
+        keys = [self.entryKey(digest, column, startTime, endTime) for column in [INDEX_KEY] + list(columns)]
+        if not all(key in meta['entries'] for key in keys):
+            return None
+        code_dir = self.__codeDir(code)
+        try:
+            arrays = [numpy.load(os.path.join(code_dir, key + '.npy')) for key in keys]
+        except (OSError, ValueError):
+            return None
+        index = pandas.Index(arrays[0], name=meta['entries'][keys[0]])
+        return pandas.DataFrame(dict(zip(columns, arrays[1:])), index=index, columns=list(columns))
+
+    def put(self, code, digest, frame, startTime=None, endTime=None):
+        """
+            保存指标列，源数据的哈希与记录不同时先删除这支股票的全部旧条目
+        :param code: 股票代码
+        :param digest: 源数据的哈希
+        :param frame: Stock._indicator返回的DataFrame
+        :param startTime: 开始时间
+        :param endTime: 结束时间
+        :return:
+        """
+        meta = self.__meta(code)
+        source = self.__sources.get(code)
+        if source is None or source['digest'] != digest:
+            # 源数据来自列式仓库等，没有文件信息，只记录哈希
+            source = {'path': None, 'size': None, 'mtime': None, 'digest': digest}
+        if meta['source'] is None or meta['source']['digest'] != digest:
+            self.invalidate(code)
+            meta = {'source': source, 'entries': {}}
+        code_dir = self.__codeDir(code)
+        os.makedirs(code_dir, exist_ok=True)
+        items = [(INDEX_KEY, numpy.asarray(frame.index, dtype=str), frame.index.name)]
+        items += [(column, frame[column].to_numpy(), column) for column in frame.columns]
+        for column, values, name in items:
+            key = self.entryKey(digest, column, startTime, endTime)
+            path = os.path.join(code_dir, key + '.npy')
+            with open(path + '.tmp', 'wb') as f:
+                numpy.save(f, values, allow_pickle=False)
+            os.replace(path + '.tmp', path)
+            meta['entries'][key] = name
+        self.__writeMeta(code, meta)
+
+    def invalidate(self, code):
+        """
+            删除某支股票的全部缓存
+        :param code: 股票代码
+        :return:
+        """
+        shutil.rmtree(self.__codeDir(code), ignore_errors=True)
+        self.__metas.pop(code, None)
+
+    def clear(self):
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.__metas.clear()
@@ -0,0 +1,103 @@
+import collections
+
+"""
+    进程内共享的LRU缓存：缓存Stock加载好的stockstats统计表（以及其上已经计算过的指标列），
+    按DataFrame实际占用的内存计算容量，超过预算时淘汰最久未使用的条目，并记录命中和淘汰统计
+    @Author: zengshuang61@gmail.com
+"""
+
+
+def frameBytes(frame):
+    """
+        DataFrame占用的内存（包含索引和字符串等对象列）
+    :param frame: DataFrame
+    :return:
+    """
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+class FrameCache(object):
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        """
+        :param max_bytes: 内存预算，单位字节
+        """
+        self.max_bytes = max_bytes
+        self.__items = collections.OrderedDict()
+        self.__bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def __contains__(self, key):
+        return key in self.__items
+
+    def __len__(self):
+        return len(self.__items)
+
+    def get(self, key):
+        """
+            命中时把条目移到最近使用的位置，未命中返回None
+        :param key:
+        :return:
+        """
+        item = self.__items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, frame):
+        if key in self.__items:
+            self.__bytes -= self.__items.pop(key)[1]
+        size = frameBytes(frame)
+        self.__items[key] = (frame, size)
+        self.__bytes += size
+        self.__evict()
+
+    def resize(self, key):
+        """
+            缓存的统计表上新增了指标列之后，重新计算它占用的内存
+        :param key:
+        :return:
+        """
+        item = self.__items.get(key)
+        if item is None:
+            return
+        size = frameBytes(item[0])
+        self.__bytes += size - item[1]
+        self.__items[key] = (item[0], size)
+        self.__evict()
+
+    def setBudget(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.__evict()
+
+    def clear(self):
+        self.__items.clear()
+        self.__bytes = 0
+
+    def __evict(self):
+        # 单个条目超过预算时也会被淘汰，即不缓存
+        while self.__bytes > self.max_bytes and self.__items:
+            _, (_, size) = self.__items.popitem(last=False)
+            self.__bytes -= size
+            self.evictions += 1
+            self.evicted_bytes += size
+
+    def stats(self):
+        return {
+            'entries': len(self.__items),
+            'bytes': self.__bytes,
+            'maxBytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'evictedBytes': self.evicted_bytes,
+        }
+
+
+# Stock默认使用的缓存，进程内所有Stock对象共享
+stock_cache = FrameCache()
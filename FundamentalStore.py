@@ -0,0 +1,347 @@
+import csv
+import json
+import os
+import shutil
+
+import numpy
+import pandas
+
+"""
+    财务数据仓库：把data/{zcfzb,lrb,xjllb}/{season,year}/下每支股票的三大报表（网易财经的转置宽表，gbk编码）
+    合并成一张以(code, report_date, item)为键的长表，按列存储为二进制文件，读取时通过numpy.memmap内存映射。
+    科目名称在不同报表中可能重复（例如利润表和现金流量表都有净利润），所以科目统一写成"报表:科目"，例如"lrb:净利润(万元)"。
+    目录结构（季度、年度各一个目录）：
+        meta.json           科目列表、总行数以及股票数
+        codes.bin           股票代码，定长字节串S6
+        offsets.bin         每支股票的起始行，长度为股票数+1，行按(code, item, report_date)排序
+        item.bin            科目编号，int32，对应meta.json中的科目列表
+        code_index.bin      股票编号，int32，对应codes.bin
+        date.bin            报告日期，datetime64[D]
+        value.bin           数值，float64，原表中的'--'不写入
+        item_order.bin      按(item, code, report_date)排序的行号，取某个科目的全部股票时使用
+        item_offsets.bin    每个科目在item_order中的起始位置，长度为科目数+1
+    @Author: zengshuang61@gmail.com
+"""
+
+FUNDAMENTAL_DIR = 'data/fundamental_store'
+REPORTS = ('zcfzb', 'lrb', 'xjllb')
+CODE_DTYPE = 'S6'
+DATE_DTYPE = 'M8[D]'
+VALUE_DTYPE = '<f8'
+
+
+def itemKey(report, name):
+    """
+        科目的唯一名称
+    :param report: 报表，zcfzb、lrb或xjllb
+    :param name: 报表中的科目名称，例如净利润(万元)
+    :return:
+    """
+    return '{}:{}'.format(report, name.strip())
+
+
+def parseReportFile(path, report):
+    """
+        解析网易财经的一张报表：第一行是报告日期，之后每一行是一个科目在各个报告期的数值
+    :param path: 报表csv
+    :param report: 报表，zcfzb、lrb或xjllb
+    :return: [(科目, 报告日期数组, 数值数组)]，只包含有数值的报告期
+    """
+    with open(path, 'r', encoding='gbk', errors='ignore') as f:
+        rows = [row for row in csv.reader(f) if row and row[0].strip()]
+    if len(rows) < 2:
+        return []
+    header = [cell.strip() for cell in rows[0][1:]]
+    columns = [i for i, cell in enumerate(header) if cell]
+    dates = numpy.asarray([header[i] for i in columns], dtype=DATE_DTYPE)
+    records = []
+    for row in rows[1:]:
+        cells = row[1:]
+        values = numpy.full(len(columns), numpy.nan)
+        for j, i in enumerate(columns):
+            try:
+                values[j] = float(cells[i].strip().replace(',', ''))
+            except (IndexError, ValueError):
+                pass
+        valid = numpy.isfinite(values)
+        if valid.any():
+            order = numpy.argsort(dates[valid], kind='stable')
+            records.append((itemKey(report, row[0]), dates[valid][order], values[valid][order]))
+    return records
+
+
+def readStockReports(code, data_dir='data', period='season'):
+    """
+        读取一支股票的三大报表
+    :param code: 股票代码
+    :param data_dir: 数据目录
+    :param period: season（季度）或year（年度）
+    :return: [(科目, 报告日期数组, 数值数组)]
+    """
+    records = []
+    for report in REPORTS:
+        path = os.path.join(data_dir, report, period, '{}.csv'.format(code))
+        if not os.path.exists(path):
+            continue
+        try:
+            records.extend(parseReportFile(path, report))
+        except Exception:
+            print('{} 解析失败，略过！'.format(path))
+    return records
+
+
+def recordsToFrame(records):
+    """
+        把(科目, 报告日期, 数值)记录转换为以报告日期为索引、科目为列的DataFrame，报告日期升序
+    :param records: readStockReports的返回值
+    :return:
+    """
+    series = {}
+    for item, dates, values in records:
+        # 同一报表中重复的科目保留第一次出现的
+        if item not in series:
+            series[item] = pandas.Series(values, index=numpy.datetime_as_string(dates, unit='D'))
+    df = pandas.DataFrame(series)
+    df.index.name = 'report_date'
+    return df.sort_index()
+
+
+def buildFundamentalStore(data_dir='data', store_dir=os.path.join(FUNDAMENTAL_DIR, 'season'), period='season'):
+    """
+        一次性转换：逐支股票解析报表后追加写入列文件，最后生成按科目排序的行号索引，
+        先写到临时目录，全部完成后再替换旧的仓库
+    :param data_dir: 数据目录
+    :param store_dir: 仓库目录
+    :param period: season（季度）或year（年度）
+    :return: 写入的股票数
+    """
+    tmp_dir = store_dir.rstrip('/') + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    code_set = set()
+    for report in REPORTS:
+        report_dir = os.path.join(data_dir, report, period)
+        if os.path.exists(report_dir):
+            code_set.update(name[:-4] for name in os.listdir(report_dir) if name.endswith('.csv'))
+
+    items = []
+    item2Id = {}
+    codes = []
+    offsets = [0]
+    names = ('item', 'code_index', 'date', 'value')
+    handles = {name: open(os.path.join(tmp_dir, '{}.bin'.format(name)), 'wb') for name in names}
+    try:
+        for code in sorted(code_set):
+            item_ids = []
+            dates = []
+            values = []
+            for item, item_dates, item_values in readStockReports(code, data_dir, period):
+                if item not in item2Id:
+                    item2Id[item] = len(items)
+                    items.append(item)
+                elif item2Id[item] in item_ids:
+                    continue
+                item_ids.append(item2Id[item])
+                dates.append(item_dates)
+                values.append(item_values)
+            if not item_ids:
+                continue
+            lengths = [len(d) for d in dates]
+            item_column = numpy.repeat(numpy.asarray(item_ids, dtype='<i4'), lengths)
+            date_column = numpy.concatenate(dates)
+            value_column = numpy.concatenate(values)
+            order = numpy.lexsort((date_column, item_column))
+            item_column[order].tofile(handles['item'])
+            numpy.full(len(order), len(codes), dtype='<i4').tofile(handles['code_index'])
+            date_column[order].tofile(handles['date'])
+            value_column[order].tofile(handles['value'])
+            codes.append(code)
+            offsets.append(offsets[-1] + len(order))
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    rows = offsets[-1]
+    if rows:
+        item_column = numpy.fromfile(os.path.join(tmp_dir, 'item.bin'), dtype='<i4')
+        # 行本身按股票排序，稳定排序后同一科目内部仍按(code, report_date)排列
+        item_order = numpy.argsort(item_column, kind='stable').astype('<i8')
+        item_offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(item_column, minlength=len(items)))))
+    else:
+        item_order = numpy.zeros(0, dtype='<i8')
+        item_offsets = numpy.zeros(len(items) + 1, dtype='<i8')
+    item_order.tofile(os.path.join(tmp_dir, 'item_order.bin'))
+    numpy.asarray(item_offsets, dtype='<i8').tofile(os.path.join(tmp_dir, 'item_offsets.bin'))
+    numpy.asarray(codes, dtype=CODE_DTYPE).tofile(os.path.join(tmp_dir, 'codes.bin'))
+    numpy.asarray(offsets, dtype='<i8').tofile(os.path.join(tmp_dir, 'offsets.bin'))
+    meta = {
+        'period': period,
+        'items': items,
+        'rows': rows,
+        'count': len(codes),
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.rename(tmp_dir, store_dir)
+    return len(codes)
+
+
+class FundamentalStore(object):
+    """
+        只读的财务数据仓库：取一支股票的全部科目是一段连续的行，取一个科目的全部股票是item_order上的一段连续行号
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.period = meta['period']
+        self.__items = meta['items']
+        self.__item2Id = {item: i for i, item in enumerate(self.__items)}
+        self.__rows = meta['rows']
+        self.__count = meta['count']
+        self.__codes = self.__map('codes.bin', CODE_DTYPE, self.__count)
+        self.__offsets = self.__map('offsets.bin', '<i8', self.__count + 1)
+        self.__item = self.__map('item.bin', '<i4', self.__rows)
+        self.__codeIndex = self.__map('code_index.bin', '<i4', self.__rows)
+        self.__dates = self.__map('date.bin', DATE_DTYPE, self.__rows)
+        self.__values = self.__map('value.bin', VALUE_DTYPE, self.__rows)
+        self.__itemOrder = self.__map('item_order.bin', '<i8', self.__rows)
+        self.__itemOffsets = self.__map('item_offsets.bin', '<i8', len(self.__items) + 1)
+        self.__code2Row = {code.decode(): i for i, code in enumerate(self.__codes)}
+
+    def __map(self, file_name, dtype, shape):
+        if shape == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(os.path.join(self.store_dir, file_name), dtype=dtype, mode='r', shape=(shape,))
+
+    def __contains__(self, code):
+        return code in self.__code2Row
+
+    def __len__(self):
+        return self.__count
+
+    def codes(self):
+        return list(self.__code2Row)
+
+    def items(self, report=None):
+        """
+            仓库中的全部科目
+        :param report: 只返回某张报表的科目，例如lrb
+        :return:
+        """
+        if report is None:
+            return list(self.__items)
+        prefix = '{}:'.format(report)
+        return [item for item in self.__items if item.startswith(prefix)]
+
+    def getStock(self, code, items=None, startTime=None, endTime=None):
+        """
+            一支股票的财务数据，只读取它在各列中的一段连续行
+        :param code: 股票代码
+        :param items: 需要的科目，默认全部科目
+        :param startTime: 开始的报告日期，None表示不限
+        :param endTime: 结束的报告日期（包含），None表示不限
+        :return: 以报告日期为索引、科目为列的DataFrame，仓库中没有该股票时返回空表
+        """
+        if code not in self.__code2Row:
+            return pandas.DataFrame(columns=items or [])
+        i = self.__code2Row[code]
+        lo, hi = int(self.__offsets[i]), int(self.__offsets[i + 1])
+        item_ids = numpy.asarray(self.__item[lo:hi])
+        dates = numpy.asarray(self.__dates[lo:hi])
+        mask = self.__dateMask(dates, startTime, endTime)
+        if items is not None:
+            mask &= numpy.isin(item_ids, [self.__item2Id[item] for item in items if item in self.__item2Id])
+        df = self.__pivot(dates[mask], numpy.asarray(self.__items, dtype=object)[item_ids[mask]],
+                          self.__values[lo:hi][mask])
+        if items is not None:
+            df = df.reindex(columns=items)
+        return df
+
+    def itemRows(self, item, codes=None, startTime=None, endTime=None):
+        """
+            一个科目在全部股票上的数据，以长表的形式返回，按(code, report_date)排序
+        :param item: 科目，例如lrb:净利润(万元)
+        :param codes: 只返回这些股票，默认全部股票
+        :param startTime: 开始的报告日期，None表示不限
+        :param endTime: 结束的报告日期（包含），None表示不限
+        :return: (股票编号数组, 报告日期数组, 数值数组)
+        """
+        i = self.__item2Id[item]
+        rows = self.__itemOrder[int(self.__itemOffsets[i]):int(self.__itemOffsets[i + 1])]
+        code_index = self.__codeIndex[rows]
+        dates = self.__dates[rows]
+        mask = self.__dateMask(dates, startTime, endTime)
+        if codes is not None:
+            mask &= numpy.isin(code_index, [self.__code2Row[code] for code in codes if code in self.__code2Row])
+        return code_index[mask], dates[mask], self.__values[rows][mask]
+
+    def getItem(self, item, codes=None, startTime=None, endTime=None):
+        """
+            一个科目在全部股票上的数据
+        :param item: 科目，例如lrb:净利润(万元)
+        :param codes: 只返回这些股票，默认全部股票
+        :param startTime: 开始的报告日期，None表示不限
+        :param endTime: 结束的报告日期（包含），None表示不限
+        :return: 以报告日期为索引、股票代码为列的DataFrame
+        """
+        code_index, dates, values = self.itemRows(item, codes, startTime, endTime)
+        return self.__pivot(dates, self.__codeNames(code_index), values)
+
+    def latest(self, item, endTime=None):
+        """
+            每支股票在endTime（包含）之前最近一期的数值，供筛选股票使用
+        :param item: 科目，例如lrb:净利润(万元)
+        :param endTime: 截止的报告日期，None表示最新一期
+        :return: 以股票代码为索引的Series
+        """
+        code_index, dates, values = self.itemRows(item, endTime=endTime)
+        # 同一支股票的行按报告日期升序排列，取每段的最后一行
+        last = numpy.flatnonzero(numpy.append(code_index[1:] != code_index[:-1], True)) if len(code_index) else []
+        return pandas.Series(values[last], index=self.__codeNames(code_index[last]), name=item)
+
+    def __codeNames(self, code_index):
+        return numpy.char.decode(numpy.asarray(self.__codes)[code_index]) if len(code_index) else numpy.array([], dtype=str)
+
+    @staticmethod
+    def __dateMask(dates, startTime, endTime):
+        mask = numpy.ones(len(dates), dtype=bool)
+        if startTime is not None:
+            mask &= dates >= numpy.datetime64(startTime, 'D')
+        if endTime is not None:
+            mask &= dates <= numpy.datetime64(endTime, 'D')
+        return mask
+
+    @staticmethod
+    def __pivot(dates, columns, values):
+        df = pandas.DataFrame({'report_date': numpy.datetime_as_string(dates, unit='D'), 'column': columns,
+                               'value': numpy.asarray(values)})
+        df = df.pivot(index='report_date', columns='column', values='value')
+        df.columns.name = None
+        return df.sort_index()
+
+
+def openFundamentalStore(store_dir):
+    """
+        打开仓库，还没有转换过时返回None，调用方回退到解析报表csv
+    :param store_dir: 仓库目录
+    :return:
+    """
+    if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+        return None
+    return FundamentalStore(store_dir)
+
+
+if __name__ == '__main__':
+    # 一次性把季度和年度的三大报表转换成财务数据仓库
+    if not os.path.exists(FUNDAMENTAL_DIR):
+        os.makedirs(FUNDAMENTAL_DIR)
+    for period in ('season', 'year'):
+        count = buildFundamentalStore('data', os.path.join(FUNDAMENTAL_DIR, period), period)
+        print('{} 财务数据转换完成，共{}支股票'.format(period, count))
@@ -0,0 +1,318 @@
+import os
+
+import numpy
+import pandas
+
+from Metrics import metrics
+from PriceStore import STORE_DIR, loadPanel, openPriceStore
+from Stock import Stock
+from StockUniverse import loadUniverse
+
+"""
+    行业聚合分析：按stocks.json中的行业，在整个股票池上计算每个交易日各行业的
+        macd_breadth    MACD大于等于0的股票占比
+        sma_breadth     收盘价在close_10_sma之上的股票占比
+        boll_breadth    收盘价不低于布林带上轨boll_ub的股票占比
+        return_<n>      最近n根K线收益率的行业中位数
+        roe             行业平均ROE（data/stockInfo.csv）
+    每支股票的递推状态（EMA的分子分母、最近若干根收盘价）保存为与股票池对齐的数组，
+    每个交易日对全部股票做一次数组运算，再用bincount和排序一次性按行业分组，不逐支股票、逐个行业循环。
+    指标的口径与stockstats（以及OnlineIndicators）相同；只统计当天有K线的股票，停牌的股票不参与当天的统计。
+    状态保存在data/industry_state.npz，收盘后只需读取新增的K线，全量重建与逐日增量得到的结果相同。
+    新增的K线从data/share_price/下的csv读取：preprocess.updateSharePrice只更新csv，不更新列式仓库。
+    @Author: zengshuang61@gmail.com
+"""
+
+STATE_PATH = 'data/industry_state.npz'
+HISTORY_PATH = 'result/industry_daily.csv'
+RETURN_WINDOWS = (1, 5, 20)
+# EMA的span，macd = close_12_ema - close_26_ema
+MACD_SPANS = (12, 26)
+SMA_WINDOW = 10
+BOLL_WINDOW = 20
+
+
+def groupMean(groups, values, count):
+    """
+        分组平均值，忽略NaN以及没有分组（-1）的元素
+    :param groups: 分组编号数组
+    :param values: 与groups对齐的数组
+    :param count: 分组数
+    :return: (平均值, 参与计算的个数)，长度为count
+    """
+    valid = (groups >= 0) & ~numpy.isnan(values)
+    n = numpy.bincount(groups[valid], minlength=count)
+    total = numpy.bincount(groups[valid], weights=values[valid], minlength=count)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.where(n > 0, total / n, numpy.nan), n
+
+
+def groupMedian(groups, values, count):
+    """
+        分组中位数：按(分组, 值)排序一次，再从每组的中间位置取值
+    :param groups: 分组编号数组
+    :param values: 与groups对齐的数组
+    :param count: 分组数
+    :return: 长度为count的数组，没有数据的分组为NaN
+    """
+    valid = (groups >= 0) & ~numpy.isnan(values)
+    groups, values = groups[valid], values[valid]
+    order = numpy.lexsort((values, groups))
+    values = values[order]
+    n = numpy.bincount(groups, minlength=count)
+    start = numpy.cumsum(n) - n
+    ret = numpy.full(count, numpy.nan)
+    has = n > 0
+    lo = start[has] + (n[has] - 1) // 2
+    hi = start[has] + n[has] // 2
+    ret[has] = (values[lo] + values[hi]) / 2
+    return ret
+
+
+def loadROE(universe, info_path='data/stockInfo.csv'):
+    """
+        与股票池对齐的ROE(%)，来源与process.sortStockByROE相同
+    :param universe: StockUniverse
+    :param info_path: getStockInfoAsync保存的csv
+    :return: 没有数据的股票为NaN
+    """
+    roe = numpy.full(len(universe), numpy.nan)
+    if not os.path.exists(info_path):
+        return roe
+    info = pandas.read_csv(info_path, dtype={'代码': str}).dropna(subset=['ROE(%)'])
+    for code, value in zip(info['代码'], info['ROE(%)']):
+        if code in universe:
+            roe[universe.row(code)] = value
+    return roe
+
+
+class IndustryAnalytics(object):
+    def __init__(self, universe, roe=None, windows=RETURN_WINDOWS):
+        """
+        :param universe: StockUniverse，决定股票和行业
+        :param roe: 与股票池对齐的ROE数组，默认读取data/stockInfo.csv
+        :param windows: 收益率的K线数
+        """
+        self.universe = universe
+        self.roe = loadROE(universe) if roe is None else numpy.asarray(roe, dtype=numpy.float64)
+        self.windows = tuple(windows)
+        n = len(universe)
+        # 保存最近width根收盘价，最后一列为最新，close_10_sma、boll以及boll_ub的滚动标准差都由它计算
+        self.width = max(BOLL_WINDOW, SMA_WINDOW, max(self.windows) + 1)
+        self.alphas = numpy.array([2.0 / (span + 1) for span in MACD_SPANS])
+        self.numerator = numpy.zeros((n, len(MACD_SPANS)))
+        self.denominator = numpy.zeros((n, len(MACD_SPANS)))
+        self.closes = numpy.full((n, self.width), numpy.nan)
+        self.last_date = numpy.full(n, numpy.datetime64('NaT'), dtype='M8[D]')
+        self.date = numpy.datetime64('NaT', 'D')
+
+    def update(self, date, close):
+        """
+            加入一个交易日的收盘价，返回当天的行业统计；不晚于已处理的最后一个交易日时不做任何事
+        :param date: 交易日
+        :param close: 与股票池对齐的收盘价数组，当天没有K线的股票为NaN
+        :return: DataFrame，或者None
+        """
+        date = numpy.datetime64(date, 'D')
+        if not numpy.isnat(self.date) and date <= self.date:
+            return None
+        close = numpy.asarray(close, dtype=numpy.float64)
+        rows = numpy.flatnonzero(~numpy.isnan(close))
+        today = close[rows]
+
+        decay = 1 - self.alphas
+        self.numerator[rows] = today[:, None] + decay * self.numerator[rows]
+        self.denominator[rows] = 1 + decay * self.denominator[rows]
+        closes = self.closes[rows]
+        closes[:, :-1] = closes[:, 1:]
+        closes[:, -1] = today
+        self.closes[rows] = closes
+        self.last_date[rows] = date
+        self.date = date
+        metrics.count('industry_days')
+        return self.__summary(date, rows, closes)
+
+    def __summary(self, date, rows, closes):
+        """
+            当天有K线的股票按行业分组统计
+        :param date: 交易日
+        :param rows: 当天有K线的股票的行号
+        :param closes: 这些股票最近width根收盘价
+        :return: DataFrame，每个行业一行
+        """
+        today = closes[:, -1]
+        ema = self.numerator[rows] / self.denominator[rows]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            sma = numpy.nanmean(closes[:, -SMA_WINDOW:], axis=1)
+            window = closes[:, -BOLL_WINDOW:]
+            boll = numpy.nanmean(window, axis=1)
+            # 与stockstats相同：close_20_mstd为ddof=1的标准差，只有一根K线时为NaN，此时不计入
+            n = numpy.sum(~numpy.isnan(window), axis=1)
+            mstd = numpy.sqrt(numpy.nansum((window - boll[:, None]) ** 2, axis=1) / (n - 1))
+            boll_ub = boll + 2 * numpy.where(n > 1, mstd, numpy.nan)
+        columns = {
+            'macd_breadth': (ema[:, 0] - ema[:, 1] >= 0).astype(numpy.float64),
+            'sma_breadth': (today > sma).astype(numpy.float64),
+            'boll_breadth': (today >= boll_ub).astype(numpy.float64),
+        }
+
+        groups = self.universe.industry[rows]
+        count = len(self.universe.industries)
+        ret = {'date': str(date), 'industry': list(self.universe.industries),
+               'stocks': numpy.bincount(groups[groups >= 0], minlength=count)}
+        for name, values in columns.items():
+            ret[name] = groupMean(groups, values, count)[0]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            for window in self.windows:
+                ret['return_{}'.format(window)] = groupMedian(groups, today / closes[:, -1 - window] - 1, count)
+        ret['roe'] = groupMean(self.universe.industry, self.roe, count)[0]
+        df = pandas.DataFrame(ret)
+        columns = ['date', 'industry', 'stocks'] + list(columns) + ['return_{}'.format(w) for w in self.windows] + ['roe']
+        return df.loc[df['stocks'] > 0, columns].reset_index(drop=True)
+
+    def replay(self, panel):
+        """
+            全量重建：按交易日依次把面板上的K线交给update
+        :param panel: PriceStore.loadPanel得到的tushare格式面板（需要date、close列）
+        :return: 每个交易日的行业统计拼接成的DataFrame
+        """
+        rows = numpy.array([self.universe.row(code) for code in panel['codes']], dtype=numpy.int64)
+        dates, length = panel['date'], panel['length']
+        # 只处理晚于状态中最后一个交易日的K线
+        pos = numpy.zeros(len(rows), dtype=numpy.int64)
+        if not numpy.isnat(self.date):
+            pos = numpy.sum(dates <= self.date, axis=1)
+        calendar = numpy.unique(dates[~numpy.isnat(dates)])
+        if not numpy.isnat(self.date):
+            calendar = calendar[calendar > self.date]
+        frames = []
+        index = numpy.arange(len(rows))
+        for date in calendar:
+            active = index[pos < length]
+            active = active[dates[active, pos[active]] == date]
+            close = numpy.full(len(self.universe), numpy.nan)
+            close[rows[active]] = panel['close'][active, pos[active]]
+            pos[active] += 1
+            with metrics.stage('industry_update'):
+                frames.append(self.update(date, close))
+        if not frames:
+            return pandas.DataFrame()
+        return pandas.concat(frames, ignore_index=True)
+
+    def snapshot(self):
+        """
+            当前状态下各行业的统计（最后一个交易日有K线的股票）
+        :return:
+        """
+        rows = numpy.flatnonzero(self.last_date == self.date)
+        return self.__summary(self.date, rows, self.closes[rows])
+
+    def save(self, path=STATE_PATH):
+        """
+            保存全部状态，先写临时文件再替换
+        :param path: 保存位置
+        :return:
+        """
+        with open(path + '.tmp', 'wb') as f:
+            numpy.savez(f, codes=self.universe.codes, windows=numpy.asarray(self.windows), numerator=self.numerator,
+                        denominator=self.denominator, closes=self.closes, last_date=self.last_date,
+                        date=numpy.asarray(self.date))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, universe, path=STATE_PATH, roe=None):
+        """
+            从save保存的文件恢复，股票池有变化时按股票代码重新对齐，新增的股票从头开始
+        :param universe: StockUniverse
+        :param path: 文件位置
+        :param roe: 与股票池对齐的ROE数组，默认读取data/stockInfo.csv
+        :return: IndustryAnalytics
+        """
+        with numpy.load(path, allow_pickle=False) as data:
+            analytics = cls(universe, roe, data['windows'].tolist())
+            old = [universe.row(code.decode()) if code.decode() in universe else -1 for code in data['codes']]
+            old = numpy.asarray(old, dtype=numpy.int64)
+            kept = old >= 0
+            analytics.numerator[old[kept]] = data['numerator'][kept]
+            analytics.denominator[old[kept]] = data['denominator'][kept]
+            analytics.closes[old[kept]] = data['closes'][kept]
+            analytics.last_date[old[kept]] = data['last_date'][kept]
+            analytics.date = data['date'][()]
+        return analytics
+
+
+def newBars(universe, since=None):
+    """
+        读取全部股票在since之后的收盘价，按交易日分组。
+        总是读取csv：updateSharePrice每天只追加csv，列式仓库要等下一次PriceStore.py转换才会包含新的K线
+    :param universe: StockUniverse
+    :param since: 已经处理过的最后一个交易日，None表示全部
+    :return: [(交易日, 与股票池对齐的收盘价数组)]，按交易日升序
+    """
+    start = None if since is None or numpy.isnat(since) else str(since + numpy.timedelta64(1, 'D'))
+    rows, dates, closes = [], [], []
+    for i, code in enumerate(universe.codesOf()):
+        df = Stock(code).getHisPriceData(startTime=start)
+        if df is None or len(df) == 0:
+            continue
+        rows.append(numpy.full(len(df), i))
+        dates.append(numpy.asarray(df['date'], dtype='M8[D]'))
+        closes.append(numpy.asarray(df['close'], dtype=numpy.float64))
+    if not rows:
+        return []
+    rows, dates, closes = numpy.concatenate(rows), numpy.concatenate(dates), numpy.concatenate(closes)
+    if start is not None:
+        keep = dates >= numpy.datetime64(start, 'D')
+        rows, dates, closes = rows[keep], dates[keep], closes[keep]
+    ret = []
+    for date in numpy.unique(dates):
+        close = numpy.full(len(universe), numpy.nan)
+        today = dates == date
+        close[rows[today]] = closes[today]
+        ret.append((date, close))
+    return ret
+
+
+def refreshIndustries(universe=None, state_path=STATE_PATH, history_path=HISTORY_PATH, hist_store=None):
+    """
+        收盘后的更新：没有保存的状态时先从面板全量重建，之后只读取csv中新增的K线并把这些交易日的统计追加到历史文件
+    :param universe: StockUniverse，默认loadUniverse()
+    :param state_path: 状态文件
+    :param history_path: 每日行业统计的csv
+    :param hist_store: 全量重建时读取面板用的share_price仓库，默认打开data/price_store/share_price；
+                       源csv在转换之后更新过的股票由loadPanel改为读取csv
+    :return: 最新交易日的行业统计
+    """
+    universe = universe or loadUniverse()
+    history_dir = os.path.dirname(history_path)
+    if history_dir and not os.path.exists(history_dir):
+        os.makedirs(history_dir)
+
+    if os.path.exists(state_path) and os.path.exists(history_path):
+        analytics = IndustryAnalytics.load(universe, state_path)
+    else:
+        hist_store = hist_store or openPriceStore(os.path.join(STORE_DIR, 'share_price'))
+        analytics = IndustryAnalytics(universe)
+        panel = loadPanel(universe.codesOf(), ['close'], price_store=hist_store, csv_dir='data/share_price/')
+        history = analytics.replay(panel)
+        if len(history):
+            history.to_csv(history_path + '.tmp', index=False, encoding='utf-8')
+            os.replace(history_path + '.tmp', history_path)
+
+    frames = []
+    for date, close in newBars(universe, analytics.date):
+        with metrics.stage('industry_update'):
+            frames.append(analytics.update(date, close))
+    frames = [df for df in frames if df is not None]
+    if frames:
+        pandas.concat(frames, ignore_index=True).to_csv(history_path, mode='a', index=False, encoding='utf-8',
+                                                        header=not os.path.exists(history_path))
+    analytics.save(state_path)
+    return analytics.snapshot()
+
+
+if __name__ == '__main__':
+    # 第一次运行时全量重建，之后每天收盘、updateSharePriceOfCodes之后再运行，只处理新增的交易日
+    latest = refreshIndustries()
+    print(latest.sort_values(by='macd_breadth', ascending=False).to_string(index=False))
+    metrics.report()
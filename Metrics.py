@@ -0,0 +1,166 @@
+import collections
+import contextlib
+import json
+import threading
+import time
+
+"""
+    运行指标：按阶段（读取csv、stockstats转换、指标计算、策略回测、写结果等）累计墙上时间和CPU时间，
+    同时记录每支股票在各阶段的耗时，以及行数、文件数、失败次数、重试次数等计数，
+    可以导出为JSON或Prometheus的文本格式，代替逐支股票的控制台输出
+    @Author: zengshuang61@gmail.com
+"""
+
+# 下载使用线程池，CPU时间按线程统计；没有thread_time的Python版本退回到进程CPU时间
+_cpuTime = getattr(time, 'thread_time', time.process_time)
+
+
+class Metrics(object):
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            # 阶段 -> [调用次数, 墙上时间, CPU时间, 单次最长墙上时间]
+            self.__stages = collections.OrderedDict()
+            self.__counters = collections.Counter()
+            # 股票代码 -> {阶段: [墙上时间, CPU时间]}
+            self.__items = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name, key=None):
+        """
+            统计with语句块的耗时，异常时也会记录
+        :param name: 阶段名称，例如csv_read
+        :param key: 股票代码等，指定时同时记录到这支股票名下
+        :return:
+        """
+        start_wall = time.perf_counter()
+        start_cpu = _cpuTime()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_wall, _cpuTime() - start_cpu, key)
+
+    def record(self, name, wall, cpu, key=None):
+        with self.__lock:
+            stage = self.__stages.setdefault(name, [0, 0.0, 0.0, 0.0])
+            stage[0] += 1
+            stage[1] += wall
+            stage[2] += cpu
+            stage[3] = max(stage[3], wall)
+            if key is not None:
+                item = self.__items.setdefault(key, {}).setdefault(name, [0.0, 0.0])
+                item[0] += wall
+                item[1] += cpu
+
+    def count(self, name, n=1):
+        """
+            累加计数，例如rows、files、failures、retries
+        :param name: 计数名称
+        :param n: 增量
+        :return:
+        """
+        with self.__lock:
+            self.__counters[name] += n
+
+    def counter(self, name):
+        return self.__counters[name]
+
+    def snapshot(self):
+        """
+            可以序列化的全部数据，子进程把它随结果一起返回，由主进程merge
+        :return:
+        """
+        with self.__lock:
+            return {
+                'stages': {name: list(stage) for name, stage in self.__stages.items()},
+                'counters': dict(self.__counters),
+                'items': {key: {name: list(v) for name, v in item.items()} for key, item in self.__items.items()},
+            }
+
+    def merge(self, snapshot):
+        """
+            合并另一个进程的snapshot
+        :param snapshot: Metrics.snapshot()的返回值
+        :return:
+        """
+        with self.__lock:
+            for name, (calls, wall, cpu, longest) in snapshot['stages'].items():
+                stage = self.__stages.setdefault(name, [0, 0.0, 0.0, 0.0])
+                stage[0] += calls
+                stage[1] += wall
+                stage[2] += cpu
+                stage[3] = max(stage[3], longest)
+            self.__counters.update(snapshot['counters'])
+            for key, item in snapshot['items'].items():
+                target = self.__items.setdefault(key, {})
+                for name, (wall, cpu) in item.items():
+                    values = target.setdefault(name, [0.0, 0.0])
+                    values[0] += wall
+                    values[1] += cpu
+
+    def summary(self, items=False):
+        """
+            汇总
+        :param items: 是否包含每支股票的耗时
+        :return: dict
+        """
+        snapshot = self.snapshot()
+        ret = {
+            'stages': {name: {'calls': calls, 'wall': wall, 'cpu': cpu, 'maxWall': longest,
+                              'meanWall': wall / calls if calls else 0.0}
+                       for name, (calls, wall, cpu, longest) in snapshot['stages'].items()},
+            'counters': snapshot['counters'],
+        }
+        if items:
+            ret['items'] = snapshot['items']
+        return ret
+
+    def writeJSON(self, path, items=True):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(items), f, ensure_ascii=False, indent=2)
+
+    def toPrometheus(self, prefix='stock'):
+        """
+            Prometheus的文本格式（text exposition format），可以交给node_exporter的textfile收集器
+        :param prefix: 指标名前缀
+        :return: str
+        """
+        summary = self.summary()
+        lines = ['# TYPE {}_stage_calls_total counter'.format(prefix)]
+        for name, stage in summary['stages'].items():
+            lines.append('{}_stage_calls_total{{stage="{}"}} {}'.format(prefix, name, stage['calls']))
+        lines.append('# TYPE {}_stage_seconds_total counter'.format(prefix))
+        for name, stage in summary['stages'].items():
+            for clock in ('wall', 'cpu'):
+                lines.append('{}_stage_seconds_total{{stage="{}",clock="{}"}} {:.6f}'.format(prefix, name, clock,
+                                                                                             stage[clock]))
+        lines.append('# TYPE {}_stage_max_seconds gauge'.format(prefix))
+        for name, stage in summary['stages'].items():
+            lines.append('{}_stage_max_seconds{{stage="{}"}} {:.6f}'.format(prefix, name, stage['maxWall']))
+        lines.append('# TYPE {}_events_total counter'.format(prefix))
+        for name, value in sorted(summary['counters'].items()):
+            lines.append('{}_events_total{{name="{}"}} {}'.format(prefix, name, value))
+        return '\n'.join(lines) + '\n'
+
+    def writePrometheus(self, path, prefix='stock'):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.toPrometheus(prefix))
+
+    def report(self):
+        """
+            在控制台输出各阶段的耗时汇总，代替逐支股票的输出
+        :return:
+        """
+        summary = self.summary()
+        for name, stage in summary['stages'].items():
+            print('{:<16}\t{:>7}次\twall {:.3f}s\tcpu {:.3f}s\tmax {:.3f}s'.format(name, stage['calls'], stage['wall'],
+                                                                                stage['cpu'], stage['maxWall']))
+        for name, value in sorted(summary['counters'].items()):
+            print('{:<16}\t{}'.format(name, value))
+
+
+# 进程内共享的运行指标
+metrics = Metrics()
@@ -0,0 +1,620 @@
+import collections
+import math
+import os
+import pickle
+
+import pandas
+
+from RollingExtrema import RollingExtrema
+
+"""
+    增量指标引擎：为每支股票的17类指标保存递推状态（EMA的分子分母、滚动窗口的和、Wilder平滑、KDJ的递推值等），
+    每来一根新K线只更新一次状态，不需要像stockstats那样对全部历史重新计算。
+    约定：update返回的值与stockstats在"截止到这根K线的全部历史"上计算得到的最后一行相同，
+    因此close_1_d、close_2_d这类引用未来数据的列在最新一行上恒为0（stockstats同样以0填充）。
+    状态可以通过save保存到磁盘，load恢复后继续更新。
+    @Author: zengshuang61@gmail.com
+"""
+
+STATE_PATH = 'data/indicator_state.pkl'
+
+
+class EMA(object):
+    """
+        与pandas的ewm(adjust=True).mean()相同：value = Σ w^i·x(t-i) / Σ w^i，分子分母各自递推
+    """
+
+    def __init__(self, span=None, alpha=None):
+        self.alpha = alpha if alpha is not None else 2.0 / (span + 1)
+        self.numerator = 0.0
+        self.denominator = 0.0
+
+    def update(self, value):
+        decay = 1 - self.alpha
+        self.numerator = value + decay * self.numerator
+        self.denominator = 1 + decay * self.denominator
+        return self.numerator / self.denominator
+
+
+def SMMA(window):
+    """
+        Wilder平滑，stockstats中为ewm(alpha=1/window, adjust=True)
+    """
+    return EMA(alpha=1.0 / window)
+
+
+class RollingWindow(object):
+    """
+        滚动窗口（min_periods=1），维护窗口内的和与平方和，均值和标准差O(1)更新；
+        窗口内出现NaN或inf时与pandas一样跳过NaN，直接在窗口上计算
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = collections.deque(maxlen=size)
+        self.total = 0.0
+        self.squares = 0.0
+        self.nonfinite = 0
+
+    def update(self, value):
+        if len(self.values) == self.size:
+            self.__remove(self.values[0])
+        self.values.append(value)
+        if math.isfinite(value):
+            self.total += value
+            self.squares += value * value
+        else:
+            self.nonfinite += 1
+        return self
+
+    def __remove(self, value):
+        if math.isfinite(value):
+            self.total -= value
+            self.squares -= value * value
+        else:
+            self.nonfinite -= 1
+
+    def full(self):
+        return len(self.values) == self.size
+
+    def __valid(self):
+        return [value for value in self.values if not math.isnan(value)]
+
+    def sum(self):
+        if self.nonfinite:
+            return sum(self.__valid())
+        return self.total
+
+    def mean(self):
+        if self.nonfinite:
+            valid = self.__valid()
+            return sum(valid) / len(valid) if valid else float('nan')
+        return self.total / len(self.values)
+
+    def std(self):
+        """
+            样本标准差（ddof=1），只有一个值时为NaN
+        """
+        if self.nonfinite:
+            return float(pandas.Series(self.__valid()).std())
+        count = len(self.values)
+        if count < 2:
+            return float('nan')
+        variance = (self.squares - self.total * self.total / count) / (count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+
+class Lag(object):
+    """
+        保存最近n+1个值，get(k)返回k根K线之前的值，历史不足时返回第一个值（stockstats的s_shift）
+    """
+
+    def __init__(self, n):
+        self.values = collections.deque(maxlen=n + 1)
+        self.first = None
+
+    def update(self, value):
+        if self.first is None:
+            self.first = value
+        self.values.append(value)
+        return self
+
+    def get(self, k):
+        if k < len(self.values):
+            return self.values[-1 - k]
+        return self.first
+
+
+def _divide(a, b):
+    # stockstats._divide：除数为0或结果为NaN时为0
+    if b == 0:
+        return 0.0
+    ret = a / b
+    return 0.0 if math.isnan(ret) else ret
+
+
+def _pandasDivide(a, b):
+    # pandas的除法：x/0为inf，0/0为NaN
+    if b == 0:
+        if a == 0 or math.isnan(a):
+            return float('nan')
+        return math.copysign(float('inf'), a)
+    return a / b
+
+
+class VolumeDelta(object):
+    COLUMNS = ['volume', 'volume_delta']
+
+    def __init__(self):
+        self.previous = None
+
+    def update(self, open, high, low, close, volume):
+        delta = 0.0 if self.previous is None else volume - self.previous
+        self.previous = volume
+        return {'volume': volume, 'volume_delta': delta}
+
+
+class CloseDelta(object):
+    COLUMNS = ['close', 'close_delta']
+
+    def __init__(self):
+        self.previous = None
+
+    def update(self, open, high, low, close, volume):
+        delta = 0.0 if self.previous is None else close - self.previous
+        self.previous = close
+        return {'close': close, 'close_delta': delta}
+
+
+class CloseDiff(object):
+    COLUMNS = ['close', 'close_1_d', 'close_2_d', 'close_-1_d', 'close_-2_d']
+
+    def __init__(self):
+        self.closes = Lag(2)
+
+    def update(self, open, high, low, close, volume):
+        self.closes.update(close)
+        count = len(self.closes.values)
+        return {
+            'close': close,
+            'close_1_d': 0.0,
+            'close_2_d': 0.0,
+            'close_-1_d': close - self.closes.get(1) if count > 1 else 0.0,
+            'close_-2_d': close - self.closes.get(2) if count > 2 else 0.0,
+        }
+
+
+class CloseRate(object):
+    COLUMNS = ['close', 'close_-1_r', 'close_-2_r']
+
+    def __init__(self):
+        self.closes = Lag(2)
+
+    def update(self, open, high, low, close, volume):
+        self.closes.update(close)
+        count = len(self.closes.values)
+        ret = {'close': close}
+        for k in (1, 2):
+            previous = self.closes.get(k)
+            ret['close_-{}_r'.format(k)] = _pandasDivide(close - previous, previous) * 100 if count > k else 0.0
+        return ret
+
+
+class CR(object):
+    COLUMNS = ['close', 'cr', 'cr-ma1', 'cr-ma2', 'cr-ma3']
+    WINDOW = 26
+    MA = (5, 10, 20)
+
+    def __init__(self):
+        self.last_middle = None
+        self.p1 = RollingWindow(self.WINDOW)
+        self.p2 = RollingWindow(self.WINDOW)
+        self.ma = [RollingWindow(window) for window in self.MA]
+        # cr-maN是向过去平移了int(N/2.5+1)根K线的均线
+        self.lags = [Lag(int(window / 2.5 + 1)) for window in self.MA]
+
+    def update(self, open, high, low, close, volume):
+        middle = (close + high + low) / 3.0
+        last_middle = middle if self.last_middle is None else self.last_middle
+        self.last_middle = middle
+        self.p1.update(high - min(last_middle, high))
+        self.p2.update(last_middle - min(last_middle, low))
+        cr = _pandasDivide(self.p1.sum(), self.p2.sum()) * 100
+        ret = {'close': close, 'cr': cr}
+        for i, window in enumerate(self.MA):
+            lag = self.lags[i]
+            lag.update(self.ma[i].update(cr).mean())
+            ret['cr-ma{}'.format(i + 1)] = lag.get(int(window / 2.5 + 1))
+        return ret
+
+
+class KDJ(object):
+    COLUMNS = ['close', 'kdjk', 'kdjd', 'kdjj']
+    WINDOW = 9
+
+    def __init__(self):
+        self.low = RollingExtrema(self.WINDOW)
+        self.high = RollingExtrema(self.WINDOW)
+        self.k = 50.0
+        self.d = 50.0
+
+    def update(self, open, high, low, close, volume):
+        self.low.onNewValue(low)
+        self.high.onNewValue(high)
+        low_min = self.low.getMin()
+        rsv = _divide(close - low_min, self.high.getMax() - low_min) * 100
+        self.k = 2.0 / 3.0 * self.k + 1.0 / 3.0 * rsv
+        self.d = 2.0 / 3.0 * self.d + 1.0 / 3.0 * self.k
+        return {'close': close, 'kdjk': self.k, 'kdjd': self.d, 'kdjj': 3 * self.k - 2 * self.d}
+
+
+class SMA(object):
+    COLUMNS = ['close', 'close_5_sma', 'close_10_sma']
+
+    def __init__(self):
+        self.windows = [RollingWindow(5), RollingWindow(10)]
+
+    def update(self, open, high, low, close, volume):
+        return {
+            'close': close,
+            'close_5_sma': self.windows[0].update(close).mean(),
+            'close_10_sma': self.windows[1].update(close).mean(),
+        }
+
+
+class MACD(object):
+    COLUMNS = ['close', 'macd', 'macds', 'macdh']
+
+    def __init__(self):
+        self.short = EMA(12)
+        self.long = EMA(26)
+        self.signal = EMA(9)
+
+    def update(self, open, high, low, close, volume):
+        macd = self.short.update(close) - self.long.update(close)
+        macds = self.signal.update(macd)
+        return {'close': close, 'macd': macd, 'macds': macds, 'macdh': macd - macds}
+
+
+class BOLL(object):
+    COLUMNS = ['close', 'boll', 'boll_ub', 'boll_lb']
+
+    def __init__(self):
+        self.window = RollingWindow(20)
+
+    def update(self, open, high, low, close, volume):
+        self.window.update(close)
+        mean = self.window.mean()
+        width = 2 * self.window.std()
+        return {'close': close, 'boll': mean, 'boll_ub': mean + width, 'boll_lb': mean - width}
+
+
+class RSI(object):
+    COLUMNS = ['close', 'rsi_6', 'rsi_12']
+    WINDOWS = (6, 12)
+
+    def __init__(self):
+        self.previous = None
+        self.up = [SMMA(window) for window in self.WINDOWS]
+        self.down = [SMMA(window) for window in self.WINDOWS]
+
+    def update(self, open, high, low, close, volume):
+        first = self.previous is None
+        diff = 0.0 if first else close - self.previous
+        self.previous = close
+        ret = {'close': close}
+        for i, window in enumerate(self.WINDOWS):
+            up = self.up[i].update(max(diff, 0.0))
+            down = self.down[i].update(max(-diff, 0.0))
+            total = up + down
+            ret['rsi_{}'.format(window)] = 50.0 if first or total == 0 else 100 * (up / total)
+        return ret
+
+
+class WR(object):
+    COLUMNS = ['close', 'wr_10', 'wr_6']
+    WINDOWS = (10, 6)
+
+    def __init__(self):
+        self.low = [RollingExtrema(window) for window in self.WINDOWS]
+        self.high = [RollingExtrema(window) for window in self.WINDOWS]
+
+    def update(self, open, high, low, close, volume):
+        ret = {'close': close}
+        for i, window in enumerate(self.WINDOWS):
+            self.low[i].onNewValue(low)
+            self.high[i].onNewValue(high)
+            hn = self.high[i].getMax()
+            hn_ln = hn - self.low[i].getMin()
+            ret['wr_{}'.format(window)] = ((hn - close) / hn_ln if hn_ln != 0 else 0.0) * -100
+        return ret
+
+
+class CCI(object):
+    """
+        平均绝对偏差需要窗口内的全部值，每次更新为O(窗口大小)，窗口只有14和20
+    """
+    COLUMNS = ['close', 'cci', 'cci_20']
+    WINDOWS = (14, 20)
+
+    def __init__(self):
+        self.windows = [RollingWindow(window) for window in self.WINDOWS]
+
+    def update(self, open, high, low, close, volume):
+        tp = (close + high + low) / 3.0
+        ret = {'close': close}
+        for window, rolling in zip(self.WINDOWS, self.windows):
+            rolling.update(tp)
+            name = 'cci' if window == 14 else 'cci_{}'.format(window)
+            if not rolling.full():
+                ret[name] = float('nan')
+                continue
+            mean = rolling.mean()
+            mad = sum(abs(value - mean) for value in rolling.values) / window
+            ret[name] = (tp - mean) / (0.015 * mad) if mad != 0 else 0.0
+        return ret
+
+
+class TrueRange(object):
+    def __init__(self):
+        self.previous_close = None
+
+    def update(self, high, low, close):
+        previous = close if self.previous_close is None else self.previous_close
+        self.previous_close = close
+        return max(high - low, abs(high - previous), abs(low - previous))
+
+
+class ATR(object):
+    COLUMNS = ['close', 'tr', 'atr']
+
+    def __init__(self):
+        self.tr = TrueRange()
+        self.atr = SMMA(14)
+
+    def update(self, open, high, low, close, volume):
+        tr = self.tr.update(high, low, close)
+        return {'close': close, 'tr': tr, 'atr': self.atr.update(tr)}
+
+
+class DMA(object):
+    COLUMNS = ['close', 'dma']
+
+    def __init__(self):
+        self.fast = RollingWindow(10)
+        self.slow = RollingWindow(50)
+
+    def update(self, open, high, low, close, volume):
+        return {'close': close, 'dma': self.fast.update(close).mean() - self.slow.update(close).mean()}
+
+
+class DMI(object):
+    COLUMNS = ['close', 'pdi', 'mdi', 'dx', 'adx', 'adxr']
+    WINDOW = 14
+
+    def __init__(self):
+        self.previous = None
+        self.pdm = SMMA(self.WINDOW)
+        self.ndm = SMMA(self.WINDOW)
+        self.tr = TrueRange()
+        self.atr = SMMA(self.WINDOW)
+        self.adx = EMA(6)
+        self.adxr = EMA(6)
+
+    def update(self, open, high, low, close, volume):
+        if self.previous is None:
+            hd = ld = 0.0
+        else:
+            hd = high - self.previous[0]
+            ld = -(low - self.previous[1])
+        self.previous = (high, low)
+        pdm = self.pdm.update(hd if hd > 0 and hd > ld else 0.0)
+        ndm = self.ndm.update(ld if ld > 0 and ld > hd else 0.0)
+        atr = self.atr.update(self.tr.update(high, low, close))
+        pdi = _pandasDivide(pdm, atr) * 100
+        mdi = _pandasDivide(ndm, atr) * 100
+        total = pdi + mdi
+        dx = abs(pdi - mdi) / total * 100 if total != 0 else 0.0
+        adx = self.adx.update(dx)
+        return {'close': close, 'pdi': pdi, 'mdi': mdi, 'dx': dx, 'adx': adx, 'adxr': self.adxr.update(adx)}
+
+
+class TRIX(object):
+    COLUMNS = ['close', 'trix', 'trix_9_sma']
+
+    def __init__(self):
+        self.emas = [EMA(12), EMA(12), EMA(12)]
+        self.previous = None
+        self.sma = RollingWindow(9)
+
+    def update(self, open, high, low, close, volume):
+        triple = close
+        for ema in self.emas:
+            triple = ema.update(triple)
+        trix = 0.0 if self.previous is None else (_pandasDivide(triple, self.previous) - 1) * 100
+        self.previous = triple
+        return {'close': close, 'trix': trix, 'trix_9_sma': self.sma.update(trix).mean()}
+
+
+class VR(object):
+    COLUMNS = ['close', 'vr', 'vr_6_sma']
+    WINDOW = 26
+
+    def __init__(self):
+        self.previous = None
+        self.up = RollingWindow(self.WINDOW)
+        self.down = RollingWindow(self.WINDOW)
+        self.flat = RollingWindow(self.WINDOW)
+        self.sma = RollingWindow(6)
+
+    def update(self, open, high, low, close, volume):
+        change = 0.0 if self.previous is None else _pandasDivide(close - self.previous, self.previous)
+        self.previous = close
+        self.up.update(volume if change > 0 else 0.0)
+        self.down.update(volume if change < 0 else 0.0)
+        self.flat.update(volume if change == 0 else 0.0)
+        half = self.flat.sum() * 0.5
+        divisor = self.down.sum() + half
+        vr = (self.up.sum() + half) / divisor * 100 if divisor != 0 else 0.0
+        return {'close': close, 'vr': vr, 'vr_6_sma': self.sma.update(vr).mean()}
+
+
+# 与Stock中17个指标方法同名，列名与stockstats一致
+FAMILIES = collections.OrderedDict([
+    ('volumDelta', VolumeDelta),
+    ('closeDelta', CloseDelta),
+    ('n_d', CloseDiff),
+    ('n_openChangeInPercent', CloseRate),
+    ('CR', CR),
+    ('KDJ', KDJ),
+    ('SMA', SMA),
+    ('MACD', MACD),
+    ('BOLL', BOLL),
+    ('RSI', RSI),
+    ('WR', WR),
+    ('CCI', CCI),
+    ('ATR', ATR),
+    ('DMA', DMA),
+    ('DMI_DI_DX_ADX_ADXR', DMI),
+    ('TRIX_MATRIX', TRIX),
+    ('VR_MAVR', VR),
+])
+
+
+class IndicatorEngine(object):
+    """
+        全部股票的增量指标状态，每支股票记录最后一根K线的日期，重复送入已经处理过的K线会被忽略
+    """
+
+    def __init__(self, families=None):
+        """
+        :param families: 需要维护的指标，FAMILIES中的名称，默认全部17类
+        """
+        self.families = list(families or FAMILIES)
+        self.__states = {}
+
+    def __contains__(self, code):
+        return code in self.__states
+
+    def __len__(self):
+        return len(self.__states)
+
+    def codes(self):
+        return list(self.__states)
+
+    def lastDate(self, code):
+        return self.__states[code]['date'] if code in self.__states else None
+
+    def update(self, code, date, open, high, low, close, volume):
+        """
+            送入一根新K线，更新这支股票所有指标的状态
+        :param code: 股票代码
+        :param date: 日期字符串，例如2019-10-31，不晚于已处理的最后一根K线时忽略
+        :return: {列名: 值}，这根K线上的全部指标
+        """
+        state = self.__states.get(code)
+        if state is None:
+            state = {'date': None, 'families': {name: FAMILIES[name]() for name in self.families}, 'values': {}}
+            self.__states[code] = state
+        elif state['date'] is not None and date <= state['date']:
+            return state['values']
+        values = {}
+        for family in state['families'].values():
+            values.update(family.update(open, high, low, close, volume))
+        state['date'] = date
+        state['values'] = values
+        return values
+
+    def updateFrame(self, code, df):
+        """
+            按日期顺序送入一段K线，列名为tushare格式（date、open、high、low、close、volume），顺序不限
+        :param code: 股票代码
+        :param df: DataFrame
+        :return: 最后一根K线上的全部指标
+        """
+        df = df.sort_values(by='date')
+        last = self.lastDate(code)
+        if last is not None:
+            df = df[df['date'].astype(str) > last]
+        values = self.values(code)
+        for date, open, high, low, close, volume in zip(df['date'].astype(str), df['open'], df['high'], df['low'],
+                                                        df['close'], df['volume']):
+            values = self.update(code, date, float(open), float(high), float(low), float(close), float(volume))
+        return values
+
+    def values(self, code, family=None):
+        """
+            最新一根K线上的指标
+        :param code: 股票代码
+        :param family: 只返回某一类指标的列，例如MACD
+        :return: dict
+        """
+        values = self.__states[code]['values'] if code in self.__states else {}
+        if family is None:
+            return dict(values)
+        return {column: values.get(column) for column in FAMILIES[family].COLUMNS}
+
+    def latest(self, family=None):
+        """
+            全部股票最新一根K线上的指标
+        :param family: 只返回某一类指标的列
+        :return: 以股票代码为索引的DataFrame
+        """
+        df = pandas.DataFrame.from_dict({code: self.values(code, family) for code in self.__states}, orient='index')
+        df.insert(0, 'date', [self.__states[code]['date'] for code in df.index])
+        return df
+
+    def save(self, path=STATE_PATH):
+        """
+            保存全部状态，先写临时文件再替换
+        :param path: 保存位置
+        :return:
+        """
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({'families': self.families, 'states': self.__states}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path=STATE_PATH):
+        """
+            从save保存的文件恢复
+        :param path: 文件位置
+        :return: IndicatorEngine
+        """
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        engine = cls(data['families'])
+        engine.__states = data['states']
+        return engine
+
+
+def refreshIndicators(codes, engine=None, csv_dir='data/share_price/', state_path=STATE_PATH):
+    """
+        收盘后的增量刷新：恢复状态，每支股票只读取最后处理日期之后的K线（通过CSVIndex二分定位），更新后保存状态
+    :param codes: 股票代码列表
+    :param engine: 已有的引擎，默认从state_path恢复，文件不存在时新建并用全部历史初始化
+    :param csv_dir: tushare格式的股价数据目录
+    :param state_path: 状态文件
+    :return: IndicatorEngine
+    """
+    from CSVIndex import readCSVRange
+
+    if engine is None:
+        engine = IndicatorEngine.load(state_path) if os.path.exists(state_path) else IndicatorEngine()
+    for code in codes:
+        path = os.path.join(csv_dir, '{}.csv'.format(code))
+        if not os.path.exists(path):
+            continue
+        last = engine.lastDate(code)
+        start = None if last is None else str(pandas.Timestamp(last) + pandas.Timedelta(days=1))[:10]
+        engine.updateFrame(code, readCSVRange(path, startTime=start))
+    engine.save(state_path)
+    return engine
+
+
+if __name__ == '__main__':
+    # 第一次运行时用全部历史初始化状态，之后每天收盘更新股价数据后再运行，只处理新增的K线
+    from StockUniverse import loadUniverse
+
+    engine = refreshIndicators(loadUniverse().codesOf())
+    print(engine.latest('MACD').head())
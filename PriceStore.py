@@ -0,0 +1,312 @@
+import json
+import os
+import shutil
+
+import numpy
+import pandas
+
+from CSVIndex import searchRange, sourceStamp
+
+"""
+    列式股价仓库：把data/share_price/与data/share_price_processed/下几千个<code>.csv合并成按列存储的二进制文件，
+    读取时通过numpy.memmap内存映射，按(code, date)定位每支股票的数据切片，避免每次都重新解析csv。
+    目录结构（每个数据集一个目录）：
+        meta.json       列名、列文件、数据类型、总行数、日期列名以及源csv目录
+        codes.bin       股票代码，定长字节串S6，按写入顺序排列
+        offsets.bin     每支股票在各列中的起始行，长度为股票数+1，第i支股票的数据位于[offsets[i], offsets[i+1])
+        date.bin        日期列，datetime64[D]，每支股票内部升序
+        <column>.bin    其余数值列，float64
+        stamps.bin      转换时每个源csv的(大小, 修改时间ns)，int64，csv之后被更新过（例如preprocess.updateSharePrice）的股票视为不在仓库中，
+                        读取方自动回退到csv
+    @Author: zengshuang61@gmail.com
+"""
+
+STORE_DIR = 'data/price_store'
+CODE_DTYPE = 'S6'
+DATE_DTYPE = 'M8[D]'
+VALUE_DTYPE = '<f8'
+
+
+def columnFileName(column):
+    """
+        列名转换为文件名，例如Adj Close -> adj_close.bin
+    :param column: 列名
+    :return:
+    """
+    return '{}.bin'.format(column.strip().lower().replace(' ', '_'))
+
+
+def findDateColumn(columns):
+    """
+        tushare历史数据的日期列为date，pyalgotrade数据的日期列为Date
+    :param columns: csv的列名
+    :return:
+    """
+    for name in ('date', 'Date'):
+        if name in columns:
+            return name
+    raise ValueError('没有找到日期列：{}'.format(list(columns)))
+
+
+def convertCSVDir(csv_dir, store_dir, skip_columns=('code',)):
+    """
+        一次性转换：把csv_dir下所有<code>.csv按日期排序后追加写入store_dir下的列文件，
+        先写到临时目录，全部完成后再替换旧的仓库，转换中途失败不会破坏已有数据
+    :param csv_dir: csv目录，例如data/share_price/
+    :param store_dir: 仓库目录，例如data/price_store/share_price
+    :param skip_columns: 不写入仓库的列，code列由文件名决定
+    :return: 写入的股票数
+    """
+    tmp_dir = store_dir.rstrip('/') + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    file_names = sorted(name for name in os.listdir(csv_dir) if name.endswith('.csv'))
+    codes = []
+    offsets = [0]
+    stamps = []
+    columns = None
+    date_column = None
+    handles = {}
+    try:
+        for file_name in file_names:
+            code = file_name[:-4]
+            try:
+                # 先记录再读取，读取期间被更新的csv会被判为过期
+                stamp = sourceStamp(os.path.join(csv_dir, file_name))
+                df = pandas.read_csv(os.path.join(csv_dir, file_name))
+            except Exception:
+                print('{} 读取失败，略过！'.format(file_name))
+                continue
+            if columns is None:
+                date_column = findDateColumn(df.columns)
+                columns = [c for c in df.columns if c != date_column and c not in skip_columns]
+                handles[date_column] = open(os.path.join(tmp_dir, 'date.bin'), 'wb')
+                for column in columns:
+                    handles[column] = open(os.path.join(tmp_dir, columnFileName(column)), 'wb')
+            df = df.sort_values(by=date_column)
+            numpy.asarray(df[date_column], dtype=DATE_DTYPE).tofile(handles[date_column])
+            for column in columns:
+                numpy.asarray(df[column], dtype=VALUE_DTYPE).tofile(handles[column])
+            codes.append(code)
+            offsets.append(offsets[-1] + len(df))
+            stamps.append(stamp)
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    numpy.asarray(codes, dtype=CODE_DTYPE).tofile(os.path.join(tmp_dir, 'codes.bin'))
+    numpy.asarray(offsets, dtype='<i8').tofile(os.path.join(tmp_dir, 'offsets.bin'))
+    numpy.asarray(stamps, dtype='<i8').reshape(-1, 2).tofile(os.path.join(tmp_dir, 'stamps.bin'))
+    meta = {
+        'date_column': date_column,
+        'columns': [[column, columnFileName(column)] for column in (columns or [])],
+        'rows': offsets[-1],
+        'count': len(codes),
+        'source_dir': csv_dir,
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.rename(tmp_dir, store_dir)
+    return len(codes)
+
+
+def columnsToFrame(data, date_column):
+    """
+        getColumns的结果转换为DataFrame，日期转换为字符串，数值列直接引用原来的数组
+    :param data: {列名: numpy数组}
+    :param date_column: 日期列名
+    :return:
+    """
+    if date_column in data:
+        data[date_column] = numpy.datetime_as_string(data[date_column], unit='D')
+    return pandas.DataFrame(data, copy=False)
+
+
+class PriceStore(object):
+    """
+        只读的列式股价仓库，所有列都以memmap方式打开，getColumns返回的是映射文件上的切片视图，不发生拷贝。
+        code in store只对源csv在转换之后没有变化的股票成立，调用方据此决定读取仓库还是csv
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.date_column = meta['date_column']
+        self.columns = [column for column, _ in meta['columns']]
+        self.__files = dict(meta['columns'])
+        self.__rows = meta['rows']
+        self.__count = meta['count']
+        self.__codes = self.__map('codes.bin', CODE_DTYPE, self.__count)
+        self.__offsets = self.__map('offsets.bin', '<i8', self.__count + 1)
+        self.__dates = self.__map('date.bin', DATE_DTYPE, self.__rows)
+        # 旧版本转换的仓库没有源csv的记录
+        self.source_dir = meta.get('source_dir')
+        self.__stamps = None
+        if self.source_dir is not None:
+            self.__stamps = self.__map('stamps.bin', '<i8', self.__count * 2).reshape(-1, 2)
+        self.__values = {}
+        self.__code2Row = {code.decode(): i for i, code in enumerate(self.__codes)}
+
+    def __map(self, file_name, dtype, shape):
+        if shape == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(os.path.join(self.store_dir, file_name), dtype=dtype, mode='r', shape=(shape,))
+
+    def __contains__(self, code):
+        return code in self.__code2Row and self.isFresh(code)
+
+    def isFresh(self, code):
+        """
+            仓库中这支股票的数据是否与源csv一致：源csv的(大小, 修改时间ns)与转换时完全相同，或者源csv已经不存在；
+            没有记录源csv的旧仓库一律视为过期，需要重新转换
+        :param code: 仓库中的股票代码
+        :return:
+        """
+        if self.__stamps is None:
+            return False
+        try:
+            stamp = sourceStamp(os.path.join(self.source_dir, '{}.csv'.format(code)))
+        except OSError:
+            return True
+        return tuple(int(value) for value in self.__stamps[self.__code2Row[code]]) == stamp
+
+    def __len__(self):
+        return self.__count
+
+    def codes(self):
+        return list(self.__code2Row)
+
+    def rowRange(self, code):
+        """
+            股票code在各列中的行区间[lo, hi)
+        :param code: 股票代码
+        :return:
+        """
+        i = self.__code2Row[code]
+        return int(self.__offsets[i]), int(self.__offsets[i + 1])
+
+    def rangeRows(self, code, startTime=None, endTime=None):
+        """
+            在股票code的日期切片上二分查找[startTime, endTime]，只会访问memmap中很少的几页
+        :param code: 股票代码
+        :param startTime: 开始时间，None表示不限
+        :param endTime: 结束时间（包含），None表示不限
+        :return: 行区间[lo, hi)
+        """
+        lo, hi = self.rowRange(code)
+        start, end = searchRange(self.__dates[lo:hi], startTime, endTime)
+        return lo + start, lo + end
+
+    def column(self, name):
+        """
+            整列的memmap，第一次访问时才打开
+        :param name: 列名，日期列或meta.json中记录的数值列
+        :return:
+        """
+        if name == self.date_column:
+            return self.__dates
+        if name not in self.__values:
+            self.__values[name] = self.__map(self.__files[name], VALUE_DTYPE, self.__rows)
+        return self.__values[name]
+
+    def getColumns(self, code, columns=None, startTime=None, endTime=None):
+        """
+            获取某支股票的各列数据，返回的是memmap上的切片视图（只读、零拷贝）
+        :param code: 股票代码
+        :param columns: 需要的列，默认全部列（包含日期列）
+        :param startTime: 开始时间，None表示不限
+        :param endTime: 结束时间（包含），None表示不限
+        :return: {列名: numpy数组}
+        """
+        lo, hi = self.rangeRows(code, startTime, endTime)
+        if columns is None:
+            columns = [self.date_column] + self.columns
+        return {name: self.column(name)[lo:hi] for name in columns}
+
+    def getFrame(self, code, columns=None, startTime=None, endTime=None):
+        """
+            以DataFrame的形式返回某支股票的数据，列与pandas.read_csv读取原csv的结果一致（日期为字符串，按日期升序），
+            数值列直接引用memmap视图
+        :param code: 股票代码
+        :param columns: 需要的列，默认全部列
+        :param startTime: 开始时间，None表示不限
+        :param endTime: 结束时间（包含），None表示不限
+        :return:
+        """
+        df = columnsToFrame(self.getColumns(code, columns, startTime, endTime), self.date_column)
+        if columns is None:
+            df['code'] = code
+        return df
+
+
+def loadPanel(codes, columns, price_store=None, csv_dir='data/share_price_processed', reader=None):
+    """
+        把多支股票的数据读取为左对齐的面板：第i行第j列是第i支股票按日期升序的第j行数据，不足的部分用NaN（日期为NaT）填充
+    :param codes: 股票代码列表
+    :param columns: 需要的数值列
+    :param price_store: 对应数据集的PriceStore，为None、不包含该股票或者源csv已经更新过时读取csv
+    :param csv_dir: csv目录
+    :param reader: 读取一支股票数据的函数reader(code) -> DataFrame，默认读取csv_dir下的<code>.csv
+    :return: dict，包含codes、length、日期列（datetime64[D]，键为数据集的日期列名）以及columns中的各列，都是(股票数 × 最大行数)的数组
+    """
+    frames = []
+    loaded = []
+    date_column = price_store.date_column if price_store is not None else None
+    for code in codes:
+        if price_store is not None and code in price_store:
+            data = price_store.getColumns(code, [date_column] + list(columns))
+        else:
+            try:
+                if reader is not None:
+                    df = reader(code)
+                else:
+                    df = pandas.read_csv(os.path.join(csv_dir, '{}.csv'.format(code)))
+            except Exception:
+                print('股票代码为 {} 的股价数据读取失败，略过！'.format(code))
+                continue
+            date_column = date_column or findDateColumn(df.columns)
+            df = df.sort_values(by=date_column)
+            data = {name: df[name].values for name in [date_column] + list(columns)}
+        frames.append(data)
+        loaded.append(code)
+
+    length = numpy.array([len(data[date_column]) for data in frames], dtype=numpy.int64)
+    width = int(length.max()) if len(length) else 0
+    panel = {'codes': loaded, 'length': length}
+    if date_column is not None:
+        panel[date_column] = numpy.full((len(frames), width), numpy.datetime64('NaT'), dtype=DATE_DTYPE)
+    for name in columns:
+        panel[name] = numpy.full((len(frames), width), numpy.nan)
+    for i, data in enumerate(frames):
+        n = length[i]
+        panel[date_column][i, :n] = numpy.asarray(data[date_column], dtype=DATE_DTYPE)
+        for name in columns:
+            panel[name][i, :n] = data[name]
+    return panel
+
+
+def openPriceStore(store_dir):
+    """
+        打开仓库，还没有转换过时返回None，调用方回退到读取csv
+    :param store_dir: 仓库目录
+    :return:
+    """
+    if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+        return None
+    return PriceStore(store_dir)
+
+
+if __name__ == '__main__':
+    # 一次性把两类csv股价数据转换成列式仓库
+    if not os.path.exists(STORE_DIR):
+        os.makedirs(STORE_DIR)
+    for csv_dir, name in (('data/share_price/', 'share_price'), ('data/share_price_processed/', 'share_price_processed')):
+        if os.path.exists(csv_dir):
+            count = convertCSVDir(csv_dir, os.path.join(STORE_DIR, name))
+            print('{} 转换完成，共{}支股票'.format(csv_dir, count))
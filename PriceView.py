@@ -0,0 +1,141 @@
+import os
+from collections import OrderedDict
+
+import numpy
+import pandas
+
+from CSVIndex import readCSVRange
+from PriceStore import STORE_DIR, columnsToFrame, openPriceStore
+
+"""
+    股价视图：只下载一份tushare格式的股价数据（data/share_price/，见preprocess.fetchSharePrice，开高低收为近7年的前复权价格），
+    PyAlgo需要的Date、Open、High、Low、Close、Volume、Adj Close由视图按列名映射得到，不再单独下载share_price_processed。
+        PriceView       包装share_price对应的PriceStore，接口与PriceStore相同，列是原仓库memmap上的切片，Adj Close与close是同一个数组
+        pyalgoFrame     把tushare格式的DataFrame改成PyAlgo的列名并按日期升序排列，只引用原来的列数组
+        readPyAlgoCSV   读取一支股票的PyAlgo格式数据，旧的share_price_processed/<code>.csv存在时仍然读取它
+    @Author: zengshuang61@gmail.com
+"""
+
+PYALGO_DIR = 'data/share_price_processed'
+HIST_DIR = 'data/share_price'
+
+# PyAlgo列名 -> tushare列名，顺序与原来share_price_processed下的csv一致；close已经是前复权价格，与原来的Adj Close相同
+PYALGO_COLUMNS = OrderedDict([('Date', 'date'), ('Open', 'open'), ('Close', 'close'), ('High', 'high'),
+                              ('Low', 'low'), ('Volume', 'volume'), ('Adj Close', 'close')])
+
+
+class PriceView(object):
+    """
+        以另一套列名呈现的只读PriceStore，不复制任何数据
+    """
+
+    def __init__(self, store, columns=PYALGO_COLUMNS):
+        """
+        :param store: 原始数据的PriceStore，例如data/price_store/share_price
+        :param columns: {视图列名: 原始列名}，必须包含原始仓库的日期列
+        """
+        self.store = store
+        self.__columns = OrderedDict(columns)
+        self.date_column = next(name for name, source in self.__columns.items() if source == store.date_column)
+        self.columns = [name for name in self.__columns if name != self.date_column]
+
+    def __contains__(self, code):
+        return code in self.store
+
+    def __len__(self):
+        return len(self.store)
+
+    def codes(self):
+        return self.store.codes()
+
+    def rowRange(self, code):
+        return self.store.rowRange(code)
+
+    def rangeRows(self, code, startTime=None, endTime=None):
+        return self.store.rangeRows(code, startTime, endTime)
+
+    def column(self, name):
+        return self.store.column(self.__columns[name])
+
+    def getColumns(self, code, columns=None, startTime=None, endTime=None):
+        """
+            与PriceStore.getColumns相同，列名为视图的列名
+        :param code: 股票代码
+        :param columns: 需要的列，默认全部列（包含日期列）
+        :param startTime: 开始时间，None表示不限
+        :param endTime: 结束时间（包含），None表示不限
+        :return: {列名: numpy数组}
+        """
+        lo, hi = self.rangeRows(code, startTime, endTime)
+        if columns is None:
+            columns = [self.date_column] + self.columns
+        return {name: self.column(name)[lo:hi] for name in columns}
+
+    def getFrame(self, code, columns=None, startTime=None, endTime=None):
+        """
+            与PriceStore.getFrame相同，列名为视图的列名
+        :param code: 股票代码
+        :param columns: 需要的列，默认全部列
+        :param startTime: 开始时间，None表示不限
+        :param endTime: 结束时间（包含），None表示不限
+        :return:
+        """
+        df = columnsToFrame(self.getColumns(code, columns, startTime, endTime), self.date_column)
+        if columns is None:
+            df['code'] = code
+        return df
+
+
+def pyalgoFrame(df, columns=PYALGO_COLUMNS):
+    """
+        把tushare格式的DataFrame改成PyAlgo要求的格式，日期升序；原数据已经按日期排好序（升序或降序）时只引用原来的列数组
+    :param df: Stock.getHisPriceData或pandas.read_csv读取的share_price数据
+    :param columns: {视图列名: 原始列名}
+    :return:
+    """
+    dates = df['date']
+    if dates.is_monotonic_increasing:
+        rows = slice(None)
+    elif dates.is_monotonic_decreasing:
+        # tushare的数据是降序的，倒序切片仍然是视图
+        rows = slice(None, None, -1)
+    else:
+        rows = numpy.argsort(dates.to_numpy(), kind='stable')
+    data = OrderedDict((name, df[source].to_numpy()[rows]) for name, source in columns.items())
+    if 'code' in df:
+        data['code'] = df['code'].to_numpy()[rows]
+    return pandas.DataFrame(data, copy=False)
+
+
+def readPyAlgoCSV(code, startTime=None, endTime=None, csv_dir=PYALGO_DIR, hist_dir=HIST_DIR):
+    """
+        读取一支股票的PyAlgo格式数据：旧的PyAlgo格式csv存在时直接读取，否则读取tushare格式的csv再通过pyalgoFrame转换
+    :param code: 股票代码
+    :param startTime: 开始时间，None表示不限
+    :param endTime: 结束时间（包含），None表示不限
+    :param csv_dir: PyAlgo格式的csv目录
+    :param hist_dir: tushare格式的csv目录
+    :return: DataFrame
+    """
+    path = os.path.join(csv_dir, '{}.csv'.format(code))
+    if not os.path.exists(path):
+        path = os.path.join(hist_dir, '{}.csv'.format(code))
+        if startTime or endTime:
+            return pyalgoFrame(readCSVRange(path, startTime, endTime))
+        return pyalgoFrame(pandas.read_csv(path, dtype={'code': str}))
+    if startTime or endTime:
+        return readCSVRange(path, startTime, endTime)
+    return pandas.read_csv(path)
+
+
+def openPyAlgoStore(store_dir=STORE_DIR):
+    """
+        PyAlgo格式的仓库：转换过旧的share_price_processed时使用它，否则使用share_price仓库的视图
+    :param store_dir: 仓库的根目录
+    :return: PriceStore、PriceView，都没有转换过时返回None
+    """
+    store = openPriceStore(os.path.join(store_dir, 'share_price_processed'))
+    if store is not None:
+        return store
+    store = openPriceStore(os.path.join(store_dir, 'share_price'))
+    return None if store is None else PriceView(store)
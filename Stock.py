@@ -4,6 +4,13 @@ import matplotlib.pyplot as plt
 import pandas
 import stockstats
 
+from CSVIndex import readCSVRange
+from FeatureStore import storeDigest
+from FrameCache import stock_cache
+from FundamentalStore import readStockReports, recordsToFrame
+from Metrics import metrics
+from PriceView import readPyAlgoCSV
+
 """
     股票处理类
     功能：
@@ -14,7 +21,8 @@ import stockstats
 """
 
 class Stock(object):
-    def __init__(self, stock_code, stock_name='', stock_industry='', start_time=None, end_time=None):
+    def __init__(self, stock_code, stock_name='', stock_industry='', start_time=None, end_time=None,
+                 price_store=None, hist_store=None, fundamental_store=None, feature_store=None):
         """
             Stock类的构造方法
         :param stock_code: 股票代码
@@ -22,10 +30,18 @@ class Stock(object):
         :param stock_industry: 股票所属行业
         :param start_time: 要分析的时间区间，开始时间
         :param end_time: 结束时间
+        :param price_store: PyAlgo格式的PriceStore或PriceView（见PriceView.openPyAlgoStore），为None或不包含该股票时读取csv
+        :param hist_store: share_price对应的PriceStore，为None或不包含该股票时读取csv
+        :param fundamental_store: 财务数据仓库FundamentalStore，为None或不包含该股票时解析报表csv
+        :param feature_store: 指标特征仓库FeatureStore，源数据没有变化时直接读取上次算好的指标列
         """
         self.code = stock_code
         self.name = stock_name
         self.industry = stock_industry
+        self.price_store = price_store
+        self.hist_store = hist_store
+        self.fundamental_store = fundamental_store
+        self.feature_store = feature_store
         filename = '{}.csv'.format(stock_code)
         self.price_path = os.path.join('data/share_price_processed/', filename)
         self.hist_price_path = os.path.join('data/share_price/', filename)
@@ -36,15 +52,86 @@ class Stock(object):
         self.zcfzb_season_path = os.path.join('data/zcfzb/season/', filename)
         self.zcfzb_year_path = os.path.join('data/zcfzb/year/', filename)
 
-        # 输出当前处理的股票
-        self.print_stock()
-        # 获取stockstats的统计类，此类用于计算各项股价指标,
-        # https://github.com/jealous/stockstats
-        his = self.getHisPriceData(startTime=start_time, endTime=end_time)
-        if his is not None:
-            self.stat = stockstats.StockDataFrame.retype(his)
-        else:
-            self.stat = None
+        self.start_time = start_time
+        self.end_time = end_time
+
+        # 不再逐支输出当前处理的股票，需要时调用print_stock，整体进度和耗时见Metrics
+        metrics.count('stocks')
+
+    @property
+    def stat(self):
+        """
+            stockstats的统计类，此类用于计算各项股价指标，第一次访问时才读取历史股价数据，
+            读取后放入进程内共享的stock_cache，之后同一支股票（同一时间区间）直接复用，
+            已经计算过的指标列也保存在缓存的统计表上
+            https://github.com/jealous/stockstats
+        :return: 没有历史股价数据时返回None
+        """
+        stat = stock_cache.get(self.__cacheKey())
+        if stat is None:
+            his = self.getHisPriceData(startTime=self.start_time, endTime=self.end_time)
+            if his is None:
+                return None
+            with metrics.stage('retype', self.code):
+                stat = stockstats.StockDataFrame.retype(his)
+            stock_cache.put(self.__cacheKey(), stat)
+        return stat
+
+    def __cacheKey(self):
+        return self.code, self.start_time, self.end_time
+
+    def _indicator(self, columns):
+        """
+            取出指标列，stockstats第一次访问某列时会在统计表上计算并新增该列，之后更新缓存占用的内存；
+            设置了feature_store时先按源数据的哈希查找磁盘上的缓存，命中时不再读取股价数据
+        :param columns: 指标列
+        :return:
+        """
+        digest = None
+        if self.feature_store is not None:
+            with metrics.stage('feature_read', self.code):
+                digest = self.__sourceDigest()
+                ret = None if digest is None else self.feature_store.get(self.code, digest, columns, self.start_time,
+                                                                         self.end_time)
+            if ret is not None:
+                metrics.count('feature_hits')
+                return ret
+            metrics.count('feature_misses')
+        stat = self.stat
+        with metrics.stage('indicator', self.code):
+            ret = stat[columns]
+        stock_cache.resize(self.__cacheKey())
+        if digest is not None:
+            with metrics.stage('feature_write', self.code):
+                self.feature_store.put(self.code, digest, ret, self.start_time, self.end_time)
+        return ret
+
+    def __sourceDigest(self):
+        """
+            计算指标所用的源数据的哈希，与getHisPriceData的数据来源一致
+        :return: 没有源数据时返回None
+        """
+        if self.hist_store is not None and self.code in self.hist_store:
+            return storeDigest(self.hist_store, self.code)
+        return self.feature_store.sourceDigest(self.code, self.hist_price_path)
+
+    def __read(self, stage, func, *args, **kwargs):
+        """
+            读取股价数据，记录耗时和行数
+        :param stage: store_read或csv_read
+        :param func: 读取函数
+        :return:
+        """
+        try:
+            with metrics.stage(stage, self.code):
+                df = func(*args, **kwargs)
+        except Exception:
+            metrics.count('failures')
+            raise
+        if stage == 'csv_read':
+            metrics.count('files')
+        metrics.count('rows', len(df))
+        return df
 
     def print_stock(self):
         print('processing stock code : {} , stock name : {} , stock industry : {} . '.format(self.code, self.name,
@@ -52,19 +139,25 @@ class Stock(object):
 
     def getPriceData(self, startTime=None, endTime=None):
         """
-            此方法得到的数据供Dual Thrust策略分析，是PyAlgo要求的数据结构，可以指定时间范围
+            此方法得到的数据供Dual Thrust策略分析，是PyAlgo要求的数据结构，可以指定时间范围；
+            没有旧的share_price_processed数据时由share_price的数据改列名得到
         :param startTime:开始时间，默认是None
         :param endTime:结束时间，默认是None
         :return:
         """
 
-        if not (startTime and endTime):
+        if not (startTime or endTime):
             # print('there is no startTime and endTime set.')
-            price = pandas.read_csv(self.price_path)
+            if self.price_store is not None and self.code in self.price_store:
+                return self.__read('store_read', self.price_store.getFrame, self.code)
+            price = self.__read('csv_read', readPyAlgoCSV, self.code)
             return price
         else:
-            # TODO 通过时间筛选股价数据
-            pass
+            # 通过日期索引二分查找出行区间，只读取[startTime, endTime]之间的数据
+            if self.price_store is not None and self.code in self.price_store:
+                return self.__read('store_read', self.price_store.getFrame, self.code, startTime=startTime,
+                                   endTime=endTime)
+            return self.__read('csv_read', readPyAlgoCSV, self.code, startTime, endTime)
 
 
     def getHisPriceData(self, startTime=None, endTime=None):
@@ -75,20 +168,41 @@ class Stock(object):
         :return:
         """
 
-        if not (startTime and endTime):
+        if not (startTime or endTime):
             # print('there is no startTime and endTime set.')
+            if self.hist_store is not None and self.code in self.hist_store:
+                # 仓库中的数据已经按日期排好序
+                return self.__read('store_read', self.hist_store.getFrame, self.code)
             try:
-                price = pandas.read_csv(self.hist_price_path)
+                price = self.__read('csv_read', pandas.read_csv, self.hist_price_path)
             except:
                 return None
             return price.sort_values(by='date')
         else:
-            # TODO 通过时间筛选历史股价数据
-            pass
+            # 通过日期索引二分查找出行区间，只读取[startTime, endTime]之间的历史数据
+            if self.hist_store is not None and self.code in self.hist_store:
+                return self.__read('store_read', self.hist_store.getFrame, self.code, startTime=startTime,
+                                   endTime=endTime)
+            try:
+                price = self.__read('csv_read', readCSVRange, self.hist_price_path, startTime, endTime)
+            except:
+                return None
+            return price.sort_values(by='date')
 
-    def pltShow(self, func, figsize=(13.50, 7.0), grid=True, subplots=True, **kw):
+    def pltShow(self, func, figsize=(13.50, 7.0), grid=True, subplots=True, path=None, **kw):
+        """
+            绘制指标图
+        :param func: 指标方法返回的DataFrame
+        :param path: 保存为图片文件（png、svg等，格式取扩展名），为None时弹出交互窗口
+        :return:
+        """
         func.plot(figsize=figsize, grid=grid, subplots=subplots, **kw)
-        plt.show()
+        if path is None:
+            plt.show()
+            return
+        plt.gcf().suptitle(self.code)
+        plt.savefig(path, bbox_inches='tight')
+        plt.close('all')
 
     """
         以下方法获为17种股价指标，通过stockstats库获取，分析时可以适当调整参数
@@ -100,28 +214,28 @@ class Stock(object):
             volume_delta交易量delta转换
         :return:
         """
-        return self.stat[['volume', 'volume_delta']]
+        return self._indicator(['volume', 'volume_delta'])
 
     def closeDelta(self):
         """
             close_delta 收盘价delta转换
         :return:
         """
-        return self.stat[['close', 'close_delta']]
+        return self._indicator(['close', 'close_delta'])
 
     def n_d(self):
         """
             计算n天差
         :return:
         """
-        return self.stat[['close', 'close_1_d', 'close_2_d', 'close_-1_d', 'close_-2_d']]
+        return self._indicator(['close', 'close_1_d', 'close_2_d', 'close_-1_d', 'close_-2_d'])
 
     def n_openChangeInPercent(self):
         """
             计算n天开盘价百分比
         :return:
         """
-        return self.stat[['close', 'close_-1_r', 'close_-2_r']]
+        return self._indicator(['close', 'close_-1_r', 'close_-2_r'])
 
     def CR(self):
         """
@@ -135,7 +249,7 @@ class Stock(object):
         　　5. CR跌至40以下时，是建仓良机。而CR高于300~400时，应注意适当减仓。
         :return:
         """
-        return self.stat[['close', 'cr', 'cr-ma1', 'cr-ma2', 'cr-ma3']]
+        return self._indicator(['close', 'cr', 'cr-ma1', 'cr-ma2', 'cr-ma3'])
 
     def KDJ(self):
         """
@@ -149,7 +263,7 @@ class Stock(object):
         # stockStat['kdjk_3_xu_kdjd_3'].plot(figsize=(20,10), grid=True)
         # plt.show()
         # 分别是k d j 三个数据统计项。默认是统计9天
-        return self.stat[['close', 'kdjk', 'kdjd', 'kdjj']]
+        return self._indicator(['close', 'kdjk', 'kdjd', 'kdjj'])
 
     def SMA(self):
         """
@@ -158,7 +272,7 @@ class Stock(object):
 
         :return:
         """
-        return self.stat[['close', 'close_5_sma', 'close_10_sma']]
+        return self._indicator(['close', 'close_5_sma', 'close_10_sma'])
 
     def MACD(self):
         """
@@ -175,7 +289,7 @@ class Stock(object):
                 df['macdh'] = (df['macd'] - df['macds'])
         :return:
         """
-        return self.stat[['close', 'macd', 'macds', 'macdh']]
+        return self._indicator(['close', 'macd', 'macds', 'macdh'])
 
     def BOLL(self):
         """
@@ -186,7 +300,7 @@ class Stock(object):
         :return:
         """
         # 包括向上和向下的band
-        return self.stat[['close', 'boll', 'boll_ub', 'boll_lb']]
+        return self._indicator(['close', 'boll', 'boll_ub', 'boll_lb'])
 
     def RSI(self):
         """
@@ -195,7 +309,7 @@ class Stock(object):
 
         :return:
         """
-        return self.stat[['close', 'rsi_6', 'rsi_12']]
+        return self._indicator(['close', 'rsi_6', 'rsi_12'])
 
     def WR(self):
         """
@@ -203,7 +317,7 @@ class Stock(object):
             文档：http://wiki.mbalib.com/wiki/%E5%A8%81%E5%BB%89%E6%8C%87%E6%A0%87
         :return:
         """
-        return self.stat[['close', 'wr_10', 'wr_6']]
+        return self._indicator(['close', 'wr_10', 'wr_6'])
 
     def CCI(self):
         """
@@ -211,7 +325,7 @@ class Stock(object):
             文档：http://wiki.mbalib.com/wiki/%E9%A1%BA%E5%8A%BF%E6%8C%87%E6%A0%87
         :return:
         """
-        return self.stat[['close', 'cci', 'cci_20']]
+        return self._indicator(['close', 'cci', 'cci_20'])
 
     def ATR(self):
         """
@@ -220,7 +334,7 @@ class Stock(object):
             均幅指标无论是从下向上穿越移动平均线，还是从上向下穿越移动平均线时，都是一种研判信号
         :return:
         """
-        return self.stat[['close', 'tr', 'atr']]
+        return self._indicator(['close', 'tr', 'atr'])
 
     def DMA(self):
         """
@@ -228,7 +342,7 @@ class Stock(object):
             文档：http://wiki.mbalib.com/wiki/DMA
         :return:
         """
-        return self.stat[['close', 'dma']]
+        return self._indicator(['close', 'dma'])
 
     def DMI_DI_DX_ADX_ADXR(self):
         """
@@ -240,7 +354,7 @@ class Stock(object):
             在应用时，应以ADX为主，ADXR为辅。
         :return:
         """
-        return self.stat[['close', 'pdi', 'mdi', 'dx', 'adx', 'adxr']]
+        return self._indicator(['close', 'pdi', 'mdi', 'dx', 'adx', 'adxr'])
 
     def TRIX_MATRIX(self):
         """
@@ -248,7 +362,7 @@ class Stock(object):
             文档：http://wiki.mbalib.com/wiki/TRIX
         :return:
         """
-        return self.stat[['close', 'trix', 'trix_9_sma']]
+        return self._indicator(['close', 'trix', 'trix_9_sma'])
 
     def VR_MAVR(self):
         """
@@ -256,10 +370,23 @@ class Stock(object):
             文档：http://wiki.mbalib.com/wiki/%E6%88%90%E4%BA%A4%E9%87%8F%E6%AF%94%E7%8E%87
         :return:
         """
-        return self.stat[['close', 'vr', 'vr_6_sma']]
+        return self._indicator(['close', 'vr', 'vr_6_sma'])
 
-
-        # TODO 分析财务报表数据
+    def getFinanceData(self, items=None, startTime=None, endTime=None):
+        """
+            三大报表的财务数据，科目写成"报表:科目"，例如lrb:净利润(万元)
+        :param items: 需要的科目，默认全部科目
+        :param startTime: 开始的报告日期，默认是None
+        :param endTime: 结束的报告日期，默认是None
+        :return: 以报告日期为索引、科目为列的DataFrame，不指定items时各列按科目名称排序，与仓库的结果一致
+        """
+        if self.fundamental_store is not None and self.code in self.fundamental_store:
+            return self.fundamental_store.getStock(self.code, items, startTime, endTime)
+        period = self.fundamental_store.period if self.fundamental_store is not None else 'season'
+        df = recordsToFrame(readStockReports(self.code, period=period))
+        df = df[(df.index >= (startTime or '')) & (df.index <= (endTime or '9999'))]
+        # 仓库通过pivot得到的列按科目名称排序，这里保持一致
+        return df.reindex(columns=sorted(df.columns) if items is None else items)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,212 @@
+import json
+import os
+
+import numpy
+
+"""
+    股票池：data/stocks.json（code、name、industry三个并列的列表）只读取一次，保存为紧凑的数组：
+        codes       股票代码，定长字节串S6
+        names       股票名称，定长unicode数组
+        industry    行业编号int32，对应industries中的行业名称，没有行业的为-1
+    代码到行号的查找为O(1)，按行业或名称前缀的筛选返回布尔数组。
+    第一次读取JSON后把数组写入二进制缓存data/stocks.npz，JSON的大小和修改时间没有变化时直接读取缓存。
+    同一进程内loadUniverse返回同一个只读对象，各个阶段共用，不再各自构造并列的列表和字典。
+    @Author: zengshuang61@gmail.com
+"""
+
+STOCKS_PATH = 'data/stocks.json'
+CODE_DTYPE = 'S6'
+
+# 文件路径 -> 已加载的股票池
+_universes = {}
+
+
+class StockUniverse(object):
+    def __init__(self, codes, names, industry, industries):
+        """
+        :param codes: 股票代码数组（S6）
+        :param names: 股票名称数组
+        :param industry: 行业编号数组（int32），-1表示没有行业
+        :param industries: 行业名称列表
+        """
+        self.__codes = numpy.asarray(codes, dtype=CODE_DTYPE)
+        self.__names = numpy.asarray(names, dtype=str)
+        self.__industry = numpy.asarray(industry, dtype=numpy.int32)
+        self.__industries = tuple(industries)
+        for values in (self.__codes, self.__names, self.__industry):
+            values.flags.writeable = False
+        self.__code2Row = {code.decode(): i for i, code in enumerate(self.__codes)}
+        self.__industry2Id = {name: i for i, name in enumerate(self.__industries)}
+        self.__lists = None
+
+    @classmethod
+    def fromDict(cls, dict_stocks):
+        """
+            由getStockCodeAndName格式的dict构造
+        :param dict_stocks: {'code': [...], 'name': [...], 'industry': [...]}
+        :return:
+        """
+        industries = []
+        industry2Id = {}
+        industry = []
+        for value in dict_stocks['industry']:
+            if value is None or (isinstance(value, float) and value != value):
+                industry.append(-1)
+                continue
+            value = str(value)
+            if value not in industry2Id:
+                industry2Id[value] = len(industries)
+                industries.append(value)
+            industry.append(industry2Id[value])
+        names = ['' if name is None else str(name) for name in dict_stocks['name']]
+        return cls(dict_stocks['code'], names, industry, industries)
+
+    @property
+    def codes(self):
+        return self.__codes
+
+    @property
+    def names(self):
+        return self.__names
+
+    @property
+    def industry(self):
+        return self.__industry
+
+    @property
+    def industries(self):
+        return self.__industries
+
+    def __len__(self):
+        return len(self.__codes)
+
+    def __contains__(self, code):
+        return code in self.__code2Row
+
+    def row(self, code):
+        """
+            股票代码对应的行号
+        :param code: 股票代码
+        :return: 不在股票池中时抛出KeyError
+        """
+        return self.__code2Row[code]
+
+    def name(self, code):
+        return str(self.__names[self.__code2Row[code]])
+
+    def industryOf(self, code):
+        """
+            股票所属行业
+        :param code: 股票代码
+        :return: 行业名称，没有行业时为None
+        """
+        i = self.__industry[self.__code2Row[code]]
+        return self.__industries[i] if i >= 0 else None
+
+    def industryMask(self, industries):
+        """
+        :param industries: 行业名称或行业名称列表
+        :return: 属于这些行业的股票为True的布尔数组
+        """
+        if isinstance(industries, str):
+            industries = [industries]
+        ids = [self.__industry2Id[name] for name in industries if name in self.__industry2Id]
+        return numpy.isin(self.__industry, ids)
+
+    def namePrefixMask(self, prefix):
+        """
+        :param prefix: 名称前缀，例如*ST，也可以是前缀的元组
+        :return: 名称以prefix开头的股票为True的布尔数组
+        """
+        if isinstance(prefix, str):
+            prefix = (prefix,)
+        mask = numpy.zeros(len(self), dtype=bool)
+        for value in prefix:
+            mask |= numpy.char.startswith(self.__names, value)
+        return mask
+
+    def codesOf(self, mask=None):
+        """
+            布尔数组（或行号数组）选中的股票代码
+        :param mask: 默认全部股票
+        :return: 股票代码字符串列表
+        """
+        codes = self.__codes if mask is None else self.__codes[mask]
+        return [code.decode() for code in codes]
+
+    def toDict(self):
+        """
+            getStockCodeAndName格式的dict，只构造一次，之后返回同一份（不要修改）
+        :return:
+        """
+        if self.__lists is None:
+            self.__lists = {
+                'code': self.codesOf(),
+                'name': self.__names.tolist(),
+                'industry': [self.__industries[i] if i >= 0 else None for i in self.__industry],
+            }
+        return self.__lists
+
+    def __getitem__(self, key):
+        # 兼容原来以dict_stocks['code']等方式使用股票池的代码
+        return self.toDict()[key]
+
+    def save(self, path, source=(-1, -1)):
+        """
+            写入二进制缓存，先写临时文件再替换
+        :param path: 缓存文件
+        :param source: 源JSON的(大小, 修改时间)，用于判断缓存是否过期
+        :return:
+        """
+        with open(path + '.tmp', 'wb') as f:
+            numpy.savez(f, codes=self.__codes, names=self.__names, industry=self.__industry,
+                        industries=numpy.asarray(self.__industries, dtype=str),
+                        source=numpy.asarray(source, dtype=numpy.int64))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, source=None):
+        """
+            读取二进制缓存
+        :param path: 缓存文件
+        :param source: 指定时与缓存中记录的源JSON的(大小, 修改时间)比较，不一致时返回None
+        :return:
+        """
+        with numpy.load(path, allow_pickle=False) as data:
+            if source is not None and tuple(data['source'].tolist()) != tuple(source):
+                return None
+            return cls(data['codes'], data['names'], data['industry'], data['industries'].tolist())
+
+
+def cachePath(file_name):
+    return os.path.splitext(file_name)[0] + '.npz'
+
+
+def loadUniverse(file_name=STOCKS_PATH):
+    """
+        进程内共享的股票池，stocks.json不存在时通过preprocess.getStockCodeAndName下载
+    :param file_name: stocks.json的路径
+    :return: StockUniverse
+    """
+    if not os.path.exists(file_name):
+        from preprocess import getStockCodeAndName
+        getStockCodeAndName(file_name)
+    stat = os.stat(file_name)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    cached = _universes.get(file_name)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    cache = cachePath(file_name)
+    universe = None
+    if os.path.exists(cache):
+        try:
+            universe = StockUniverse.load(cache, signature)
+        except (OSError, ValueError, KeyError):
+            universe = None
+    if universe is None:
+        with open(file_name, 'r', encoding='utf-8') as f:
+            universe = StockUniverse.fromDict(json.load(f))
+        universe.save(cache, signature)
+    _universes[file_name] = (signature, universe)
+    return universe
@@ -0,0 +1,164 @@
+import os
+
+import numpy
+
+from PriceStore import STORE_DIR, loadPanel, openPriceStore
+
+"""
+    股票池过滤：在整个股票池和股价面板上一次性计算筛选条件，每个条件返回与股票池对齐的布尔数组，
+    可以用& | ~自由组合，代替逐行排除*ST以及按排名位置手工去掉新股的做法。
+    面板只读取一次；所有与时间有关的条件都以面板中最后一个交易日为基准，同样的数据得到同样的结果。
+    @Author: zengshuang61@gmail.com
+"""
+
+ST_PREFIXES = ('ST', '*ST', 'S*ST', 'SST')
+PANEL_COLUMNS = ['volume', 'turnover']
+
+
+class UniverseFilter(object):
+    def __init__(self, universe, panel=None, hist_store=None, csv_dir='data/share_price/'):
+        """
+        :param universe: StockUniverse
+        :param panel: PriceStore.loadPanel得到的tushare格式面板（需要date、volume、turnover列），默认第一次用到时读取
+        :param hist_store: share_price对应的PriceStore，读取面板时使用，默认打开data/price_store/share_price
+        :param csv_dir: 没有PriceStore时读取的csv目录
+        """
+        self.universe = universe
+        self.hist_store = hist_store
+        self.csv_dir = csv_dir
+        self.__panel = panel
+        self.__rows = None
+
+    @property
+    def panel(self):
+        if self.__panel is None:
+            store = self.hist_store or openPriceStore(os.path.join(STORE_DIR, 'share_price'))
+            self.__panel = loadPanel(self.universe.codesOf(), PANEL_COLUMNS, price_store=store, csv_dir=self.csv_dir)
+        return self.__panel
+
+    def __panelRows(self):
+        """
+            面板各行对应的股票池行号，读取失败的股票不在面板中
+        :return:
+        """
+        if self.__rows is None:
+            self.__rows = numpy.array([self.universe.row(code) for code in self.panel['codes']], dtype=numpy.int64)
+        return self.__rows
+
+    def __align(self, values, fill):
+        """
+            把面板上按股票计算出的值放回股票池的顺序，不在面板中的股票取fill
+        :param values: 与面板行对齐的数组
+        :param fill: 缺失值
+        :return:
+        """
+        ret = numpy.full(len(self.universe), fill, dtype=numpy.asarray(values).dtype)
+        ret[self.__panelRows()] = values
+        return ret
+
+    def asof(self):
+        """
+            基准日：面板中最后一个交易日
+        :return: datetime64[D]
+        """
+        dates = self.panel['date']
+        return dates[~numpy.isnat(dates)].max() if dates.size else numpy.datetime64('NaT')
+
+    def all(self):
+        return numpy.ones(len(self.universe), dtype=bool)
+
+    def notST(self, prefixes=ST_PREFIXES):
+        """
+        :param prefixes: ST类股票名称的前缀
+        :return: 不是ST、*ST的股票为True
+        """
+        return ~self.universe.namePrefixMask(prefixes)
+
+    def barCount(self):
+        return self.__align(self.panel['length'], 0)
+
+    def minBars(self, bars):
+        """
+        :param bars: 最少的K线数
+        :return: 股价数据不少于bars根K线的股票为True
+        """
+        return self.barCount() >= bars
+
+    def minListingDays(self, days):
+        """
+            第一根K线距离基准日不少于days个自然日。股价数据只下载了最近几年，
+            更早上市的股票的第一根K线晚于真实的上市日期，但同样满足条件
+        :param days: 最少的自然日数
+        :return:
+        """
+        first = self.panel['date'][:, 0]
+        age = (self.asof() - first).astype('timedelta64[D]').astype(numpy.float64)
+        age[numpy.isnat(first)] = numpy.nan
+        return self.__align(age, numpy.nan) >= days
+
+    def __lastBars(self, window):
+        """
+            每支股票最后window根K线的位置
+        :param window: K线数
+        :return: 与面板形状相同的布尔数组
+        """
+        columns = numpy.arange(self.panel['date'].shape[1])[None, :]
+        length = self.panel['length'][:, None]
+        return (columns < length) & (columns >= length - window)
+
+    def averageTurnover(self, window=20):
+        """
+            最后window根K线的平均换手率
+        :param window: K线数
+        :return: 与股票池对齐的数组，没有数据的为NaN
+        """
+        turnover = numpy.where(self.__lastBars(window), self.panel['turnover'], numpy.nan)
+        count = numpy.sum(~numpy.isnan(turnover), axis=1)
+        total = numpy.nansum(turnover, axis=1)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            mean = numpy.where(count > 0, total / count, numpy.nan)
+        return self.__align(mean, numpy.nan)
+
+    def minTurnover(self, turnover, window=20):
+        """
+        :param turnover: 最低平均换手率（%）
+        :param window: K线数
+        :return:
+        """
+        return self.averageTurnover(window) >= turnover
+
+    def suspensionRatio(self, window=250):
+        """
+            最近window个交易日（全部股票交易日的并集）中，从这支股票第一根K线开始算起没有成交的天数占比
+        :param window: 交易日数
+        :return: 与股票池对齐的数组，没有数据的为1
+        """
+        dates = self.panel['date']
+        calendar = numpy.unique(dates[~numpy.isnat(dates)])[-window:]
+        if calendar.size == 0:
+            return numpy.ones(len(self.universe))
+        traded = (dates >= calendar[0]) & (self.panel['volume'] > 0)
+        first = numpy.where(numpy.isnat(dates[:, 0]), calendar[-1], numpy.maximum(dates[:, 0], calendar[0]))
+        expected = calendar.size - numpy.searchsorted(calendar, first)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            ratio = numpy.where(expected > 0, 1 - traded.sum(axis=1) / expected, 1.0)
+        ratio[self.panel['length'] == 0] = 1.0
+        return self.__align(numpy.clip(ratio, 0.0, 1.0), 1.0)
+
+    def maxSuspension(self, ratio, window=250):
+        """
+        :param ratio: 最大停牌天数占比
+        :param window: 交易日数
+        :return:
+        """
+        return self.suspensionRatio(window) <= ratio
+
+    def select(self, sorted_stocks, mask):
+        """
+            保留排序结果中通过筛选的股票，顺序不变
+        :param sorted_stocks: [(code, value)]
+        :param mask: 与股票池对齐的布尔数组
+        :return: [(code, value)]
+        """
+        return [(code, value) for code, value in sorted_stocks
+                if code in self.universe and mask[self.universe.row(code)]]
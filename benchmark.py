@@ -0,0 +1,326 @@
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+import numpy
+import pandas
+
+"""
+    性能基准：用确定性的合成数据（与data/share_price、data/share_price_processed下的csv格式相同）
+    测量读取、指标计算、排序和回测各环节的耗时，结果写入JSON，便于在不同提交之间比较。全程离线运行。
+    用法：
+        python3 benchmark.py --stocks 100 --years 5 --output result/benchmark.json
+        python3 benchmark.py --compare result/benchmark_old.json result/benchmark.json
+    @Author: zengshuang61@gmail.com
+"""
+
+TRADING_DAYS = 250
+HIST_COLUMNS = ['open', 'high', 'close', 'low', 'volume', 'price_change', 'p_change', 'ma5', 'ma10', 'ma20', 'v_ma5',
+                'v_ma10', 'v_ma20', 'turnover']
+INDUSTRIES = ['银行', '房地产', '化工原料', '元器件', '软件服务', '汽车配件', '中成药', '电气设备']
+
+
+def syntheticCodes(stocks):
+    """
+        深市和沪市代码交替，保证两种前缀都有
+    :param stocks: 股票数
+    :return:
+    """
+    return ['{:06d}'.format(600000 + i // 2) if i % 2 else '{:06d}'.format(1 + i // 2) for i in range(stocks)]
+
+
+def syntheticBars(rng, days, end='2019-10-31'):
+    """
+        几何布朗运动生成一支股票的日线
+    :param rng: numpy.random.RandomState
+    :param days: 交易日数
+    :param end: 最后一个交易日
+    :return: DataFrame，列为date、open、high、close、low、volume，按日期升序
+    """
+    dates = pandas.bdate_range(end=end, periods=days).strftime('%Y-%m-%d')
+    close = 10 * numpy.exp(numpy.cumsum(rng.normal(0.0002, 0.02, days)))
+    open_ = close * numpy.exp(rng.normal(0, 0.01, days))
+    high = numpy.maximum(open_, close) * (1 + numpy.abs(rng.normal(0, 0.01, days)))
+    low = numpy.minimum(open_, close) * (1 - numpy.abs(rng.normal(0, 0.01, days)))
+    volume = rng.randint(1000, 500000, days).astype(float)
+    return pandas.DataFrame({'date': dates, 'open': open_.round(2), 'high': high.round(2), 'close': close.round(2),
+                             'low': low.round(2), 'volume': volume})
+
+
+def generateSyntheticData(root, stocks=10, years=1, seed=0):
+    """
+        在root/data下生成合成数据，同一组参数每次生成的文件完全相同：
+        share_price/<code>.csv（tushare格式，日期降序）、share_price_processed/<code>.csv（PyAlgo格式，日期升序）、
+        stocks.json以及筛选结果filtered_stocks_ROE.txt（全部股票）
+    :param root: 工作目录
+    :param stocks: 股票数
+    :param years: 年数，每年250个交易日
+    :param seed: 随机种子
+    :return: dict_stocks
+    """
+    rng = numpy.random.RandomState(seed)
+    data_dir = os.path.join(root, 'data')
+    for sub_dir in ('share_price', 'share_price_processed'):
+        os.makedirs(os.path.join(data_dir, sub_dir), exist_ok=True)
+    codes = syntheticCodes(stocks)
+    names = []
+    industries = []
+    for i, code in enumerate(codes):
+        names.append('{}股票{}'.format('*ST' if i % 17 == 16 else '', code))
+        industries.append(INDUSTRIES[i % len(INDUSTRIES)])
+        # 每支股票的长度略有不同，模拟上市时间不同
+        days = max(60, years * TRADING_DAYS - rng.randint(0, TRADING_DAYS // 2))
+        bars = syntheticBars(rng, days)
+
+        hist = bars.copy()
+        hist['price_change'] = hist['close'].diff().fillna(0).round(2)
+        hist['p_change'] = (hist['close'].pct_change().fillna(0) * 100).round(2)
+        for n in (5, 10, 20):
+            hist['ma{}'.format(n)] = hist['close'].rolling(n, min_periods=1).mean().round(3)
+            hist['v_ma{}'.format(n)] = hist['volume'].rolling(n, min_periods=1).mean().round(2)
+        hist['turnover'] = rng.rand(days).round(4)
+        hist['code'] = code
+        hist[['date'] + HIST_COLUMNS + ['code']].iloc[::-1].to_csv(
+            os.path.join(data_dir, 'share_price', '{}.csv'.format(code)), index=False)
+
+        processed = pandas.DataFrame({'Date': bars['date'], 'Open': bars['open'], 'Close': bars['close'],
+                                      'High': bars['high'], 'Low': bars['low'], 'Volume': bars['volume'],
+                                      'code': code, 'Adj Close': bars['close']})
+        processed.to_csv(os.path.join(data_dir, 'share_price_processed', '{}.csv'.format(code)), index=False)
+
+    dict_stocks = dict(code=codes, name=names, industry=industries)
+    with open(os.path.join(data_dir, 'stocks.json'), 'w', encoding='utf-8') as f:
+        json.dump(dict_stocks, f, ensure_ascii=False)
+    with open(os.path.join(data_dir, 'filtered_stocks_ROE.txt'), 'w', encoding='utf-8') as f:
+        f.write('代码\t名称\t行业\tROE\t')
+        for code, name, industry in zip(codes, names, industries):
+            f.write('\n{}\t{}\t{}\t{}'.format(code, name, industry, 0))
+    return dict_stocks
+
+
+def measure(func, repeat=3, setup=None):
+    """
+        多次运行func，分别记录墙上时间和CPU时间
+    :param func: 被测函数
+    :param repeat: 运行次数
+    :param setup: 每次运行前执行的准备函数，不计入耗时
+    :return: dict
+    """
+    wall = []
+    cpu = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start_wall = time.perf_counter()
+            start_cpu = time.process_time()
+            func()
+            cpu.append(time.process_time() - start_cpu)
+            wall.append(time.perf_counter() - start_wall)
+    return {'wall': wall, 'cpu': cpu, 'min': min(wall), 'mean': sum(wall) / len(wall)}
+
+
+def benchmarkCases(dict_stocks, backtest_stocks=20, workers=1):
+    """
+        各个基准用例，在已经切换到合成数据目录之后调用
+    :param dict_stocks: 合成数据的股票
+    :param backtest_stocks: pyalgotrade逐支回测的股票数，逐支回测较慢，只取前几支
+    :param workers: AnalyzeByDualThrust的进程数
+    :return: [(名称, 被测函数, 准备函数, 处理的股票数)]
+    """
+    from DualThrustStrategy import AnalyzeByDualThrust, runStrategy
+    from DualThrustVector import loadPanel, runVectorStrategy
+    from FeatureStore import FEATURE_DIR
+    from FrameCache import stock_cache
+    from PriceStore import STORE_DIR, convertCSVDir, openPriceStore
+    from Stock import Stock
+    from process import sortStockByMACD, sortStockByMACDBatch
+
+    codes = dict_stocks['code']
+    hist_store_dir = os.path.join(STORE_DIR, 'share_price')
+    price_store_dir = os.path.join(STORE_DIR, 'share_price_processed')
+    stores = {}
+
+    def loadCSV():
+        for code in codes:
+            Stock(code).getHisPriceData()
+
+    def convertStores():
+        convertCSVDir('data/share_price/', hist_store_dir)
+        convertCSVDir('data/share_price_processed/', price_store_dir)
+        stores['hist'] = openPriceStore(hist_store_dir)
+        stores['price'] = openPriceStore(price_store_dir)
+
+    def store(name):
+        # 只运行部分用例时，第一次用到仓库才转换
+        if name not in stores:
+            convertStores()
+        return stores[name]
+
+    def loadStore():
+        for code in codes:
+            Stock(code, hist_store=store('hist')).getHisPriceData()
+
+    def indicators():
+        for code in codes:
+            stock = Stock(code, hist_store=store('hist'))
+            stock.MACD()
+            stock.KDJ()
+            stock.RSI()
+            stock.BOLL()
+
+    def clearFeatures():
+        # sortStockByMACD默认使用data/feature_store，不清空时第二次起测到的是磁盘缓存命中
+        stock_cache.clear()
+        shutil.rmtree(FEATURE_DIR, ignore_errors=True)
+
+    def warmFeatures():
+        stock_cache.clear()
+        if not os.path.exists(FEATURE_DIR):
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                sortStockByMACD(dict_stocks)
+
+    def backtest():
+        for code in codes[:backtest_stocks]:
+            # stdout=False时runStrategy不构造绘图器，不会留下需要关闭的图
+            runStrategy(code, os.path.join('data/share_price_processed', '{}.csv'.format(code)), stdout=False)
+
+    def backtestVector():
+        runVectorStrategy(loadPanel(codes, price_store=store('price')))
+
+    def analyze():
+        AnalyzeByDualThrust('data/filtered_stocks_ROE.txt', workers=workers)
+
+    return [
+        ('load_csv', loadCSV, stock_cache.clear, len(codes)),
+        ('convert_store', convertStores, None, len(codes)),
+        ('load_store', loadStore, stock_cache.clear, len(codes)),
+        ('indicators', indicators, stock_cache.clear, len(codes)),
+        ('rank_macd', lambda: sortStockByMACD(dict_stocks), clearFeatures, len(codes)),
+        ('rank_macd_cached', lambda: sortStockByMACD(dict_stocks), warmFeatures, len(codes)),
+        ('rank_macd_batch', lambda: sortStockByMACDBatch(dict_stocks), None, len(codes)),
+        ('backtest', backtest, None, min(backtest_stocks, len(codes))),
+        ('backtest_vector', backtestVector, None, len(codes)),
+        ('analyze_dual_thrust', analyze, None, len(codes)),
+    ]
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__) or '.',
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def runBenchmarks(stocks=10, years=1, seed=0, repeat=3, only=None, backtest_stocks=20, workers=1, workdir=None):
+    """
+        生成合成数据并依次运行基准用例
+    :param stocks: 股票数（10~5000）
+    :param years: 年数（1~20）
+    :param seed: 随机种子
+    :param repeat: 每个用例运行的次数
+    :param only: 只运行这些用例，默认全部
+    :param backtest_stocks: pyalgotrade逐支回测的股票数
+    :param workers: AnalyzeByDualThrust的进程数
+    :param workdir: 合成数据目录，默认使用临时目录并在结束后删除
+    :return: 可以直接写入JSON的dict
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    root = workdir or tempfile.mkdtemp(prefix='benchmark_')
+    cwd = os.getcwd()
+    report = {
+        'meta': {
+            'stocks': stocks,
+            'years': years,
+            'seed': seed,
+            'repeat': repeat,
+            'revision': gitRevision(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': numpy.__version__,
+            'pandas': pandas.__version__,
+        },
+        'results': {},
+    }
+    try:
+        start = time.perf_counter()
+        dict_stocks = generateSyntheticData(root, stocks, years, seed)
+        report['meta']['generate'] = time.perf_counter() - start
+        os.chdir(root)
+        # pyalgotrade会为每一笔订单输出日志，基准测试时关闭
+        logging.disable(logging.CRITICAL)
+        for name, func, setup, count in benchmarkCases(dict_stocks, backtest_stocks, workers):
+            if only and name not in only:
+                continue
+            result = measure(func, repeat, setup)
+            result['stocks'] = count
+            report['results'][name] = result
+            print('{:<20}\tmin {:.3f}s\tmean {:.3f}s\t{:.2f}ms/stock'.format(name, result['min'], result['mean'],
+                                                                            result['min'] * 1000 / max(count, 1)))
+    finally:
+        logging.disable(logging.NOTSET)
+        os.chdir(cwd)
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return report
+
+
+def compareBenchmarks(old_path, new_path):
+    """
+        比较两次基准结果，输出各用例最短耗时之比，大于1表示变慢
+    :param old_path: 旧结果JSON
+    :param new_path: 新结果JSON
+    :return: {用例: 新/旧}
+    """
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)['results']
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)['results']
+    ratios = {}
+    for name in new:
+        if name in old and old[name]['min'] > 0:
+            ratios[name] = new[name]['min'] / old[name]['min']
+            print('{:<20}\t{:.3f}s -> {:.3f}s\t{:.2f}x'.format(name, old[name]['min'], new[name]['min'], ratios[name]))
+    return ratios
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='合成数据上的性能基准')
+    parser.add_argument('--stocks', type=int, default=10, help='股票数（10~5000）')
+    parser.add_argument('--years', type=int, default=1, help='年数（1~20）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help='只运行这些用例')
+    parser.add_argument('--backtest-stocks', type=int, default=20, help='pyalgotrade逐支回测的股票数')
+    parser.add_argument('--workers', type=int, default=1, help='AnalyzeByDualThrust的进程数')
+    parser.add_argument('--workdir', help='合成数据目录，指定时保留生成的数据')
+    parser.add_argument('--output', default='result/benchmark.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='比较两次的结果')
+    args = parser.parse_args()
+
+    if args.compare:
+        compareBenchmarks(*args.compare)
+    else:
+        report = runBenchmarks(args.stocks, args.years, args.seed, args.repeat, args.only, args.backtest_stocks,
+                               args.workers, args.workdir)
+        output_dir = os.path.dirname(args.output)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print('结果保存至：{}'.format(args.output))
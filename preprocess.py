@@ -1,18 +1,40 @@
+import asyncio
 import datetime
 import json
 import os
+import re
+import shutil
 import time
+from html.parser import HTMLParser
 from multiprocessing.dummy import Pool
+from urllib.parse import urlparse
 
+import aiohttp
+import numpy
+import pandas
 import requests
 import tushare as ts
 from bs4 import BeautifulSoup
 
+from CSVIndex import loadCSVIndex, readCSVRange
+from Metrics import metrics
+
 """
     用于获取股价历史行情数据、三大财报数据和财务统计数据
     @Author: zengshuang61@gmail.com
 """
 
+# 网易财经财报数据地址及三大财报：资产负债表、利润表、现金流量表
+FINANCE_BASE_URL = 'http://quotes.money.163.com'
+FINANCE_REPORTS = ('zcfzb', 'lrb', 'xjllb')
+
+# 股价数据的最早日期
+SHARE_PRICE_START = '2000-11-21'
+# get_k_data提供的前复权开高低收和成交量
+K_DATA_COLUMNS = ['open', 'high', 'close', 'low', 'volume']
+# 只有get_hist_data提供的列（只覆盖近三年），按日期并入同一个文件
+HIST_EXTRA_COLUMNS = ['price_change', 'p_change', 'ma5', 'ma10', 'ma20', 'v_ma5', 'v_ma10', 'v_ma20', 'turnover']
+
 
 def getHTMLText(url, code="utf-8"):
     try:
@@ -142,17 +164,165 @@ def getFinanceDataOfCodes(code_list):
     pool.join()
 
 
+class TokenBucket(object):
+    """
+        令牌桶限速：每秒补充rate个令牌，最多积攒capacity个，每个请求消耗一个令牌
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.__tokens = capacity
+        self.__last = time.monotonic()
+        self.__lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.__lock:
+            while True:
+                now = time.monotonic()
+                self.__tokens = min(self.capacity, self.__tokens + (now - self.__last) * self.rate)
+                self.__last = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.__tokens) / self.rate)
+
+
+class HostRateLimiter(object):
+    """
+        按域名分别限速，每个域名一个令牌桶
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.__buckets = {}
+
+    async def acquire(self, url):
+        host = urlparse(url).netloc
+        if host not in self.__buckets:
+            self.__buckets[host] = TokenBucket(self.rate, self.capacity)
+        await self.__buckets[host].acquire()
+
+
+async def fetchToFile(session, limiter, semaphore, url, file_name, retries=3):
+    """
+        异步下载url到file_name，边下载边写入临时文件，完成后再改名，中途失败不会留下不完整的文件
+    :param session: 共享的aiohttp.ClientSession，连接保持复用
+    :param limiter: HostRateLimiter
+    :param semaphore: 限制同时进行的请求数
+    :param url: 下载地址
+    :param file_name: 文件保存位置
+    :param retries: 失败重试次数
+    :return: 是否成功
+    """
+    if os.path.exists(file_name):
+        return True
+    tmp_name = file_name + '.part'
+    for attempt in range(retries):
+        async with semaphore:
+            await limiter.acquire(url)
+            try:
+                async with session.get(url) as r:
+                    r.raise_for_status()
+                    with open(tmp_name, 'wb') as fd:
+                        async for chunk in r.content.iter_chunked(64 * 1024):
+                            fd.write(chunk)
+                os.replace(tmp_name, file_name)
+                metrics.count('files')
+                return True
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+                # 写文件失败（目录不存在、磁盘已满等）同样只算这一个文件失败，不能中断gather中的其他下载
+                pass
+        # 失败后指数退避再重试
+        if attempt + 1 < retries:
+            metrics.count('retries')
+            await asyncio.sleep(2 ** attempt)
+    if os.path.exists(tmp_name):
+        os.remove(tmp_name)
+    metrics.count('failures')
+    return False
+
+
+async def downloadFinanceData(code_list, base_url=FINANCE_BASE_URL, save_dir='data', rate=4 / 3.0, capacity=4,
+                              concurrency=8, retries=3):
+    """
+        异步下载三大财报数据，与getFinanceData生成的文件相同
+    :param code_list: 股票代码列表
+    :param base_url: 网易财经地址，测试时可以换成本地的http服务
+    :param save_dir: 数据目录
+    :param rate: 每个域名每秒最多请求数，默认与原来4个线程、每次请求后sleep(3)的上限相同
+    :param capacity: 令牌桶容量，允许的瞬时并发请求数
+    :param concurrency: 最大并发连接数
+    :param retries: 每个文件的重试次数
+    :return: 下载失败的(code, 报表, type)列表
+    """
+    limiter = HostRateLimiter(rate, capacity)
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    jobs = []
+    for code in code_list:
+        for report in FINANCE_REPORTS:
+            for type, sub_dir in (('', 'season'), ('year', 'year')):
+                url = '{}/service/{}_{}.html?type={}'.format(base_url, report, code, type)
+                file_name = os.path.join(save_dir, report, sub_dir, code + '.csv')
+                jobs.append(((code, report, type), url, file_name))
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+        results = await asyncio.gather(
+            *[fetchToFile(session, limiter, semaphore, url, file_name, retries) for _, url, file_name in jobs])
+    failed = [job[0] for job, ok in zip(jobs, results) if not ok]
+    for code, report, type in failed:
+        print(code + "_________" + report + "____failed,type=" + type)
+    return failed
+
+
+def getFinanceDataOfCodesAsync(code_list, **kwargs):
+    """
+        异步下载财报数据：共享连接池、按域名令牌桶限速、限制并发，参数见downloadFinanceData
+    :param code_list:股票代码列表
+    :return: 下载失败的(code, 报表, type)列表
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(downloadFinanceData(code_list, **kwargs))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def fetchSharePrice(code, start, end):
+    """
+        下载一支股票[start, end]的股价数据：开高低收和成交量来自get_k_data的前复权数据（与原来share_price_processed相同），
+        换手率、均线等只有get_hist_data提供的列按日期并入，get_hist_data只提供近三年的数据，更早的日期这些列为空；
+        这些列是tushare按不复权价格计算的原值
+    :param code: 股票代码
+    :param start: 开始日期
+    :param end: 结束日期
+    :return: 以date为索引、按日期降序的DataFrame，列的顺序与get_hist_data相同；没有数据时返回None
+    """
+    k_data = ts.get_k_data(code, start=start, end=end)
+    if k_data is None or len(k_data) < 1:
+        return None
+    df = k_data.set_index('date')[K_DATA_COLUMNS]
+    hist = ts.get_hist_data(code, start=start, end=end)
+    if hist is not None and len(hist):
+        df = df.join(hist[HIST_EXTRA_COLUMNS])
+    df = df.reindex(columns=K_DATA_COLUMNS + HIST_EXTRA_COLUMNS)
+    df.index.name = 'date'
+    return df.sort_index(ascending=False)
+
+
 def downloadSharePrice(code, years=7):
     """
-        下载指定股票代码的历史股价数据到本地, 文件名为<code>.csv, 默认下载7年的数据
+        下载指定股票代码的历史股价数据到本地, 文件名为<code>.csv, 默认下载7年的数据。
+        只保存一份数据（见fetchSharePrice），PyAlgo需要的格式由PriceView改列名得到，不需要再下载一遍
     :param code: 股票代码，例如000001
     :param years: 至今多少年的行情数据
     :return:
     """
     if years == 0:
         return
-    # 存储路径，pyalgotrade处理的数据
-    # save_path = os.path.join("data/share_price_processed/", "{}.csv".format(code))
     # 历史数据存储的路径
     save_path = os.path.join("data/share_price/", "{}.csv".format(code))
     # 判断之前是否下载过
@@ -163,35 +333,23 @@ def downloadSharePrice(code, years=7):
     now = datetime.datetime.now()
     start_time = now - datetime.timedelta(days=years * 365)
     # start = start_time.strftime("%Y-%m-%d")
-    start = "2000-11-21"
+    start = SHARE_PRICE_START
     end_time = "2019-11-26"
     try:
         print("{} 正在下载过去{}年的股价数据".format(code, years))
-        # 注释掉的为pyalgotrade处理的数据
-        #df = ts.get_k_data(code, start=start, end=end_time)
-        # 下面的是tushare的历史股价数据，近三年的股价数据，因为tushare的get_hist_data接口只提供近三年的数据
-        df = ts.get_hist_data(code, start=start, end=end_time)
+        # 前复权的get_k_data覆盖近7年，get_hist_data只提供近三年的数据，它独有的列并入同一个文件
+        df = fetchSharePrice(code, start=start, end=end_time)
         print("{} 下载完成".format(code))
-        if len(df) < 1:
+        if df is None or len(df) < 1:
             print("{} 下载失败".format(code))
             return
     except:
         print("{} 下载失败".format(code))
         return
 
-    # 新建Adj Close字段，生成pyalgotrade数据的时候用，当生成历史数据的时候需要将其注释掉
-    # df["Adj Close"] = df.close
-
-    # 下面两行用来获取历史数据
     df['code'] = code
-    df.sort_index()
-
-    # 将tushare下的数据的字段保存为pyalgotrade所要求的数据格式，生成pyalgotrade数据的时候用，当生成历史数据的时候需要将其注释掉
-    # df.columns = ["Date", "Open", "Close", "High", "Low", "Volume", "code", "Adj Close"]
 
-    # 将数据保存成本地csv文件，生成pyalgotrade用
-    # df.to_csv(save_path, index=False)
-    # 生成历史数据时用
+    # Adj Close（即前复权的close）以及Date、Open等PyAlgo的列名由PriceView.PYALGO_COLUMNS映射，不再单独保存
     df.to_csv(save_path, index=True)
 
 
@@ -207,9 +365,142 @@ def downloadSharePriceOfCodes(code_list):
     pool.join()
 
 
+def updateSharePrice(code, source=None, end=None, save_dir='data/share_price/'):
+    """
+        增量更新历史股价数据：读取已保存的最后一个交易日，从这一天开始下载缺少的数据，
+        写入临时文件后再原子替换原文件，并保持文件原有的日期顺序（tushare为降序）。
+        股价是前复权的，除权除息之后以前的价格都会改变：重新下载到的最后一个交易日的收盘价与文件中的不同时，
+        重新下载全部数据替换整个文件
+    :param code: 股票代码
+    :param source: 数据源，调用方式与fetchSharePrice(code, start=..., end=...)相同，默认fetchSharePrice，
+                   测试时可以换成读取本地数据的假数据源
+    :param end: 更新到哪一天，默认今天
+    :param save_dir: 历史数据的存储路径
+    :return: 新增的行数
+    """
+    source = source or fetchSharePrice
+    save_path = os.path.join(save_dir, "{}.csv".format(code))
+    end = end or datetime.date.today().strftime("%Y-%m-%d")
+    dates = None
+    last = None
+    if os.path.exists(save_path):
+        dates = loadCSVIndex(save_path)['date'][:-1]
+        if len(dates):
+            last = str(dates.max())
+            if str(dates.max() + numpy.timedelta64(1, 'D')) > end:
+                return 0
+
+    df = downloadSharePriceRange(source, code, last or SHARE_PRICE_START, end)
+    if df is None:
+        return 0
+    if last is not None:
+        overlap = df[df['date'] == last]
+        stored = readCSVRange(save_path, last, last)
+        if len(overlap) and len(stored) and not numpy.allclose(overlap['close'].values, stored['close'].values):
+            # 复权因子变了，已保存的价格全部作废
+            full = downloadSharePriceRange(source, code, SHARE_PRICE_START, end)
+            if full is None:
+                return 0
+            ascending = len(dates) > 1 and dates[0] <= dates[-1]
+            writeSharePrice(full, save_path, ascending)
+            metrics.count('rebases')
+            metrics.count('files')
+            count = int(numpy.sum(full['date'] > last))
+            metrics.count('rows', count)
+            return count
+        df = df[df['date'] > last]
+    if len(df) < 1:
+        return 0
+
+    if dates is None:
+        writeSharePrice(df, save_path)
+        metrics.count('files')
+        metrics.count('rows', len(df))
+        return len(df)
+
+    with open(save_path, 'rb') as f:
+        header = f.readline()
+    df = df[[name.strip() for name in header.decode('utf-8').split(',')]]
+    ascending = len(dates) > 1 and dates[0] <= dates[-1]
+    rows = df.sort_values(by='date', ascending=ascending).to_csv(index=False, header=False).encode('utf-8')
+
+    tmp_path = save_path + '.tmp'
+    with open(save_path, 'rb') as f, open(tmp_path, 'wb') as out:
+        if ascending:
+            # 升序文件：新数据接在末尾
+            shutil.copyfileobj(f, out)
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                out.write(b'\n')
+            out.write(rows)
+        else:
+            # 降序文件：新数据插在表头之后
+            out.write(f.readline())
+            out.write(rows)
+            shutil.copyfileobj(f, out)
+    os.replace(tmp_path, save_path)
+    metrics.count('files')
+    metrics.count('rows', len(df))
+    return len(df)
+
+
+def downloadSharePriceRange(source, code, start, end):
+    """
+        调用数据源下载[start, end]的数据，失败或没有数据时返回None
+    :param source: 数据源，见updateSharePrice
+    :param code: 股票代码
+    :param start: 开始日期
+    :param end: 结束日期
+    :return: 以date为普通列（字符串）、带code列的DataFrame
+    """
+    try:
+        with metrics.stage('download', code):
+            df = source(code, start=start, end=end)
+    except:
+        metrics.count('failures')
+        print("{} 更新失败".format(code))
+        return None
+    if df is None or len(df) < 1:
+        return None
+    df = df.copy()
+    df['code'] = code
+    df = df.reset_index()
+    df['date'] = df['date'].astype(str)
+    df = df[df['date'] >= start]
+    return df if len(df) else None
+
+
+def writeSharePrice(df, save_path, ascending=False):
+    """
+        把完整的股价数据写入临时文件后原子替换save_path
+    :param df: downloadSharePriceRange的结果
+    :param save_path: csv文件
+    :param ascending: 日期是否升序，tushare为降序
+    :return:
+    """
+    tmp_path = save_path + '.tmp'
+    df.sort_values(by='date', ascending=ascending).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, save_path)
+
+
+def updateSharePriceOfCodes(code_list, source=None, end=None):
+    """
+        单核多线程增量更新股价数据
+    :param code_list: 股票代码列表
+    :param source: 数据源，见updateSharePrice
+    :param end: 更新到哪一天，默认今天
+    :return: 新增的总行数
+    """
+    pool = Pool(4)
+    counts = pool.map(lambda code: updateSharePrice(code, source=source, end=end), code_list)
+    pool.close()
+    pool.join()
+    return sum(counts)
+
+
 def isExist(code, path="data/share_price/ "):
     """
-        data/share_price_processed/或data/share_price/
+        检查data/share_price/下是否有该股票的数据，没有时重新下载
     :param code:
     :param path:
     :return:
@@ -272,11 +563,208 @@ def getStockInfo(lst, fpath):
             continue
 
 
+STOCK_INFO_BASE_URL = 'http://quote.eastmoney.com'
+# 总市值、净资产、净利润的单位为元，其余为百分比数值
+STOCK_INFO_COLUMNS = ['sz/sh', '代码', '总市值', '净资产', '净利润', '市盈率(%)', '市净率(%)', '毛利率(%)', '净利率(%)', 'ROE(%)']
+CWZB_PATTERN = re.compile(r'class\s*=\s*["\']?cwzb\b')
+NUMBER_UNITS = {'亿': 1e8, '万': 1e4}
+
+
+def exchangeOfCode(code):
+    """
+        根据代码前缀判断交易所：6、9开头为上交所（主板、B股），其余（0、2、3开头）为深交所
+    :param code: 股票代码
+    :return: sh或sz
+    """
+    return 'sh' if code[:1] in ('6', '9') else 'sz'
+
+
+def parseNumber(text):
+    """
+        把页面上的文本转换为数值，例如'2,345.6亿' -> 234560000000.0，'12.3%' -> 12.3，'-' -> nan
+    :param text: 单元格文本
+    :return:
+    """
+    text = text.strip().replace(',', '').rstrip('%')
+    scale = 1.0
+    if text[-1:] in NUMBER_UNITS:
+        scale = NUMBER_UNITS[text[-1]]
+        text = text[:-1]
+    try:
+        return float(text) * scale
+    except ValueError:
+        return float('nan')
+
+
+class CwzbParser(HTMLParser):
+    """
+        只收集喂给它的html片段中第一个tbody里各个td的文本
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.cells = []
+        self.__inBody = False
+        self.__text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tbody':
+            self.__inBody = True
+        elif tag == 'td' and self.__inBody:
+            self.__text = []
+
+    def handle_endtag(self, tag):
+        if tag == 'td' and self.__text is not None:
+            self.cells.append(''.join(self.__text))
+            self.__text = None
+        elif tag == 'tbody':
+            self.__inBody = False
+
+    def handle_data(self, data):
+        if self.__text is not None:
+            self.__text.append(data)
+
+
+def parseStockInfoPage(html):
+    """
+        从东方财富个股页面中取出cwzb（财务指标）表格的8个数值，只解析这一小段html，不再构造整页的BeautifulSoup
+    :param html: 页面html
+    :return: [总市值, 净资产, 净利润, 市盈率, 市净率, 毛利率, 净利率, ROE]，页面中没有cwzb表格时返回None
+    """
+    match = CWZB_PATTERN.search(html)
+    if match is None:
+        return None
+    end = html.find('</tbody>', match.end())
+    if end < 0:
+        return None
+    parser = CwzbParser()
+    parser.feed(html[match.end():end + len('</tbody>')])
+    cells = parser.cells[1:9]
+    if len(cells) < 8:
+        return None
+    return [parseNumber(cell) for cell in cells]
+
+
+async def fetchText(session, limiter, semaphore, url, encoding='gbk', retries=3):
+    """
+        异步获取页面文本，页面不存在（404）时直接返回None，不再重试
+    :param session: 共享的aiohttp.ClientSession
+    :param limiter: HostRateLimiter
+    :param semaphore: 限制同时进行的请求数
+    :param url: 页面地址
+    :param encoding: 页面编码，东方财富为GB2312，这里按其超集gbk解码
+    :param retries: 失败重试次数
+    :return:
+    """
+    for attempt in range(retries):
+        async with semaphore:
+            await limiter.acquire(url)
+            try:
+                async with session.get(url) as r:
+                    if r.status == 404:
+                        return None
+                    r.raise_for_status()
+                    return (await r.read()).decode(encoding, errors='ignore')
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+        if attempt + 1 < retries:
+            metrics.count('retries')
+            await asyncio.sleep(2 ** attempt)
+    metrics.count('failures')
+    return None
+
+
+async def downloadStockInfo(code_list, base_url=STOCK_INFO_BASE_URL, rate=5, capacity=10, concurrency=16, retries=3):
+    """
+        并发获取每支股票的财务指标，交易所由代码前缀确定，只有该页面取不到时才尝试另一个交易所
+    :param code_list: 股票代码列表
+    :param base_url: 东方财富地址，测试时可以换成本地的http服务
+    :param rate: 每秒最多请求数
+    :param capacity: 令牌桶容量
+    :param concurrency: 最大并发连接数
+    :param retries: 每个页面的重试次数
+    :return: 按STOCK_INFO_COLUMNS排列的行，取不到的股票不包含在内
+    """
+    limiter = HostRateLimiter(rate, capacity)
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async def fetchOne(session, code):
+        exchange = exchangeOfCode(code)
+        for ex in (exchange, 'sz' if exchange == 'sh' else 'sh'):
+            html = await fetchText(session, limiter, semaphore, '{}/{}{}.html'.format(base_url, ex, code),
+                                   retries=retries)
+            values = parseStockInfoPage(html) if html else None
+            if values is not None:
+                return [ex, code] + values
+        return None
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+        rows = await asyncio.gather(*[fetchOne(session, code) for code in code_list])
+    return [row for row in rows if row is not None]
+
+
+def readStockInfoPages(code_list, html_dir):
+    """
+        从保存下来的页面（<html_dir>/<sz|sh><code>.html）中解析财务指标，与downloadStockInfo结果相同，用于离线测试
+    :param code_list: 股票代码列表
+    :param html_dir: 页面目录
+    :return: 按STOCK_INFO_COLUMNS排列的行
+    """
+    rows = []
+    for code in code_list:
+        exchange = exchangeOfCode(code)
+        for ex in (exchange, 'sz' if exchange == 'sh' else 'sh'):
+            path = os.path.join(html_dir, '{}{}.html'.format(ex, code))
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                values = parseStockInfoPage(f.read().decode('gbk', errors='ignore'))
+            if values is not None:
+                rows.append([ex, code] + values)
+                break
+    return rows
+
+
+def saveStockInfo(rows, fpath='data/stockInfo.csv'):
+    """
+        一次性写出全部股票的财务指标，先写临时文件再替换
+    :param rows: 按STOCK_INFO_COLUMNS排列的行
+    :param fpath: 保存位置
+    :return: DataFrame
+    """
+    df = pandas.DataFrame(rows, columns=STOCK_INFO_COLUMNS)
+    df.to_csv(fpath + '.tmp', index=False, encoding='utf-8')
+    os.replace(fpath + '.tmp', fpath)
+    return df
+
+
+def getStockInfoAsync(code_list, fpath='data/stockInfo.csv', html_dir=None, **kwargs):
+    """
+        获取全部股票的财务指标（总市值、净资产、净利润、市盈率、市净率、毛利率、净利率、ROE）并保存为csv
+    :param code_list: 股票代码列表
+    :param fpath: 保存位置
+    :param html_dir: 指定时从保存下来的页面中解析，不访问网络
+    :param kwargs: 其余参数见downloadStockInfo
+    :return: DataFrame
+    """
+    if html_dir is not None:
+        return saveStockInfo(readStockInfoPages(code_list, html_dir), fpath)
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        rows = loop.run_until_complete(downloadStockInfo(code_list, **kwargs))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    return saveStockInfo(rows, fpath)
+
+
 if __name__ == '__main__':
 
     # 创建数据文件夹
     dir_list = ['data/lrb/season', 'data/lrb/year', 'data/xjllb/season', 'data/xjllb/year', 'data/zcfzb/season',
-                'data/zcfzb/year', 'data/share_price_processed', 'data/share_price']
+                'data/zcfzb/year', 'data/share_price']
     for path in dir_list:
         if not os.path.exists(path):
             mkdir(path)
@@ -287,12 +775,14 @@ if __name__ == '__main__':
     print("一共{}支股票！".format(len(stock_code_list)))
 
     '''
-    获取每支股票最近7年的股价数据，或者注释掉一些代码获取近三年内的历史数据
+    获取每支股票的股价数据，只下载一份tushare格式的数据，PyAlgo需要的格式由PriceView得到
     来源：tushare
     下载时间：2019年10月17日
     股价时间跨度：2010年10月1日—2019年10月1日
     '''
     downloadSharePriceOfCodes(stock_code_list)
+    # 日常更新时只下载每支股票最后一个交易日之后的数据
+    # updateSharePriceOfCodes(stock_code_list)
     # 查看哪些股票的股价数据没有被下载，并重新下载
     isExitOfCodes(stock_code_list)
 
@@ -302,7 +792,9 @@ if __name__ == '__main__':
     年度财报截止日期：2017年12月31日
     季度财报截止日期：2019年11月21日
     '''
-    getFinanceDataOfCodes(stock_code_list)
+    # getFinanceDataOfCodes(stock_code_list)
+    # 异步下载：共享连接池，按域名令牌桶限速，不再每次请求后sleep
+    getFinanceDataOfCodesAsync(stock_code_list)
 
 
 
@@ -311,3 +803,5 @@ if __name__ == '__main__':
     来源：东方财富网个股页面
     '''
     # getStockInfo(stock_code_list, 'data/stockInfo.txt')
+    # 并发获取，按代码前缀确定交易所，只解析cwzb表格，一次性写入data/stockInfo.csv
+    # getStockInfoAsync(stock_code_list, 'data/stockInfo.csv')
@@ -1,8 +1,12 @@
 import datetime
-import time
 
+import numpy
+
+from FeatureStore import FeatureStore
+from PriceStore import STORE_DIR, loadPanel, openPriceStore
 from Stock import *
-from preprocess import getStockCodeAndName
+from StockUniverse import loadUniverse
+from UniverseFilter import ST_PREFIXES, UniverseFilter
 
 """
     设计两种股票排序逻辑：
@@ -47,12 +51,17 @@ def sortStockByMACD(dict_stocks):
     total = len(stock_code_list)
     c = 0
     start = datetime.datetime.now()
+    # 如果已经通过PriceStore.py转换过列式仓库，则直接从内存映射中读取，不再逐个解析csv
+    hist_store = openPriceStore(os.path.join(STORE_DIR, 'share_price'))
+    # 股价数据没有变化的股票直接读取上次保存在data/feature_store/中的MACD
+    feature_store = FeatureStore()
     print('MACD排序进行中')
     for i in range(len(stock_code_list)):
         code = stock_code_list[i]
         name = stock_name_list[i]
         industry = stock_industry_list[i]
-        stock = Stock(stock_code=code, stock_name=name, stock_industry=industry)
+        stock = Stock(stock_code=code, stock_name=name, stock_industry=industry, hist_store=hist_store,
+                      feature_store=feature_store)
         macd = stock.MACD()['macd']
         count = macd.count()
         percentage = macd[macd >= 0].count() / count
@@ -63,11 +72,33 @@ def sortStockByMACD(dict_stocks):
     return sortDictByValueDesc(MACD_in_percent_dict)
 
 
-def sortStockByROE():
+def sortStockByMACDBatch(dict_stocks):
+    """
+        与sortStockByMACD结果相同的批量版本：把所有股票的收盘价读成左对齐的面板，一次算出全部股票的MACD，
+        不再逐个构造Stock对象
+    :param dict_stocks:
+    :return:
+    """
+    hist_store = openPriceStore(os.path.join(STORE_DIR, 'share_price'))
+    panel = loadPanel(dict_stocks['code'], ['close'], price_store=hist_store, csv_dir='data/share_price/')
+    # 每一列是一支股票，与stockstats一致：macd = close_12_ema - close_26_ema，ewm(span, adjust=True, min_periods=1)
+    close = pandas.DataFrame(panel['close'].T, columns=panel['codes'])
+    macd = close.ewm(span=12, adjust=True, min_periods=1).mean() - close.ewm(span=26, adjust=True, min_periods=1).mean()
+    # ewm在面板尾部的NaN填充处会沿用前一个值，这里去掉
+    macd = macd.where(close.notna())
+    percentage = (macd >= 0).sum() / macd.count()
+    return sortDictByValueDesc(percentage.to_dict())
+
+
+def sortStockByROE(info_path='data/stockInfo.csv'):
     """
         根据东方财富网个股页面提供的每支股票的ROE百分比（加权净资产收益率）对股票进行排序
+    :param info_path: getStockInfoAsync保存的csv，不存在时读取getStockInfo保存的data/stockInfo.txt
     :return:
     """
+    if os.path.exists(info_path):
+        info = pandas.read_csv(info_path, dtype={'代码': str}).dropna(subset=['ROE(%)'])
+        return sortDictByValueDesc(dict(zip(info['代码'], info['ROE(%)'])))
     path = 'data/stockInfo.txt'
     roe_dict = {}
     with open(path, 'r', encoding='utf-8') as f:
@@ -84,61 +115,200 @@ def sortStockByROE():
     return sortDictByValueDesc(roe_dict)
 
 
-def saveFilteredStocks(sorted_stocks, Index='ROE', path='data/filtered_stocks', start=0, end=-1):
+# 多因子筛选可以使用的因子，除MACD外都来自getStockInfoAsync保存的data/stockInfo.csv
+FACTOR_COLUMNS = {
+    'ROE': 'ROE(%)',
+    'PE': '市盈率(%)',
+    'PB': '市净率(%)',
+    'GrossMargin': '毛利率(%)',
+    'NetMargin': '净利率(%)',
+    'MarketCap': '总市值',
+    'NetAssets': '净资产',
+    'NetProfit': '净利润',
+}
+
+
+class StockScreener(object):
+    """
+        多因子筛选：各因子按股票对齐成列并缓存，调整权重重新筛选时不会重新计算MACD或重新读取文件
+    """
+
+    def __init__(self, dict_stocks, info_path='data/stockInfo.csv'):
+        """
+        :param dict_stocks: getStockCodeAndName的返回值，决定股票池
+        :param info_path: getStockInfoAsync保存的csv
+        """
+        self.dict_stocks = dict_stocks
+        self.info_path = info_path
+        self.codes = pandas.Index(dict_stocks['code'])
+        self.names = pandas.Series(dict_stocks['name'], index=self.codes).astype(str)
+        self.__info = None
+        self.__factors = {}
+        self.__normalized = {}
+
+    def __stockInfo(self):
+        if self.__info is None:
+            info = pandas.read_csv(self.info_path, dtype={'代码': str})
+            self.__info = info.drop_duplicates(subset='代码').set_index('代码')
+        return self.__info
+
+    def factor(self, name):
+        """
+            与股票池对齐的因子列，第一次访问时计算，之后直接返回缓存
+        :param name: MACD（MACD大于等于0的天数占比）、FACTOR_COLUMNS中的因子或通过setFactor添加的因子
+        :return: 以股票代码为索引的Series，缺失的为NaN
+        """
+        if name not in self.__factors:
+            if name == 'MACD':
+                values = pandas.Series(dict(sortStockByMACDBatch(self.dict_stocks)))
+            elif name in FACTOR_COLUMNS:
+                values = self.__stockInfo()[FACTOR_COLUMNS[name]]
+            else:
+                raise KeyError('未知的因子：{}'.format(name))
+            self.setFactor(name, values)
+        return self.__factors[name]
+
+    def setFactor(self, name, values):
+        """
+            添加或替换一个因子，例如FundamentalStore.latest得到的财务科目
+        :param name: 因子名称
+        :param values: 以股票代码为索引的Series
+        :return:
+        """
+        self.__factors[name] = pandas.Series(values, dtype=float).reindex(self.codes)
+        for key in [key for key in self.__normalized if key[0] == name]:
+            del self.__normalized[key]
+
+    def normalized(self, name, method='rank'):
+        """
+            标准化后的因子列，同样缓存
+        :param name: 因子名称
+        :param method: rank为在整个股票池中的百分位排名，zscore为标准分
+        :return:
+        """
+        key = (name, method)
+        if key not in self.__normalized:
+            values = self.factor(name)
+            if method == 'rank':
+                self.__normalized[key] = values.rank(pct=True)
+            elif method == 'zscore':
+                self.__normalized[key] = (values - values.mean()) / values.std()
+            else:
+                raise ValueError('未知的标准化方法：{}'.format(method))
+        return self.__normalized[key]
+
+    def scores(self, weights, method='rank'):
+        """
+            综合得分 = Σ 权重 × 标准化后的因子，任一因子缺失的股票得分为NaN
+        :param weights: {因子名称: 权重}，权重为负表示越小越好，例如{'ROE': 1, 'PE': -0.5}
+        :param method: rank或zscore
+        :return: 以股票代码为索引的Series
+        """
+        total = pandas.Series(0.0, index=self.codes)
+        for name, weight in weights.items():
+            total += weight * self.normalized(name, method)
+        return total
+
+    def mask(self, filters=None, exclude_st=True):
+        """
+            一次性在整个股票池上计算筛选条件
+        :param filters: {因子名称: (下限, 上限)}，闭区间，None表示不限，例如{'PE': (0, 50)}
+        :param exclude_st: 是否排除ST类股票，前缀与UniverseFilter.notST相同（ST、*ST、S*ST、SST）
+        :return: 布尔数组
+        """
+        keep = numpy.ones(len(self.codes), dtype=bool)
+        for name, (low, high) in (filters or {}).items():
+            values = self.factor(name).values
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+        if exclude_st:
+            keep &= ~self.names.str.startswith(ST_PREFIXES).values
+        return keep
+
+    def screen(self, weights, filters=None, k=50, method='rank', exclude_st=True):
+        """
+            按综合得分取前k支股票，只对前k个做部分排序，不再对整个股票池排序
+        :param weights: {因子名称: 权重}
+        :param filters: {因子名称: (下限, 上限)}
+        :param k: 返回的股票数
+        :param method: rank或zscore
+        :param exclude_st: 是否排除ST类股票
+        :return: [(code, score)]，按得分降序，格式与sortDictByValueDesc相同，可以直接交给saveFilteredStocks
+        """
+        scores = self.scores(weights, method).values
+        index = numpy.flatnonzero(self.mask(filters, exclude_st) & numpy.isfinite(scores))
+        if k < len(index):
+            index = index[numpy.argpartition(-scores[index], k - 1)[:k]]
+        index = index[numpy.argsort(-scores[index], kind='stable')]
+        return [(self.codes[i], float(scores[i])) for i in index]
+
+
+def saveFilteredStocks(sorted_stocks, Index='ROE', path='data/filtered_stocks', start=0, end=None, mask=None):
     """
-        对排序后的股票进行筛选，去除带有*ST的股票，并保存到文件中
+        对排序后的股票进行筛选，去除带有*ST的股票（或按mask筛选），并一次性写入文件
     :param sorted_stocks: 排序后的股票，格式：(code,index)，（股票，相应指数）
     :param Index: 指标类型
     :param path: 保存文件的路径
+    :param start: 筛选之后保留的排名区间[start, end)
+    :param end: 默认保留全部
+    :param mask: UniverseFilter组合出的布尔数组（与股票池对齐），默认只排除ST、*ST股票
     :return:
     """
     print('{}指标开始筛选：'.format(Index))
-    code2Name_dict, code2Industry_dict = stockCode2NameAndIndustry(dict_stocks)
-    f = open('{}_{}.txt'.format(path, Index), 'w', encoding='utf-8')
+    universe_filter = UniverseFilter(loadUniverse())
+    if mask is None:
+        mask = universe_filter.notST()
+    selected = universe_filter.select(sorted_stocks, mask)[start:end]
+    universe = universe_filter.universe
     headers = ['代码', '名称', '行业', Index]
-    for i in range(len(headers)):
-        f.write("{0:<4}\t".format(headers[i], chr(12288)))
-    length = len(sorted_stocks)
-    count = 0
-    c = 0
-    startTime = datetime.datetime.now()
-    for code, index in sorted_stocks[start:end]:
-        name = code2Name_dict[code]
-        industry = code2Industry_dict[code]
-        c += 1
-        if str(name).startswith('*ST'):
-            continue
-        f.write('\n{}\t{}\t{}\t{}'.format(code, name, industry, index))
-        count += 1
-        printProcess(c, end - start, datetime.datetime.now() - startTime, '排除*ST Done!')
-        time.sleep(0.1)
-    print('筛选后：{}支股票'.format(count))
+    lines = [''.join("{0:<4}\t".format(header) for header in headers)]
+    lines += ['{}\t{}\t{}\t{}'.format(code, universe.name(code), universe.industryOf(code), index)
+              for code, index in selected]
+    with open('{}_{}.txt'.format(path, Index), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+    print('筛选后：{}支股票'.format(len(selected)))
     print('保存至文件：{}_{}.txt中'.format(path, Index))
 
 
-def stockCode2NameAndIndustry(dict_stocks):
-    stock_code_list = dict_stocks['code']
-    stock_name_list = dict_stocks['name']
-    stock_industry_list = dict_stocks['industry']
-    code2Name_dict = {}
-    code2Industry_dict = {}
-    for i in range(len(stock_code_list)):
-        code = stock_code_list[i]
-        name = stock_name_list[i]
-        industry = stock_industry_list[i]
-        code2Name_dict[code] = name
-        code2Industry_dict[code] = industry
-    return code2Name_dict, code2Industry_dict
+def readFilteredCodes(path):
+    """
+        读取saveFilteredStocks保存的筛选结果文件，返回其中的股票代码
+    :param path: 筛选结果文件，例如data/filtered_stocks_ROE.txt
+    :return:
+    """
+    code_lis = []
+    with open(path, 'r', encoding='utf-8') as f:
+        count = 0
+        lines = f.readlines()
+        for line in lines:
+            if count == 0:
+                count += 1
+                continue
+            info = line.split('\t')
+            code_lis.append(info[0])
+    return code_lis
 
 
 if __name__ == '__main__':
-    # 对A股3520家上市公司进行排名，
-    dict_stocks = getStockCodeAndName()
+    # 对A股3520家上市公司进行排名，股票池在进程内只加载一次，可以当作getStockCodeAndName返回的dict使用
+    dict_stocks = loadUniverse()
+
+    # 股票池过滤：排除ST、*ST，去掉股价数据不足一年（刚上市）、近20个交易日平均换手率过低以及近一年停牌过多的股票，
+    # 代替原来按排名位置手工去掉新股的start、end
+    universe_filter = UniverseFilter(dict_stocks)
+    mask = universe_filter.notST() & universe_filter.minBars(250) & universe_filter.minTurnover(0.2) & \
+        universe_filter.maxSuspension(0.1)
 
     # 方法一：根据MACD
-    # 可以通过修改start和end修改筛选出来的股票规模，这里是去掉刚上市几个月的公司
-    sorted_stocks = sortStockByMACD(dict_stocks)
-    saveFilteredStocks(sorted_stocks, Index='MACD', start=101, end=376)
+    # sortStockByMACDBatch与sortStockByMACD的结果相同，但一次算出所有股票的MACD，不再逐个构造Stock对象
+    sorted_stocks = sortStockByMACDBatch(dict_stocks)
+    saveFilteredStocks(sorted_stocks, Index='MACD', end=275, mask=mask)
     # 方法二：ROE
     sorted_stocks = sortStockByROE()
-    saveFilteredStocks(sorted_stocks, start=6, end=276)
+    saveFilteredStocks(sorted_stocks, end=270, mask=mask)
+    # 方法三：多因子综合打分，直接取前K支股票（需要先通过preprocess.getStockInfoAsync生成data/stockInfo.csv）
+    # screener = StockScreener(dict_stocks)
+    # top_stocks = screener.screen({'MACD': 1, 'ROE': 1, 'PE': -0.5}, filters={'PE': (0, 50)}, k=270)
+    # saveFilteredStocks(top_stocks, Index='Composite', start=0, end=len(top_stocks))
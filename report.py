@@ -0,0 +1,138 @@
+import argparse
+import multiprocessing
+import os
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+import pandas
+
+from DualThrustStrategy import runStrategy
+from Metrics import metrics
+from PriceView import readPyAlgoCSV
+from Stock import Stock
+
+"""
+    报告阶段：批量回测（AnalyzeByDualThrust）不再绘图，回测结束后从结果文件中取排名靠前的股票，
+    用无界面的Agg后端把Dual Thrust回测图和指标图渲染成png或svg，多进程并行，每支股票一个任务。
+    用法：
+        python3 report.py --index ROE --top 20 --format svg --workers 4
+    @Author: zengshuang61@gmail.com
+"""
+
+CHART_DIR = 'result/charts'
+INDICATORS = ['MACD', 'KDJ', 'BOLL']
+
+
+def topRanked(result_path, top=10, sort_by='cumReturn(%)'):
+    """
+        回测结果中排名靠前的股票
+    :param result_path: AnalyzeByDualThrust输出的result/dual_thrust_<Index>.csv
+    :param top: 取前多少支
+    :param sort_by: 排序的列，降序
+    :return: 股票代码列表
+    """
+    df = pandas.read_csv(result_path, dtype={'code': str})
+    return df.sort_values(by=sort_by, ascending=False)['code'].head(top).tolist()
+
+
+def renderStock(code, output_dir=CHART_DIR, fmt='png', indicators=INDICATORS, csv_dir='data/share_price_processed'):
+    """
+        渲染一支股票的回测图和指标图
+    :param code: 股票代码
+    :param output_dir: 输出目录
+    :param fmt: 图片格式，png或svg
+    :param indicators: Stock的指标方法名
+    :param csv_dir: PyAlgo格式的股价数据目录，没有某支股票的csv时读取data/share_price/下的数据
+    :return: 生成的文件列表
+    """
+    paths = [os.path.join(output_dir, '{}_dual_thrust.{}'.format(code, fmt))]
+    runStrategy(code, os.path.join(csv_dir, '{}.csv'.format(code)), stdout=False, plot_path=paths[0],
+                data=readPyAlgoCSV(code, csv_dir=csv_dir))
+    stock = Stock(code)
+    for name in indicators:
+        path = os.path.join(output_dir, '{}_{}.{}'.format(code, name, fmt))
+        with metrics.stage('plot', code):
+            stock.pltShow(getattr(stock, name)(), path=path)
+        paths.append(path)
+    return paths
+
+
+def _renderInWorker(task):
+    """
+        子进程中执行的渲染任务，异常随结果一起返回
+    :param task: (股票代码, 输出目录, 格式, 指标, 股价数据目录)
+    :return: (股票代码, 生成的文件或None, 错误信息或None, 运行指标)
+    """
+    code = task[0]
+    metrics.reset()
+    try:
+        paths, error = renderStock(*task), None
+    except Exception as e:
+        metrics.count('failures')
+        paths, error = None, '{}: {}'.format(type(e).__name__, e)
+    return code, paths, error, metrics.snapshot()
+
+
+def renderCharts(codes, output_dir=CHART_DIR, fmt='png', indicators=INDICATORS, workers=None,
+                 csv_dir='data/share_price_processed'):
+    """
+        并行渲染多支股票的图
+    :param codes: 股票代码列表
+    :param output_dir: 输出目录
+    :param fmt: 图片格式，png或svg
+    :param indicators: Stock的指标方法名
+    :param workers: 进程数，1为串行，None为使用全部CPU核数
+    :param csv_dir: PyAlgo格式的股价数据目录
+    :return: {股票代码: 生成的文件列表}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(code, output_dir, fmt, indicators, csv_dir) for code in codes]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    ret = {}
+    if workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+        try:
+            for code, paths, error, snapshot in pool.imap_unordered(_renderInWorker, tasks):
+                metrics.merge(snapshot)
+                if error is not None:
+                    print('error {}! {}'.format(code, error))
+                    continue
+                ret[code] = paths
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            try:
+                ret[task[0]] = renderStock(*task)
+            except Exception as e:
+                metrics.count('failures')
+                print('error {}! {}'.format(task[0], e))
+    metrics.count('charts', sum(len(paths) for paths in ret.values()))
+    return ret
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='渲染回测结果中排名靠前的股票的回测图和指标图')
+    parser.add_argument('--index', default='ROE', help='回测结果文件result/dual_thrust_<index>.csv')
+    parser.add_argument('--top', type=int, default=10, help='渲染排名前多少支股票')
+    parser.add_argument('--sort-by', default='cumReturn(%)', help='排序的列')
+    parser.add_argument('--format', default='png', choices=['png', 'svg'], help='图片格式')
+    parser.add_argument('--indicators', default=','.join(INDICATORS), help='指标图，逗号分隔的Stock方法名')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认使用全部CPU核数')
+    parser.add_argument('--output', default=CHART_DIR, help='输出目录')
+    args = parser.parse_args(argv)
+
+    codes = topRanked(os.path.join('result', 'dual_thrust_{}.csv'.format(args.index)), args.top, args.sort_by)
+    indicators = [name for name in args.indicators.split(',') if name]
+    charts = renderCharts(codes, args.output, args.format, indicators, args.workers)
+    print('{}支股票，共{}张图，保存在{}'.format(len(charts), sum(len(paths) for paths in charts.values()),
+                                        args.output))
+    metrics.report()
+
+
+if __name__ == '__main__':
+    main()
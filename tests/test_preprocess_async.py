@@ -0,0 +1,94 @@
+import asyncio
+import os
+import time
+
+from aiohttp import web
+
+from Metrics import metrics
+from preprocess import FINANCE_REPORTS, downloadFinanceData
+
+"""
+    用本地的aiohttp.web假服务器测试异步财报下载：限速、失败重试以及写文件失败不影响其他下载
+    @Author: zengshuang61@gmail.com
+"""
+
+RATE = 20.0
+
+
+async def runWithStubServer(save_dir, code_list, fail_once, retries=2):
+    """
+        启动假服务器并下载
+    :param save_dir: 数据目录
+    :param code_list: 股票代码列表
+    :param fail_once: 第一次请求返回500的路径
+    :param retries: 每个文件的重试次数
+    :return: (下载失败的列表, [(请求时间, 路径)])
+    """
+    requests = []
+
+    async def handle(request):
+        requests.append((time.monotonic(), request.path_qs))
+        if request.path_qs in fail_once and sum(path == request.path_qs for _, path in requests) == 1:
+            return web.Response(status=500)
+        return web.Response(text='report,{}\n'.format(request.path_qs))
+
+    app = web.Application()
+    app.router.add_get('/service/{name}', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        failed = await downloadFinanceData(code_list, base_url='http://127.0.0.1:{}'.format(port), save_dir=save_dir,
+                                           rate=RATE, capacity=1, concurrency=4, retries=retries)
+    finally:
+        await runner.cleanup()
+    return failed, requests
+
+
+def makeDirs(save_dir, skip=()):
+    for report in FINANCE_REPORTS:
+        for sub_dir in ('season', 'year'):
+            if (report, sub_dir) not in skip:
+                os.makedirs(os.path.join(save_dir, report, sub_dir))
+
+
+def test_retry_after_server_error(tmp_path):
+    save_dir = str(tmp_path)
+    makeDirs(save_dir)
+    metrics.reset()
+    failed, requests = asyncio.run(runWithStubServer(save_dir, ['000001'], {'/service/lrb_000001.html?type=year'}))
+    assert failed == []
+    assert sum(path == '/service/lrb_000001.html?type=year' for _, path in requests) == 2
+    assert metrics.counter('retries') == 1
+    assert metrics.counter('files') == 6
+    with open(os.path.join(save_dir, 'lrb', 'year', '000001.csv')) as f:
+        assert f.read() == 'report,/service/lrb_000001.html?type=year\n'
+    assert not [name for _, _, names in os.walk(save_dir) for name in names if name.endswith('.part')]
+
+
+def test_rate_limit(tmp_path):
+    save_dir = str(tmp_path)
+    makeDirs(save_dir)
+    failed, requests = asyncio.run(runWithStubServer(save_dir, ['000001', '000002'], set()))
+    assert failed == []
+    assert len(requests) == 12
+    # 令牌桶容量为1时相邻两次请求至少间隔1/RATE秒（留出计时误差）
+    times = sorted(t for t, _ in requests)
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert min(gaps) >= 0.8 / RATE
+    assert times[-1] - times[0] >= 0.9 * (len(times) - 1) / RATE
+
+
+def test_write_error_does_not_abort_batch(tmp_path):
+    save_dir = str(tmp_path)
+    # xjllb/year目录不存在，写文件时抛出OSError
+    makeDirs(save_dir, skip={('xjllb', 'year')})
+    metrics.reset()
+    failed, _ = asyncio.run(runWithStubServer(save_dir, ['000001', '000002'], set()))
+    assert sorted(failed) == [('000001', 'xjllb', 'year'), ('000002', 'xjllb', 'year')]
+    assert metrics.counter('files') == 10
+    assert metrics.counter('failures') == 2
+    for code in ('000001', '000002'):
+        assert os.path.exists(os.path.join(save_dir, 'zcfzb', 'season', code + '.csv'))
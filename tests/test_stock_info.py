@@ -0,0 +1,68 @@
+import math
+import os
+
+import pandas
+import pytest
+
+from preprocess import STOCK_INFO_COLUMNS, getStockInfoAsync, parseNumber, parseStockInfoPage, readStockInfoPages
+
+"""
+    用保存下来的东方财富个股页面（tests/fixtures/sh600000.html，GBK编码）测试财务指标的解析
+    @Author: zengshuang61@gmail.com
+"""
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# 页面中浦发银行一行的数值，毛利率为'--'
+EXPECTED = [3320.14e8, 5668.52e8, 558.55e8, 5.67, 0.66, float('nan'), 37.61, 9.87]
+
+
+def assertValues(values, expected):
+    assert len(values) == len(expected)
+    for value, want in zip(values, expected):
+        if math.isnan(want):
+            assert math.isnan(value)
+        else:
+            assert value == pytest.approx(want)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('2,345.6亿', 234560000000.0),
+    ('-1.5万', -15000.0),
+    ('12.3%', 12.3),
+    (' 0.66 ', 0.66),
+    ('--', float('nan')),
+    ('-', float('nan')),
+    ('%', float('nan')),
+    ('', float('nan')),
+    ('亿', float('nan')),
+])
+def test_parse_number(text, expected):
+    assertValues([parseNumber(text)], [expected])
+
+
+def test_parse_saved_page():
+    with open(os.path.join(FIXTURE_DIR, 'sh600000.html'), 'rb') as f:
+        html = f.read().decode('gbk')
+    # 页面中cwzb之前的表格不应被解析，只取cwzb第一个tbody中公司本身一行
+    assertValues(parseStockInfoPage(html), EXPECTED)
+
+
+def test_page_without_cwzb():
+    assert parseStockInfoPage('<html><table><tbody><tr><td>1</td></tr></tbody></table></html>') is None
+    assert parseStockInfoPage('<div class="cwzb"><table><tbody><tr><td>浦发银行</td><td>1</td></tr></tbody>') is None
+
+
+def test_read_saved_pages(tmp_path):
+    # 600000在上交所，没有保存页面的股票不出现在结果中
+    rows = readStockInfoPages(['600000', '000001'], FIXTURE_DIR)
+    assert len(rows) == 1
+    assert rows[0][:2] == ['sh', '600000']
+    assertValues(rows[0][2:], EXPECTED)
+
+    fpath = str(tmp_path / 'stockInfo.csv')
+    getStockInfoAsync(['600000'], fpath=fpath, html_dir=FIXTURE_DIR)
+    df = pandas.read_csv(fpath, dtype={'代码': str})
+    assert list(df.columns) == STOCK_INFO_COLUMNS
+    assert df['代码'].tolist() == ['600000']
+    assert df['ROE(%)'].iloc[0] == pytest.approx(9.87)
+    assert math.isnan(df['毛利率(%)'].iloc[0])
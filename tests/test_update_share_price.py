@@ -0,0 +1,113 @@
+import os
+
+import numpy
+import pandas
+import pytest
+
+from preprocess import HIST_EXTRA_COLUMNS, K_DATA_COLUMNS, updateSharePrice
+
+"""
+    用本地的假数据源代替fetchSharePrice测试增量更新：降序、升序、不存在的文件，没有新数据时文件不被改写，以及复权变化后整个重写
+    @Author: zengshuang61@gmail.com
+"""
+
+CODE = '000001'
+DATES = pandas.bdate_range('2019-01-01', periods=60).strftime('%Y-%m-%d')
+
+
+class FakeSource(object):
+    """
+        与fetchSharePrice调用方式相同的假数据源：返回[start, end]之间以date为索引、降序的数据，并记录每次调用
+    """
+
+    def __init__(self, factor=1.0, empty=False):
+        rng = numpy.random.RandomState(0)
+        close = (10 + numpy.cumsum(rng.randn(len(DATES)) * 0.1)).round(2)
+        self.df = pandas.DataFrame({column: close for column in K_DATA_COLUMNS}, index=pandas.Index(DATES, name='date'))
+        self.df['volume'] = 1000.0
+        for column in HIST_EXTRA_COLUMNS:
+            self.df[column] = 1.5
+        self.df[K_DATA_COLUMNS[:4]] = (self.df[K_DATA_COLUMNS[:4]] * factor).round(2)
+        self.empty = empty
+        self.calls = []
+
+    def __call__(self, code, start, end):
+        self.calls.append((start, end))
+        if self.empty:
+            return pandas.DataFrame(columns=self.df.columns)
+        df = self.df[(self.df.index >= start) & (self.df.index <= end)]
+        return df.sort_index(ascending=False)
+
+
+def writeHistory(save_dir, source, count, ascending):
+    """
+        把假数据源的前count根K线按指定顺序写成已有的csv
+    """
+    df = source.df.iloc[:count].copy()
+    df['code'] = CODE
+    path = os.path.join(save_dir, '{}.csv'.format(CODE))
+    df.sort_index(ascending=ascending).to_csv(path)
+    return path
+
+
+def readHistory(path):
+    return pandas.read_csv(path, dtype={'code': str})
+
+
+@pytest.mark.parametrize('ascending', [False, True])
+def test_append_keeps_file_order(tmp_path, ascending):
+    source = FakeSource()
+    path = writeHistory(str(tmp_path), source, 40, ascending)
+
+    assert updateSharePrice(CODE, source=source, end=DATES[49], save_dir=str(tmp_path)) == 10
+    # 从已保存的最后一个交易日开始下载，用来核对复权价格
+    assert source.calls == [(DATES[39], DATES[49])]
+    df = readHistory(path)
+    assert df['date'].is_monotonic_increasing if ascending else df['date'].is_monotonic_decreasing
+    assert list(df['date'].sort_values()) == list(DATES[:50])
+    assert (df['code'] == CODE).all()
+    expected = source.df.iloc[:50]
+    df = df.set_index('date').sort_index()
+    numpy.testing.assert_allclose(df[expected.columns].values, expected.values)
+
+
+def test_missing_file_downloads_everything(tmp_path):
+    source = FakeSource()
+    path = os.path.join(str(tmp_path), '{}.csv'.format(CODE))
+
+    assert updateSharePrice(CODE, source=source, end=DATES[-1], save_dir=str(tmp_path)) == len(DATES)
+    df = readHistory(path)
+    assert df['date'].is_monotonic_decreasing
+    assert list(df.columns) == ['date'] + K_DATA_COLUMNS + HIST_EXTRA_COLUMNS + ['code']
+    assert len(df) == len(DATES)
+
+
+@pytest.mark.parametrize('source, end', [(FakeSource(empty=True), DATES[49]), (FakeSource(), DATES[39]),
+                                         (FakeSource(), DATES[40])],
+                         ids=['empty download', 'up to date', 'only the last saved bar'])
+def test_no_new_bars_leaves_file_untouched(tmp_path, source, end):
+    path = writeHistory(str(tmp_path), FakeSource(), 40, False)
+    # 把修改时间改到过去，改写文件一定会改变它
+    os.utime(path, ns=(10 ** 18, 10 ** 18))
+    with open(path, 'rb') as f:
+        before = f.read()
+
+    if end == DATES[40]:
+        # 数据源只有已经保存过的K线
+        source.df = source.df.iloc[:40]
+    assert updateSharePrice(CODE, source=source, end=end, save_dir=str(tmp_path)) == 0
+    with open(path, 'rb') as f:
+        assert f.read() == before
+    assert os.stat(path).st_mtime_ns == 10 ** 18
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_adjustment_change_rewrites_file(tmp_path):
+    path = writeHistory(str(tmp_path), FakeSource(), 40, True)
+    # 除权除息之后前复权价格整体改变
+    source = FakeSource(factor=0.9)
+
+    assert updateSharePrice(CODE, source=source, end=DATES[49], save_dir=str(tmp_path)) == 10
+    df = readHistory(path)
+    assert df['date'].is_monotonic_increasing
+    numpy.testing.assert_allclose(df['close'].values, source.df['close'].values[:50])